@@ -0,0 +1,633 @@
+"""
+Rimworld Mod Maker - Asset Pipeline Module
+Contains the Tk-free logic for placing texture and sound files into a mod.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as wait_futures
+
+from project import CONTENT_TYPES, ModProject
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # Only available on Windows
+    msvcrt = None
+
+
+# Content types that can carry a texture and a sound, with their display labels
+ASSET_CONTENT_TYPES = [
+    ("items", "Item"),
+    ("weapons", "Weapon"),
+    ("buildings", "Building"),
+    ("cosmetics", "Cosmetic"),
+    ("drugs", "Drug"),
+    ("workbenches", "Workbench")
+]
+
+TEXTURES_FOLDER = os.path.join("Textures", "Things")
+SOUNDS_FOLDER = "Sounds"
+
+# How assets are laid out in the mod. "shared" stores every distinct file
+# content once under a name derived from its hash and points the texPath of
+# every def using it there; "per_def" gives every def its own <defName>.png.
+ASSET_LAYOUTS = ("shared", "per_def")
+DEFAULT_ASSET_LAYOUT = "shared"
+SHARED_ASSETS_FOLDER = "Shared"
+SHARED_NAME_LENGTH = 16  # Hex digits of the content hash used in file names
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# How asset files are placed into the mod. "copy" makes an independent copy,
+# using kernel-side copies where the OS has them. "hardlink" and "reflink"
+# are meant for local builds: a hardlink shares the source file itself (or
+# its copy in the asset store), so editing either changes both, while a
+# reflink shares only the storage
+# until one of them is written (btrfs, XFS, APFS). Both fall back to a copy
+# where the filesystem cannot do them.
+COPY_MODES = ("copy", "hardlink", "reflink")
+DEFAULT_COPY_MODE = "copy"
+
+# Persistent cache of source file hashes, so that rebuilding a mod whose
+# assets did not change only needs a stat call per file. MODMAKER_CACHE_DIR
+# moves it elsewhere.
+HASH_CACHE_NAME = "asset_hashes.json"
+HASH_CACHE_VERSION = 1
+HASH_CACHE_LIMIT = 100000  # Entries kept; the ones not used by this run go first
+# Files modified this recently are hashed but not cached: another write
+# within the timestamp granularity of the filesystem (2s on FAT) would
+# leave size and mtime unchanged
+HASH_CACHE_RACY_NS = 2 * 1000 ** 3
+
+# Content-addressed copies of the assets selected in the GUI, kept next to
+# the hash cache so that a build only has to link them into the mod. Past
+# ASSET_STORE_LIMIT bytes the least recently used copies are removed; the
+# access time of a copy is set when it is used, at most once a day
+ASSET_STORE_NAME = "store"
+ASSET_STORE_LIMIT = 1024 * 1024 * 1024
+ASSET_STORE_TOUCH_SECONDS = 24 * 60 * 60
+
+# File signatures accepted for textures and sounds
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+SOUND_SIGNATURES = {".wav": (b"RIFF", 8, b"WAVE"), ".ogg": (b"OggS", None, None)}
+
+# ioctl request cloning a whole file on Linux (FICLONE from linux/fs.h)
+_FICLONE = 0x40049409
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """Hold an exclusive lock on the file at path, created if missing.
+    
+    The lock is shared with other processes and with other threads that
+    lock the same path. Without blocking, raises BlockingIOError if the
+    lock is held elsewhere.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as f:
+        if msvcrt:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        raise BlockingIOError(f"'{path}' is locked")
+                    time.sleep(0.05)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            if msvcrt:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def default_hash_cache_path():
+    """Return where the asset hash cache lives for the current user"""
+    folder = os.environ.get("MODMAKER_CACHE_DIR")
+    if not folder:
+        if os.name == "nt":
+            base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        else:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        folder = os.path.join(base, "rimworld-mod-maker")
+    return os.path.join(folder, HASH_CACHE_NAME)
+
+
+class HashCache:
+    """SHA-256 of files keyed on their path, size, mtime and inode.
+
+    A file is only read again once one of those changes. Lookups are
+    thread safe. With path set to None the cache only lives in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = self._read() if path else {}
+        self._used = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != HASH_CACHE_VERSION:
+            return {}
+        return data.get('files', {})
+
+    def sha256(self, path):
+        """Return the hex SHA-256 of a file, reading it only if it changed"""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[:3] == signature:
+                self._used.add(key)
+                self.hits += 1
+                return entry[3]
+
+        digest = file_sha256(key)
+        with self._lock:
+            self.misses += 1
+        self._store(key, stat, digest)
+        return digest
+
+    def add(self, path, sha256):
+        """Record the hash of a file written with known content"""
+        key = os.path.abspath(path)
+        self._store(key, os.stat(key), sha256)
+
+    def _store(self, key, stat, digest):
+        if time.time_ns() - stat.st_mtime_ns <= HASH_CACHE_RACY_NS:
+            return
+        with self._lock:
+            self._entries[key] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, digest]
+            self._used.add(key)
+            self._dirty = True
+
+    def save(self):
+        """Write new entries to disk, merged with those other builds saved meanwhile.
+
+        The merge holds a lock file next to the cache, so builds saving at
+        the same time do not drop each other's entries.
+        """
+        if not self.path or not self._dirty:
+            return
+        with self._lock, file_lock(f"{self.path}.lock"):
+            entries = self._read()
+            entries.update(self._entries)
+            if len(entries) > HASH_CACHE_LIMIT:
+                unused = [key for key in entries if key not in self._used]
+                for key in unused[:len(entries) - HASH_CACHE_LIMIT]:
+                    del entries[key]
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': HASH_CACHE_VERSION, 'files': entries}, f)
+            os.replace(tmp_path, self.path)
+            self._entries = entries
+            self._dirty = False
+
+
+def default_asset_store_path():
+    """Return the folder of the asset store for the current user"""
+    return os.path.join(os.path.dirname(default_hash_cache_path()), ASSET_STORE_NAME)
+
+
+def check_asset_header(path):
+    """Check that a texture or sound file starts like one.
+
+    Returns a short description such as "PNG 64x64" and raises ValueError
+    for files the game would not load.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(32)
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext in SOUND_SIGNATURES:
+        magic, offset, form = SOUND_SIGNATURES[ext]
+        if not header.startswith(magic) or (form and header[offset:offset + len(form)] != form):
+            raise ValueError(f"{os.path.basename(path)} is not a valid {ext[1:].upper()} file")
+        return ext[1:].upper()
+
+    if not header.startswith(PNG_SIGNATURE) or header[12:16] != b"IHDR":
+        raise ValueError(f"{os.path.basename(path)} is not a valid PNG file")
+    width = int.from_bytes(header[16:20], "big")
+    height = int.from_bytes(header[20:24], "big")
+    return f"PNG {width}x{height}"
+
+
+class AssetStore:
+    """Copies of asset files named after their SHA-256.
+
+    Staged copies are private to the mod maker and never edited, so builds
+    can hardlink them into a mod instead of copying the source. A copy
+    that was changed anyway no longer matches its name and is ignored.
+    evict() trims the store to limit bytes.
+    """
+
+    def __init__(self, folder, hash_cache, limit=ASSET_STORE_LIMIT):
+        self.folder = folder
+        self.hash_cache = hash_cache
+        self.limit = limit
+        self._used = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, sha256, ext):
+        return os.path.join(self.folder, sha256[:2], sha256 + ext.lower())
+
+    def stage(self, source):
+        """Hash source and add it to the store, returning its SHA-256"""
+        before = os.stat(source)
+        sha256 = self.hash_cache.sha256(source)
+        if not self.lookup(sha256, os.path.splitext(source)[1]):
+            destination = self.path_for(sha256, os.path.splitext(source)[1])
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            copy_file(source, destination, "reflink")
+            after = os.stat(source)
+            if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                os.remove(destination)
+                raise OSError(f"{os.path.basename(source)} changed while it was being staged")
+            self.hash_cache.add(destination, sha256)
+            with self._lock:
+                self._used.add(destination)
+        return sha256
+
+    def lookup(self, sha256, ext):
+        """Return the staged copy of a file with that content, or None"""
+        path = self.path_for(sha256, ext)
+        try:
+            if self.hash_cache.sha256(path) == sha256:
+                self._touch(path)
+                return path
+        except OSError:
+            pass
+        return None
+
+    def _touch(self, path):
+        # Only the access time changes, so the hash cache entry stays valid
+        with self._lock:
+            self._used.add(path)
+        stat = os.stat(path)
+        if time.time() - stat.st_atime > ASSET_STORE_TOUCH_SECONDS:
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+    def evict(self):
+        """Remove the least recently used copies while the store holds more
+        than limit bytes, keeping those used since it was opened. Returns the
+        number of bytes freed."""
+        files = []
+        for dirpath, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        freed = 0
+        with self._lock:
+            used = set(self._used)
+        for _, size, path in sorted(files):
+            if total <= self.limit:
+                break
+            if path in used:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            freed += size
+        return freed
+
+
+class AssetPrefetcher:
+    """Checks, hashes and stages asset files on a background thread.
+
+    submit() returns a future resolving to (description, SHA-256), so the
+    work is usually done by the time the mod is built.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asset-prefetch")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _prefetch(self, path):
+        description = check_asset_header(path)
+        return description, self.store.stage(path)
+
+    def submit(self, path):
+        """Queue a file, returning the future of its prefetch"""
+        with self._lock:
+            future = self._futures.get(path)
+            if future is None or future.done():
+                future = self._futures[path] = self._pool.submit(self._prefetch, path)
+            return future
+
+    def wait(self, cancel=None, progress=None):
+        """Block until every queued file is done; errors stay in their futures.
+
+        Returns early once cancel, a threading.Event, is set.
+        progress(done, total) is called as files finish.
+        """
+        with self._lock:
+            futures = list(self._futures.values())
+        pending = set(futures)
+        while pending:
+            if cancel is not None and cancel.is_set():
+                return
+            _, pending = wait_futures(pending, timeout=0.1)
+            if progress:
+                progress(len(futures) - len(pending), len(futures))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def same_content(source, destination, hash_file=file_sha256):
+    """Return True if destination exists and holds the same bytes as source"""
+    try:
+        if os.path.getsize(source) != os.path.getsize(destination):
+            return False
+    except OSError:
+        return False
+    return hash_file(source) == hash_file(destination)
+
+
+def _copy_contents(source, destination):
+    """Copy the bytes of source to destination, inside the kernel if possible.
+
+    Returns the name of the method that did the copy.
+    """
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        for method, kernel_copy in (("copy_file_range", getattr(os, "copy_file_range", None)),
+                                    ("sendfile", getattr(os, "sendfile", None))):
+            if kernel_copy is None:
+                continue
+            try:
+                copied = 0
+                while copied < size:
+                    if method == "copy_file_range":
+                        sent = kernel_copy(src.fileno(), dst.fileno(), size - copied)
+                    else:
+                        sent = kernel_copy(dst.fileno(), src.fileno(), copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied == size:
+                    return method
+            except OSError:
+                pass
+            # Start over with the next method
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+        shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+        return "read/write"
+
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def copy_file(source, destination, mode=DEFAULT_COPY_MODE):
+    """Place source at destination like shutil.copy2, replacing any existing file.
+
+    The file is written next to the destination first and moved into place,
+    so an interrupted copy never leaves a truncated asset behind. Returns
+    the method used, e.g. "copy_file_range" or "hardlink".
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode '{mode}', expected one of {', '.join(COPY_MODES)}")
+
+    tmp_path = destination + ".tmp"
+    try:
+        method = None
+        if mode == "hardlink":
+            if os.path.exists(destination) and os.path.samefile(source, destination):
+                return "hardlink"  # Linked by an earlier build
+            try:
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                os.link(source, tmp_path)
+                method = "hardlink"
+            except OSError:
+                pass  # e.g. source and mod on different filesystems
+        elif mode == "reflink":
+            try:
+                _reflink(source, tmp_path)
+                method = "reflink"
+            except OSError:
+                pass
+
+        if method is None:
+            method = _copy_contents(source, tmp_path)
+        if method != "hardlink":
+            shutil.copystat(source, tmp_path)
+        os.replace(tmp_path, destination)
+        return method
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CopyReport:
+    """Outcome of copying a set of asset files"""
+
+    def __init__(self):
+        self.copied = []   # Descriptions of the files copied
+        self.skipped = 0   # Files that were already up to date
+        self.errors = []   # (description, source, error message)
+        self.bytes_copied = 0
+        self.methods = {}  # Copy method -> number of files
+
+
+def run_copy_jobs(jobs, mod_folder, copy_one, workers=None, progress=None):
+    """Run copy_one(description, source, destination path) for every
+    (description, source, destination) job on a thread pool.
+
+    copy_one returns the copy method used, or None if it skipped the file.
+    Errors do not stop the other copies and are collected in the returned
+    CopyReport. progress(done, total, description) is called from the
+    calling thread after every job.
+    """
+    report = CopyReport()
+    # Two jobs for one destination would race; the last one wins, as it
+    # did when the files were copied one after another
+    jobs = list({destination: (description, source, destination)
+                 for description, source, destination in jobs}.values())
+    if not jobs:
+        return report
+    for directory in {os.path.dirname(destination) for _, _, destination in jobs}:
+        os.makedirs(os.path.join(mod_folder, directory), exist_ok=True)
+
+    def run(job):
+        description, source, destination = job
+        dest_path = os.path.join(mod_folder, destination)
+        method = copy_one(description, source, dest_path)
+        return method, os.path.getsize(dest_path) if method else 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            description, source, _ = futures[future]
+            try:
+                method, size = future.result()
+            except Exception as e:
+                report.errors.append((description, source, str(e)))
+            else:
+                if method is None:
+                    report.skipped += 1
+                else:
+                    report.copied.append(description)
+                    report.bytes_copied += size
+                    report.methods[method] = report.methods.get(method, 0) + 1
+            if progress:
+                progress(done, len(jobs), description)
+
+    return report
+
+
+class AssetPlan:
+    """Where every texture and sound of a project ends up in the mod.
+
+    Each source file is hashed once. hash_file can be swapped for a cached
+    implementation; it must return the hex SHA-256 of a path.
+    """
+
+    def __init__(self, project, layout=DEFAULT_ASSET_LAYOUT, hash_file=file_sha256):
+        if layout not in ASSET_LAYOUTS:
+            raise ValueError(f"Unknown asset layout '{layout}', expected one of {', '.join(ASSET_LAYOUTS)}")
+        self.project = project
+        self.layout = layout
+        self.jobs = []            # (description, source, destination), one per output file
+        self.source_hashes = {}   # Source path -> SHA-256 of its content
+        self.errors = []          # (description, source, error) for unreadable sources
+        self.texture_paths = {}   # (content type, defName) -> texPath
+        self._hash_file = hash_file
+        self._plan()
+
+    def _hash(self, description, source):
+        if source not in self.source_hashes:
+            try:
+                self.source_hashes[source] = self._hash_file(source)
+            except OSError as e:
+                self.source_hashes[source] = None
+                self.errors.append((description, source, str(e)))
+        return self.source_hashes[source]
+
+    def _plan(self):
+        destinations = set()
+
+        def add_job(description, source, destination):
+            if destination not in destinations:
+                destinations.add(destination)
+                self.jobs.append((description, source, destination))
+
+        for content_type, label in ASSET_CONTENT_TYPES:
+            for record in getattr(self.project, content_type):
+                def_name = record['defName']
+
+                texture = record.get('texture')
+                digest = texture and self._hash(f"{label} texture: {def_name}.png", texture)
+                if digest and self.layout == "per_def":
+                    add_job(f"{label} texture: {def_name}.png", texture,
+                            os.path.join(TEXTURES_FOLDER, f"{def_name}.png"))
+                elif digest:
+                    name = digest[:SHARED_NAME_LENGTH]
+                    add_job(f"Texture: {SHARED_ASSETS_FOLDER}/{name}.png", texture,
+                            os.path.join(TEXTURES_FOLDER, SHARED_ASSETS_FOLDER, f"{name}.png"))
+                    self.texture_paths[(content_type, def_name)] = f"Things/{SHARED_ASSETS_FOLDER}/{name}"
+
+                sound = record.get('sound')
+                ext = os.path.splitext(sound or "")[1]
+                digest = sound and self._hash(f"{label} sound: {def_name}{ext}", sound)
+                if digest and self.layout == "per_def":
+                    add_job(f"{label} sound: {def_name}{ext}", sound,
+                            os.path.join(SOUNDS_FOLDER, f"{def_name}{ext}"))
+                elif digest:
+                    name = digest[:SHARED_NAME_LENGTH]
+                    add_job(f"Sound: {SHARED_ASSETS_FOLDER}/{name}{ext}", sound,
+                            os.path.join(SOUNDS_FOLDER, SHARED_ASSETS_FOLDER, f"{name}{ext}"))
+
+    def apply_texture_paths(self):
+        """Return a copy of the project whose records carry their texPath.
+
+        Records without a shared texture are left as they are, so the
+        generators fall back to Things/<defName> for them.
+        """
+        if not self.texture_paths:
+            return self.project
+        content = {}
+        for content_type in CONTENT_TYPES:
+            records = getattr(self.project, content_type)
+            content[content_type] = [
+                dict(record, texPath=self.texture_paths[(content_type, record['defName'])])
+                if (content_type, record['defName']) in self.texture_paths else record
+                for record in records
+            ]
+        return ModProject(self.project.get_mod_info(), getattr(self.project, 'settings', None), **content)
+
+
+def copy_assets(project, mod_folder, mode=DEFAULT_COPY_MODE, workers=None, progress=None,
+                hash_cache=None):
+    """Copy every asset of the project into the mod folder.
+
+    Uses the per_def layout of AssetPlan, one file per def, which matches
+    XML generated without apply_texture_paths(). Destinations that already
+    hold the same bytes are left alone; pass a HashCache to avoid reading
+    unchanged files again. Returns a CopyReport.
+    """
+    hash_cache = hash_cache or HashCache()
+    asset_plan = AssetPlan(project, "per_def", hash_cache.sha256)
+    # Create textures and sounds directories
+    os.makedirs(os.path.join(mod_folder, TEXTURES_FOLDER), exist_ok=True)
+    os.makedirs(os.path.join(mod_folder, SOUNDS_FOLDER), exist_ok=True)
+
+    def copy_one(description, source, dest_path):
+        if same_content(source, dest_path, hash_cache.sha256):
+            return None
+        return copy_file(source, dest_path, mode)
+
+    report = run_copy_jobs(asset_plan.jobs, mod_folder, copy_one, workers, progress)
+    report.errors = asset_plan.errors + report.errors
+    hash_cache.save()
+    return report
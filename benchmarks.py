@@ -0,0 +1,383 @@
+"""
+Rimworld Mod Maker - Benchmark Module
+Measures how the build stages scale on synthetic projects, headlessly.
+
+    python main.py benchmark --sizes 100,1000,10000 --results results.json
+    python main.py benchmark --baseline results.json
+    python main.py benchmark --layout compact --compare-layout pretty
+
+Every measurement runs in a fresh worker process, so the peak RSS recorded
+for a stage is not inflated by the stages measured before it. Each stage
+is measured several times and the fastest run is compared, as a single
+run of a short stage is mostly noise.
+"""
+
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import struct
+import tempfile
+import time
+import wave
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from assets import AssetPlan, DEFAULT_ASSET_LAYOUT, DEFAULT_COPY_MODE
+from builder import GENERATION_STAGES, ModBuilder, run_stage, create_mod_structure
+from generators import DEFAULT_PATCH_MODE
+from project import ModProject, RESEARCH_UNLOCK_FIELDS
+
+
+# Version 2 records every run of a stage; wall_time is the fastest one
+RESULTS_VERSION = 2
+READABLE_RESULTS_VERSIONS = (1, 2)
+
+DEFAULT_SIZES = (100, 1000, 10000)
+DEFAULT_REPEATS = 3
+BENCHMARK_STAGES = [name for name, _, _, _ in GENERATION_STAGES] + ["assets"]
+
+# The assets stage gets as many distinct textures and sounds as there are
+# defs of each type, so that its output grows with the project like the
+# XML does
+DUMMY_ASSET_COUNT = 16
+DUMMY_TEXTURE_SIZE = 64
+DUMMY_SOUND_FRAMES = 441
+
+# Inline prerequisites write no patches at all, so the research_patches
+# stage is measured in this mode unless another patch mode is selected
+PATCH_STAGE_MODE = "grouped"
+
+# A stage regresses when its fastest run gets this much slower or bigger
+# than the baseline, ignoring differences below the noise floor or within
+# the spread between the fastest and the median run
+DEFAULT_TOLERANCE = 0.25
+TIME_NOISE_FLOOR = 0.05
+RSS_NOISE_FLOOR_KB = 8 * 1024
+
+# Growth exponent between two sizes above which a stage is flagged as
+# superlinear; 1.0 is linear, 2.0 quadratic
+SCALING_LIMIT = 1.5
+
+
+def write_dummy_png(path, width, height, seed=0):
+    """Write a valid RGBA PNG filled with a seed-dependent pattern"""
+    def chunk(chunk_type, data):
+        return (struct.pack(">I", len(data)) + chunk_type + data +
+                struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    row = bytes((x * 4 + seed) % 256 for x in range(width * 4))
+    raw = b"".join(b"\x00" + row for _ in range(height))
+    with open(path, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw)))
+        f.write(chunk(b"IEND", b""))
+
+
+def write_dummy_wav(path, frames=4410, seed=0):
+    """Write a short mono 16-bit WAV file"""
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(b"".join(struct.pack("<h", (i * 37 + seed) % 2000 - 1000) for i in range(frames)))
+
+
+def create_dummy_assets(folder, count=DUMMY_ASSET_COUNT):
+    """Write count dummy textures and sounds; returns (textures, sounds)"""
+    os.makedirs(folder, exist_ok=True)
+    textures, sounds = [], []
+    for i in range(count):
+        texture = os.path.join(folder, f"texture_{i}.png")
+        write_dummy_png(texture, DUMMY_TEXTURE_SIZE, DUMMY_TEXTURE_SIZE, seed=i)
+        textures.append(texture)
+        sound = os.path.join(folder, f"sound_{i}.wav")
+        write_dummy_wav(sound, DUMMY_SOUND_FRAMES, seed=i)
+        sounds.append(sound)
+    return textures, sounds
+
+
+def synthetic_project(defs_per_type, textures=(), sounds=()):
+    """Create a project with defs_per_type records of every content type.
+
+    Every thing def gets one of the given textures and every other one a
+    sound; research project i unlocks the i-th def of each thing type.
+    """
+    def assets(i):
+        return {
+            'texture': textures[i % len(textures)] if textures else None,
+            'sound': sounds[i % len(sounds)] if sounds and i % 2 else None
+        }
+
+    def text(kind, i):
+        return {
+            'defName': f"Bench{kind}{i}",
+            'label': f"benchmark {kind.lower()} {i}",
+            'description': f"Synthetic {kind.lower()} number {i} & friends, used for <benchmarks>."
+        }
+
+    n = range(defs_per_type)
+    project = ModProject(
+        {'name': f"Benchmark {defs_per_type}", 'author': "Mod Maker", 'version': "1.0.0",
+         'description': "Synthetic project for benchmarking"},
+        items=[dict(text("Item", i), marketValue=10.0 + i % 50, mass=0.5, stackLimit=75,
+                    category="ResourcesRaw", **assets(i)) for i in n],
+        weapons=[dict(text("Weapon", i), weaponType="Melee" if i % 2 else "Ranged", damage=10 + i % 20,
+                      damageType="Cut", marketValue=100.0, mass=1.5, **assets(i)) for i in n],
+        buildings=[dict(text("Building", i), size="2, 2", hitPoints=100, workToBuild=500,
+                        **assets(i)) for i in n],
+        cosmetics=[dict(text("Cosmetic", i), apparelType="Shirt", bodyParts="Torso, Legs", layer="Middle",
+                        armorSharp=0.1, armorBlunt=0.0, armorHeat=0.2, marketValue=50.0, mass=0.5,
+                        workToMake=1000, **assets(i)) for i in n],
+        drugs=[dict(text("Drug", i), marketValue=25.0, mass=0.05, nutrition=0.1 * (i % 2), joy=0.2,
+                    addictionChance=0.1, toleranceGain=0.05, duration=8.0, painReduction=0.1 * (i % 2),
+                    moodOffset=5 * (i % 3), consciousnessOffset=0.0, **assets(i)) for i in n],
+        workbenches=[dict(text("Workbench", i), sizeX=3, sizeZ=1, steelCost=100, componentCost=i % 2,
+                          marketValue=300, workToBuild=3000, workSpeedFactor=1.0, efficiencyFactor=1.0,
+                          skillRequired="Crafting", skillLevel=4, powerConsumption=50 * (i % 2),
+                          **assets(i)) for i in n],
+        research=[dict(text("Research", i), baseCost=500, techLevel="Industrial") for i in n],
+        recipes=[dict(text("Recipe", i), workAmount=100, product="Steel", productCount=1,
+                      ingredients="Steel:5, WoodLog:2") for i in n]
+    )
+
+    kinds = {"items": "Item", "weapons": "Weapon", "buildings": "Building",
+             "cosmetics": "Cosmetic", "drugs": "Drug", "workbenches": "Workbench"}
+    for i, research in enumerate(project.research):
+        for content_type, field in RESEARCH_UNLOCK_FIELDS.items():
+            research[field] = [f"Bench{kinds[content_type]}{i}"]
+    return project
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process in KiB, or None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if platform.system() == "Darwin" else peak
+
+
+def _folder_bytes(folder):
+    total, files = 0, 0
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+            files += 1
+    return total, files
+
+
+def measure_stage(stage, defs_per_type, work_folder, asset_folder, generator_options=None,
+                  copy_mode=DEFAULT_COPY_MODE, asset_layout=DEFAULT_ASSET_LAYOUT):
+    """Build a synthetic project and run one stage on it.
+
+    The assets stage hashes and places the assets the way ModBuilder.build()
+    does, with the given copy_mode and asset_layout. Meant to run in a
+    fresh worker process. Returns a result entry.
+    """
+    generator_options = dict(generator_options or {})
+    if stage == "research_patches" and generator_options.get('patch_mode', DEFAULT_PATCH_MODE) == "inline":
+        generator_options['patch_mode'] = PATCH_STAGE_MODE
+
+    textures, sounds = [], []
+    if stage == "assets":
+        textures = sorted(os.path.join(asset_folder, f) for f in os.listdir(asset_folder) if f.endswith(".png"))
+        sounds = sorted(os.path.join(asset_folder, f) for f in os.listdir(asset_folder) if f.endswith(".wav"))
+    project = synthetic_project(defs_per_type, textures, sounds)
+
+    mod_folder = os.path.join(work_folder, f"{stage}_{defs_per_type}")
+    create_mod_structure(mod_folder)
+    rss_before = peak_rss_kb()
+
+    start = time.perf_counter()
+    if stage == "assets":
+        builder = ModBuilder(project, copy_mode=copy_mode, asset_layout=asset_layout)
+        asset_plan = AssetPlan(project, asset_layout, builder.hash_cache.sha256)
+        builder.copy_assets(mod_folder, asset_plan=asset_plan)
+    else:
+        method_name, folder = next((method_name, folder) for name, _, method_name, folder in GENERATION_STAGES
+                                   if name == stage)
+        run_stage(project, method_name, os.path.join(mod_folder, folder), generator_options)
+    wall_time = time.perf_counter() - start
+
+    rss_after = peak_rss_kb()
+    output_bytes, files = _folder_bytes(mod_folder)
+    shutil.rmtree(mod_folder, ignore_errors=True)
+
+    return {
+        'stage': stage,
+        'defs_per_type': defs_per_type,
+        'wall_time': wall_time,
+        'peak_rss_kb': rss_after,
+        'rss_delta_kb': rss_after - rss_before if rss_after is not None else None,
+        'output_bytes': output_bytes,
+        'files': files
+    }
+
+
+def merge_runs(runs):
+    """Combine the result entries of repeated runs of one stage into one.
+
+    wall_time and rss_delta_kb are the lowest of all runs, the least
+    disturbed by other processes; wall_time_median and wall_times show
+    how much the runs varied.
+    """
+    result = dict(runs[0])
+    wall_times = [run['wall_time'] for run in runs]
+    result['wall_time'] = min(wall_times)
+    result['wall_time_median'] = statistics.median(wall_times)
+    result['wall_times'] = wall_times
+    rss_deltas = [run['rss_delta_kb'] for run in runs if run['rss_delta_kb'] is not None]
+    result['rss_delta_kb'] = min(rss_deltas) if rss_deltas else None
+    result['peak_rss_kb'] = min((run['peak_rss_kb'] for run in runs if run['peak_rss_kb'] is not None),
+                                default=None)
+    return result
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=None, generator_options=None, copy_mode=DEFAULT_COPY_MODE,
+                   progress=print, asset_layout=DEFAULT_ASSET_LAYOUT, repeats=DEFAULT_REPEATS):
+    """Measure every stage at every size repeats times; returns the results document"""
+    stages = stages or BENCHMARK_STAGES
+    unknown = set(stages) - set(BENCHMARK_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    if repeats < 1:
+        raise ValueError("repeats must be at least 1")
+
+    results = []
+    work_folder = tempfile.mkdtemp(prefix="modmaker_bench_")
+    try:
+        for defs_per_type in sorted(sizes):
+            asset_folder = os.path.join(work_folder, f"sources_{defs_per_type}")
+            if "assets" in stages:
+                create_dummy_assets(asset_folder, defs_per_type)
+            for stage in stages:
+                runs = []
+                for _ in range(repeats):
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        runs.append(pool.submit(measure_stage, stage, defs_per_type, work_folder, asset_folder,
+                                                generator_options, copy_mode, asset_layout).result())
+                result = merge_runs(runs)
+                results.append(result)
+                if progress:
+                    progress(format_result(result))
+            shutil.rmtree(asset_folder, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'generator_options': generator_options or {},
+        'copy_mode': copy_mode,
+        'asset_layout': asset_layout,
+        'repeats': repeats,
+        'results': results
+    }
+
+
+def format_result(result):
+    rss = f"{result['peak_rss_kb'] / 1024:.1f} MiB peak" if result['peak_rss_kb'] is not None else "RSS n/a"
+    median = result.get('wall_time_median', result['wall_time'])
+    return (f"{result['stage']:>16} x{result['defs_per_type']:<7} {result['wall_time']:8.3f}s "
+            f"(median {median:.3f}s)  "
+            f"{rss}  {result['output_bytes']} bytes in {result['files']} files")
+
+
+def save_results(document, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        document = json.load(f)
+    if document.get('version') not in READABLE_RESULTS_VERSIONS:
+        raise ValueError(f"{path} is not a benchmark results file of version "
+                         f"{', '.join(map(str, READABLE_RESULTS_VERSIONS))}")
+    return document
+
+
+def find_regressions(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare two results documents.
+
+    Returns a list of messages for stages that got slower, used more memory
+    or wrote different output than the baseline at the same size. Times
+    are compared by the fastest run; a slowdown also has to exceed the
+    noise floor and the spread of the runs of both documents.
+    """
+    def spread(result):
+        return result.get('wall_time_median', result['wall_time']) - result['wall_time']
+
+    previous = {(r['stage'], r['defs_per_type']): r for r in baseline['results']}
+    problems = []
+    for result in current['results']:
+        key = (result['stage'], result['defs_per_type'])
+        base = previous.get(key)
+        if not base:
+            continue
+        label = f"{result['stage']} x{result['defs_per_type']}"
+
+        noise = max(TIME_NOISE_FLOOR, spread(result), spread(base))
+        if (result['wall_time'] > base['wall_time'] * (1 + tolerance) and
+                result['wall_time'] - base['wall_time'] > noise):
+            problems.append(f"{label}: {base['wall_time']:.3f}s -> {result['wall_time']:.3f}s "
+                            f"(fastest of {len(result.get('wall_times', [0]))} runs)")
+
+        if (result['rss_delta_kb'] is not None and base.get('rss_delta_kb') is not None and
+                result['rss_delta_kb'] > base['rss_delta_kb'] * (1 + tolerance) and
+                result['rss_delta_kb'] - base['rss_delta_kb'] > RSS_NOISE_FLOOR_KB):
+            problems.append(f"{label}: memory {base['rss_delta_kb']} KiB -> {result['rss_delta_kb']} KiB")
+
+        if result['output_bytes'] != base['output_bytes']:
+            problems.append(f"{label}: output {base['output_bytes']} bytes -> {result['output_bytes']} bytes")
+    return problems
+
+
+def compare_results(current, other):
+    """Return one line per stage and size comparing the wall time and output
+    size of other, e.g. measured with another XML layout, to current"""
+    previous = {(r['stage'], r['defs_per_type']): r for r in other['results']}
+    lines = []
+    for result in current['results']:
+        base = previous.get((result['stage'], result['defs_per_type']))
+        if not base:
+            continue
+        size_change = ((result['output_bytes'] - base['output_bytes']) / base['output_bytes'] * 100
+                       if base['output_bytes'] else 0.0)
+        lines.append(f"{result['stage']:>16} x{result['defs_per_type']:<7} "
+                     f"{base['wall_time']:8.3f}s -> {result['wall_time']:.3f}s  "
+                     f"{base['output_bytes']} -> {result['output_bytes']} bytes ({size_change:+.1f}%)")
+    return lines
+
+
+def find_superlinear_stages(document, limit=SCALING_LIMIT):
+    """Flag stages whose wall time grows faster than n**limit between two
+    consecutive sizes, ignoring timings below the noise floor"""
+    by_stage = {}
+    for result in document['results']:
+        by_stage.setdefault(result['stage'], []).append(result)
+
+    problems = []
+    for stage, results in by_stage.items():
+        results.sort(key=lambda result: result['defs_per_type'])
+        for small, large in zip(results, results[1:]):
+            if small['wall_time'] < TIME_NOISE_FLOOR or small['defs_per_type'] == large['defs_per_type']:
+                continue
+            exponent = (math.log(large['wall_time'] / small['wall_time']) /
+                        math.log(large['defs_per_type'] / small['defs_per_type']))
+            if exponent > limit:
+                problems.append(f"{stage}: time grows as n^{exponent:.2f} from "
+                                f"{small['defs_per_type']} to {large['defs_per_type']} defs")
+    return problems
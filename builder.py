@@ -0,0 +1,726 @@
+"""
+Rimworld Mod Maker - Build Pipeline Module
+Schedules the stages of a mod build and keeps track of what each build wrote.
+"""
+
+import ctypes
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from assets import (
+    AssetPlan, HashCache, copy_file, default_hash_cache_path, file_sha256, run_copy_jobs, same_content,
+    COPY_MODES, DEFAULT_COPY_MODE, ASSET_LAYOUTS, DEFAULT_ASSET_LAYOUT
+)
+from generators import (
+    FragmentCache, XMLGenerator, GENERATOR_VERSION, DEFAULT_XML_ENGINE, DEFAULT_PATCH_MODE, DEFAULT_XML_LAYOUT,
+    count_research_patch_operations, package_id
+)
+from project import CONTENT_TYPES, THING_CONTENT_TYPES
+from dds import check_dds_format
+from textures import optimize_textures, TEXTURE_BUDGETS, TEXTURE_FORMATS, DEFAULT_TEXTURE_FORMAT
+
+
+EXECUTORS = ("thread", "process")
+
+# Independent generation stages: (stage name, content list that must be
+# non-empty for the stage to run or None, XMLGenerator method, output folder
+# relative to the mod folder). Each stage writes its own file.
+GENERATION_STAGES = [
+    ("about", None, "generate_about_xml", ""),
+    ("items", "items", "generate_items_xml", "Defs"),
+    ("weapons", "weapons", "generate_weapons_xml", "Defs"),
+    ("buildings", "buildings", "generate_buildings_xml", "Defs"),
+    ("cosmetics", "cosmetics", "generate_cosmetics_xml", "Defs"),
+    ("drugs", "drugs", "generate_drugs_xml", "Defs"),
+    ("workbenches", "workbenches", "generate_workbenches_xml", "Defs"),
+    ("research", "research", "generate_research_xml", "Defs"),
+    ("research_patches", "research", "generate_research_unlock_patches", "Patches"),
+    ("recipes", "recipes", "generate_recipes_xml", "Defs"),
+    ("language", None, "generate_language_xml", "")
+]
+
+# XMLGenerator options used unless the builder is told otherwise. Spelled
+# out so that the stage fingerprints do not depend on which were passed.
+DEFAULT_GENERATOR_OPTIONS = {
+    "engine": DEFAULT_XML_ENGINE,
+    "patch_mode": DEFAULT_PATCH_MODE,
+    "extract_parents": False,
+    "shard_defs": None,
+    "shard_bytes": None,
+    "layout": DEFAULT_XML_LAYOUT
+}
+
+# ModBuilder options for each kind of build. Release builds are for
+# players, so the XML does not need to be readable.
+BUILD_PROFILES = {
+    "dev": {"layout": "pretty"},
+    "release": {"layout": "compact"}
+}
+DEFAULT_BUILD_PROFILE = "dev"
+
+# Project data read by each stage. A stage is only rerun by an incremental
+# build when this data changes; stages not listed read their own content list.
+# ThingDefs carry the research projects that unlock them, and the research
+# patches need to know which defs are the mod's own.
+STAGE_INPUTS = {
+    "about": ("mod_info",),
+    "research_patches": ("research",) + THING_CONTENT_TYPES,
+    "language": CONTENT_TYPES
+}
+STAGE_INPUTS.update((content_type, (content_type, "research")) for content_type in THING_CONTENT_TYPES)
+
+MOD_DIRECTORIES = [
+    "About",
+    "Defs",
+    "Textures/Things",
+    "Sounds",
+    "Patches",
+    "Assemblies",
+    "Languages/English/Keyed"
+]
+
+# Written into the mod folder by every build, read back by the next one
+MANIFEST_NAME = ".modmaker_manifest.json"
+MANIFEST_VERSION = 1
+
+# Builds are written to <builds>/<mod name>-<hash of the mod folder path>/staging
+# and swapped with the mod folder once every stage is done, so a failed or
+# cancelled build changes nothing and the game can keep reading the old
+# build meanwhile. The replaced build can be kept as .../previous. <builds>
+# is BUILDS_FOLDER in the cache folder, as long as that is on the file
+# system of the mod folder, since folders cannot be renamed across file
+# systems. Otherwise it is the hidden LOCAL_BUILDS_FOLDER next to the mod
+# folder, the only place certain to be on its file system; it has no
+# About.xml, so the game does not list it as a mod
+BUILDS_FOLDER = "builds"
+LOCAL_BUILDS_FOLDER = ".modmaker_builds"
+BUILD_KEY_LENGTH = 16
+
+# renameat2(2) swaps two paths in one step; elsewhere three renames are used
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+try:
+    _renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    _renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+except (AttributeError, OSError, TypeError):
+    _renameat2 = None
+
+
+class BuildError(Exception):
+    """Raised when a build stage fails"""
+
+
+class BuildCancelled(BuildError):
+    """Raised when a build is cancelled; the mod folder is left as it was"""
+
+
+def check_cancelled(cancel):
+    """Raise BuildCancelled once cancel, a threading.Event or None, is set"""
+    if cancel is not None and cancel.is_set():
+        raise BuildCancelled("Build cancelled")
+
+
+def _device(path):
+    """Return the device of path, or of its closest existing parent"""
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+def builds_root(mod_folder):
+    """Return the folder the staging and previous builds of mod_folder go in"""
+    parent = os.path.dirname(os.path.abspath(mod_folder))
+    cache_root = os.path.join(os.path.dirname(default_hash_cache_path()), BUILDS_FOLDER)
+    if _device(cache_root) == _device(parent):
+        return cache_root
+    return os.path.join(parent, LOCAL_BUILDS_FOLDER)
+
+
+def build_folder(mod_folder, kind):
+    """Return the path of the staging or previous copy of mod_folder"""
+    mod_folder = os.path.abspath(mod_folder)
+    key = hashlib.sha256(mod_folder.encode('utf-8')).hexdigest()[:BUILD_KEY_LENGTH]
+    return os.path.join(builds_root(mod_folder), f"{os.path.basename(mod_folder)}-{key}", kind)
+
+
+def exchange_folders(first, second):
+    """Swap two existing folders, atomically where the OS supports it.
+
+    Elsewhere second is moved to <first>.swap, first to second and the swap
+    folder to first; recover_interrupted_swap() finishes or undoes this
+    when the process is killed in between.
+    """
+    if _renameat2 is not None:
+        if _renameat2(_AT_FDCWD, os.fsencode(first), _AT_FDCWD, os.fsencode(second), _RENAME_EXCHANGE) == 0:
+            return
+        # Not supported by this kernel or file system
+    swap_folder = f"{first}.swap"
+    os.rename(second, swap_folder)
+    os.rename(first, second)
+    os.rename(swap_folder, first)
+
+
+def recover_interrupted_swap(mod_folder):
+    """Clean up after exchange_folders() was killed between two renames.
+
+    After the first rename the mod folder is in the swap folder and is
+    put back. After the second the new folder is already in place, and the
+    old one is moved on from the swap folder as the exchange would have.
+    """
+    for kind in ("staging", "previous"):
+        folder = build_folder(mod_folder, kind)
+        swap_folder = f"{folder}.swap"
+        if not os.path.isdir(swap_folder):
+            continue
+        if not os.path.exists(mod_folder):
+            os.rename(swap_folder, mod_folder)
+        elif not os.path.exists(folder):
+            os.rename(swap_folder, folder)
+
+
+def replace_folder(staging_folder, mod_folder, keep_previous=False):
+    """Move a finished build into place.
+
+    The build it replaces is kept as the previous build if keep_previous
+    is set; otherwise it and any older previous build are deleted.
+    """
+    previous_folder = build_folder(mod_folder, "previous")
+    if os.path.exists(previous_folder):
+        shutil.rmtree(previous_folder)
+    os.makedirs(os.path.dirname(mod_folder) or ".", exist_ok=True)
+    if not os.path.exists(mod_folder):
+        os.rename(staging_folder, mod_folder)
+        return
+    exchange_folders(staging_folder, mod_folder)
+    if keep_previous:
+        os.rename(staging_folder, previous_folder)
+    else:
+        shutil.rmtree(staging_folder)
+
+
+def link_or_copy(source, destination, link=True):
+    """Hardlink source to destination, copying where links are unsupported.
+
+    Without link the file is always copied, e.g. into a build that is kept
+    for rollback and must not change along with the one replacing it.
+    """
+    if link:
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+
+
+def create_mod_structure(mod_folder):
+    """Create the basic mod folder structure"""
+    for directory in MOD_DIRECTORIES:
+        os.makedirs(os.path.join(mod_folder, directory), exist_ok=True)
+
+
+def create_preview_readme(mod_folder):
+    """Explain how to add a preview image, unless that was already done"""
+    about_folder = os.path.join(mod_folder, "About")
+    readme_path = os.path.join(about_folder, "README_Preview.txt")
+    if os.path.exists(readme_path) or os.path.exists(os.path.join(about_folder, "Preview.png")):
+        return
+
+    with open(readme_path, 'w', encoding='utf-8') as f:
+        f.write("To add a preview image for your mod:\n")
+        f.write("1. Create or find a 512x512 pixel PNG image\n")
+        f.write("2. Name it 'Preview.png'\n")
+        f.write("3. Replace this file with your preview image\n")
+        f.write("4. Delete this README_Preview.txt file\n")
+
+
+def profile_options(profile, **options):
+    """Return the ModBuilder options of a build profile, overridden by options"""
+    if profile not in BUILD_PROFILES:
+        raise ValueError(f"Unknown build profile '{profile}', expected one of {', '.join(BUILD_PROFILES)}")
+    return dict(BUILD_PROFILES[profile], **options)
+
+
+def run_stage(project, method_name, folder, generator_options=None, fragment_cache_path=None):
+    """Run a single generator method.
+
+    generator_options are passed on to XMLGenerator, along with a
+    FragmentCache on fragment_cache_path if given. Returns the wall time in
+    seconds, the paths of the files written, (cached, rendered) defs and
+    {path: bytes saved} by abstract parent extraction. Lives at module level
+    so that process pools can pickle it.
+    """
+    start = time.perf_counter()
+    fragment_cache = FragmentCache(fragment_cache_path) if fragment_cache_path else None
+    generator = XMLGenerator(project, fragment_cache=fragment_cache, **(generator_options or {}))
+    try:
+        getattr(generator, method_name)(folder)
+    finally:
+        if fragment_cache:
+            fragment_cache.close()
+    fragments = (fragment_cache.hits, fragment_cache.misses) if fragment_cache else (0, 0)
+    return time.perf_counter() - start, generator.written_files, fragments, generator.parent_bytes_saved
+
+
+def load_manifest(mod_folder):
+    """Return the manifest of the previous build in mod_folder, or None"""
+    try:
+        with open(os.path.join(mod_folder, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(mod_folder, manifest):
+    """Atomically write the manifest of the current build"""
+    manifest_path = os.path.join(mod_folder, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def new_manifest():
+    return {'version': MANIFEST_VERSION, 'stages': {}, 'files': {}}
+
+
+def manifest_path(mod_folder, relative_path):
+    """Turn a '/'-separated manifest key back into a filesystem path"""
+    return os.path.join(mod_folder, *relative_path.split('/'))
+
+
+def manifest_key(mod_folder, path):
+    """Turn a path inside the mod folder into a '/'-separated manifest key"""
+    return os.path.relpath(path, mod_folder).replace(os.sep, '/')
+
+
+def file_entry(path, sha256=None):
+    """Describe a file for the manifest; pass sha256 if it is already known"""
+    stat = os.stat(path)
+    return {
+        'sha256': sha256 or file_sha256(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+
+def is_unchanged_on_disk(path, entry):
+    """Check that a file still matches its manifest entry, using only stat"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == entry.get('size') and stat.st_mtime_ns == entry.get('mtime_ns')
+
+
+class BuildReport:
+    """Timing and bookkeeping information collected while building a mod"""
+
+    def __init__(self):
+        self.stage_times = {}
+        self.total_time = 0.0
+        self.skipped_stages = []
+        self.copied_assets = []
+        self.skipped_assets = 0
+        self.asset_errors = []
+        self.removed_files = []
+        self.bytes_written = 0
+        self.copy_methods = {}
+        self.hashed_assets = 0  # Files read to hash them, not found in the hash cache
+        self.optimized_textures = 0
+        self.scaled_textures = []    # (source, (width, height))
+        self.texture_bytes_saved = 0
+        self.cached_defs = 0    # Defs copied from the fragment cache
+        self.rendered_defs = 0  # Defs built and serialized with a fragment cache
+        # Manifest key -> bytes saved by moving shared fields into abstract
+        # parent defs, for the Defs files written
+        self.parent_bytes_saved = {}
+        # Patch operations, and so XPath evaluations at game load, for
+        # each research patch mode
+        self.patch_operations = {}
+
+    def slowest_stage(self):
+        """Return (stage name, seconds) of the slowest stage, or None"""
+        if not self.stage_times:
+            return None
+        return max(self.stage_times.items(), key=lambda stage: stage[1])
+
+    def format_stage_times(self):
+        """Return one human readable line per stage plus the total"""
+        lines = [f"{name}: {seconds:.3f}s" for name, seconds in self.stage_times.items()]
+        lines.extend(f"{name}: unchanged" for name in self.skipped_stages)
+        lines.append(f"total: {self.total_time:.3f}s")
+        return lines
+
+
+class ModBuilder:
+    """Builds a mod from a ModProject.
+
+    The generation stages share no state and run concurrently, so the total
+    generation time approaches that of the slowest stage. Threads are cheap
+    to start and fine for small mods; processes sidestep the GIL for large
+    ones. Assets are laid out according to asset_layout and copied on a
+    thread pool with the given copy_mode. Source hashes are looked up in
+    hash_cache, a HashCache that defaults to an in-memory one; pass a
+    persistent one to skip reading unchanged assets across builds. Assets
+    already staged in asset_store, an AssetStore, are placed from there.
+    With optimize_textures set, PNGs are repacked and scaled down to the
+    size budget of their content type first, and texture_format "dds" or
+    "dds-bc" converts them to DDS; results are cached in texture_cache.
+    With keep_previous set, the build a new one replaces is kept for
+    restore_previous(); unchanged files are then copied rather than
+    hardlinked into the new build, so that editing the new one in place
+    does not change the kept one. fragment_cache is the path of a FragmentCache that
+    lets rebuilt Defs files reuse the XML of unchanged defs. Any further
+    keyword arguments (engine, patch_mode, extract_parents, shard_defs,
+    shard_bytes, layout) are passed on to XMLGenerator.
+    """
+
+    def __init__(self, project, workers=None, executor="thread", copy_mode=DEFAULT_COPY_MODE,
+                 asset_layout=DEFAULT_ASSET_LAYOUT, hash_cache=None, asset_store=None,
+                 optimize_textures=False, texture_format=DEFAULT_TEXTURE_FORMAT, texture_cache=None,
+                 keep_previous=False, fragment_cache=None, **generator_options):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{executor}', expected one of {', '.join(EXECUTORS)}")
+        if copy_mode not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode '{copy_mode}', expected one of {', '.join(COPY_MODES)}")
+        if asset_layout not in ASSET_LAYOUTS:
+            raise ValueError(f"Unknown asset layout '{asset_layout}', expected one of {', '.join(ASSET_LAYOUTS)}")
+        if texture_format not in TEXTURE_FORMATS:
+            raise ValueError(f"Unknown texture format '{texture_format}', expected one of {', '.join(TEXTURE_FORMATS)}")
+        if texture_format != "png":
+            check_dds_format(texture_format)
+        self.generator_options = dict(DEFAULT_GENERATOR_OPTIONS, **generator_options)
+        XMLGenerator(project, **self.generator_options)  # Reject bad options before building
+        self.project = project
+        self.workers = workers
+        self.executor = executor
+        self.copy_mode = copy_mode
+        self.asset_layout = asset_layout
+        self.hash_cache = hash_cache or HashCache()
+        self.asset_store = asset_store
+        self.optimize_textures = optimize_textures
+        self.texture_format = texture_format
+        self.texture_cache = texture_cache
+        self.keep_previous = keep_previous
+        self.fragment_cache = fragment_cache
+
+    @staticmethod
+    def has_manifest(mod_folder):
+        """Return True if mod_folder holds a previous build that can be updated"""
+        return load_manifest(mod_folder) is not None
+
+    def stages(self, project=None):
+        """Return (name, method, folder) for every stage the project needs"""
+        project = project or self.project
+        return [
+            (name, method_name, folder)
+            for name, content_type, method_name, folder in GENERATION_STAGES
+            if content_type is None or getattr(project, content_type)
+        ]
+
+    def stage_fingerprint(self, name, project=None):
+        """Hash everything a stage's output depends on"""
+        project = project or self.project
+        inputs = {}
+        for key in STAGE_INPUTS.get(name, (name,)):
+            inputs[key] = project.get_mod_info() if key == "mod_info" else getattr(project, key)
+        if self.generator_options.get("extract_parents"):
+            inputs["package_id"] = package_id(project.get_mod_info())  # Part of the parent names
+        payload = json.dumps([GENERATOR_VERSION, self.generator_options, name, inputs],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def build(self, mod_folder, incremental=True, progress=None, cancel=None, stage_progress=None):
+        """Build the complete mod into mod_folder.
+
+        Every build leaves a manifest with a content hash of each file it
+        wrote. With incremental set, that manifest is used to skip stages
+        whose inputs did not change and assets whose source did not change,
+        and to drop only the outputs the new build no longer produces;
+        without it an existing mod folder is replaced as a whole.
+        progress is passed on to copy_assets; stage_progress(done, total,
+        name) is called as generation and texture stages finish. Setting
+        cancel, a threading.Event, stops the build with BuildCancelled.
+
+        The build is written to a staging folder in the cache folder, or
+        next to the folder holding mod_folder if the cache is on another
+        file system, which unchanged files are hardlinked into, and then
+        swapped in. A
+        cancelled or failed build leaves the previous one intact; with
+        keep_previous set on the builder, the build that was replaced is
+        kept for restore_previous().
+        """
+        start = time.perf_counter()
+        recover_interrupted_swap(mod_folder)
+
+        previous = load_manifest(mod_folder) if incremental else None
+        manifest = new_manifest()
+        hashed_before = self.hash_cache.misses
+        staging_folder = build_folder(mod_folder, "staging")
+        if os.path.exists(staging_folder):
+            shutil.rmtree(staging_folder)  # Left by a build that was killed
+        create_mod_structure(staging_folder)
+
+        try:
+            # Hash the asset sources first: with the shared layout the
+            # texPath of every def depends on the content of its texture
+            asset_plan = AssetPlan(self.project, self.asset_layout, self.hash_cache.sha256)
+            check_cancelled(cancel)
+            report = self.generate(mod_folder, previous, manifest, asset_plan.apply_texture_paths(),
+                                   staging_folder, cancel, stage_progress)
+            replacements = None
+            if self.optimize_textures or self.texture_format != "png":
+                if stage_progress:
+                    stage_progress(0, 1, "textures")
+                replacements = self.optimize_project_textures(asset_plan, report, cancel)
+                if stage_progress:
+                    stage_progress(1, 1, "textures")
+            self.copy_assets(mod_folder, previous, manifest, report, progress, asset_plan, replacements,
+                             staging_folder, cancel)
+            check_cancelled(cancel)
+
+            self.carry_over(mod_folder, staging_folder, previous, manifest, report)
+            create_preview_readme(staging_folder)
+            save_manifest(staging_folder, manifest)
+        except BaseException:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+            raise
+
+        replace_folder(staging_folder, mod_folder, self.keep_previous)
+        self.hash_cache.save()
+        report.hashed_assets = self.hash_cache.misses - hashed_before
+        report.total_time = time.perf_counter() - start
+        return report
+
+    @staticmethod
+    def restore_previous(mod_folder):
+        """Swap mod_folder with the build kept by build(keep_previous=True).
+
+        Calling this again undoes the restore.
+        """
+        previous_folder = build_folder(mod_folder, "previous")
+        if not os.path.isdir(previous_folder):
+            raise BuildError(f"No previous build of '{mod_folder}' was kept")
+        if os.path.exists(mod_folder):
+            exchange_folders(previous_folder, mod_folder)
+        else:
+            os.rename(previous_folder, mod_folder)
+
+    def generate(self, mod_folder, previous=None, manifest=None, project=None, output_folder=None,
+                 cancel=None, stage_progress=None):
+        """Generate all XML files into an existing mod folder structure.
+
+        project defaults to the builder's own; build() passes a copy with
+        the texPaths of the asset plan filled in. Files are written to
+        output_folder, which defaults to mod_folder and mirrors its layout.
+        """
+        project = project or self.project
+        report = BuildReport()
+        start = time.perf_counter()
+        manifest = manifest if manifest is not None else new_manifest()
+        output_folder = output_folder or mod_folder
+        create_mod_structure(output_folder)
+
+        pending = []
+        for name, method_name, folder in self.stages(project):
+            fingerprint = self.stage_fingerprint(name, project)
+            if previous and self._stage_is_current(mod_folder, previous, name, fingerprint):
+                manifest['stages'][name] = previous['stages'][name]
+                for key in previous['stages'][name]['files']:
+                    manifest['files'][key] = previous['files'][key]
+                report.skipped_stages.append(name)
+            else:
+                pending.append((name, method_name, os.path.join(output_folder, folder), fingerprint))
+
+        results = self._run_stages(pending, project)
+        try:
+            for done, (name, (seconds, written_files, (cached, rendered), parent_bytes_saved), fingerprint) \
+                    in enumerate(results, 1):
+                report.cached_defs += cached
+                report.rendered_defs += rendered
+                for path, saved in parent_bytes_saved.items():
+                    report.parent_bytes_saved[manifest_key(output_folder, path)] = saved
+                keys = []
+                for path in written_files:
+                    key = manifest_key(output_folder, path)
+                    entry = file_entry(path)
+                    previous_entry = previous['files'].get(key) if previous else None
+                    if (output_folder != mod_folder and previous_entry
+                            and previous_entry['sha256'] == entry['sha256']
+                            and is_unchanged_on_disk(manifest_path(mod_folder, key), previous_entry)):
+                        # Keep the previous file, and its mtime, so that only
+                        # files that really changed look changed, e.g. to deploy
+                        os.remove(path)
+                        link_or_copy(manifest_path(mod_folder, key), path, not self.keep_previous)
+                        entry = previous_entry
+                    else:
+                        report.bytes_written += entry['size']
+                    manifest['files'][key] = entry
+                    keys.append(key)
+                manifest['stages'][name] = {'inputs': fingerprint, 'files': keys}
+                report.stage_times[name] = seconds
+                if stage_progress:
+                    stage_progress(done, len(pending), name)
+                check_cancelled(cancel)
+        finally:
+            results.close()
+
+        if project.research:
+            report.patch_operations = count_research_patch_operations(project)
+
+        report.total_time = time.perf_counter() - start
+        return report
+
+    def _stage_is_current(self, mod_folder, previous, name, fingerprint):
+        stage = previous.get('stages', {}).get(name)
+        if not stage or stage.get('inputs') != fingerprint:
+            return False
+        return all(
+            key in previous['files'] and
+            is_unchanged_on_disk(manifest_path(mod_folder, key), previous['files'][key])
+            for key in stage['files']
+        )
+
+    def _run_stages(self, pending, project):
+        """Run (name, method, folder, fingerprint) stages, yielding their results"""
+        workers = self.workers or min(len(pending), os.cpu_count() or 1)
+
+        if workers <= 1:
+            for name, method_name, folder, fingerprint in pending:
+                try:
+                    result = run_stage(project, method_name, folder, self.generator_options, self.fragment_cache)
+                except Exception as e:
+                    raise BuildError(f"Stage '{name}' failed: {e}") from e
+                yield name, result, fingerprint
+            return
+
+        pool_class = ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            futures = [
+                (name, pool.submit(run_stage, project, method_name, folder, self.generator_options,
+                                   self.fragment_cache),
+                 fingerprint)
+                for name, method_name, folder, fingerprint in pending
+            ]
+            try:
+                for name, future, fingerprint in futures:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        raise BuildError(f"Stage '{name}' failed: {e}") from e
+                    yield name, result, fingerprint
+            finally:
+                # Do not start the remaining stages of a failed or cancelled build
+                for _, future, _ in futures:
+                    future.cancel()
+
+    def optimize_project_textures(self, asset_plan, report, cancel=None):
+        """Run the texture optimization stage on a process pool.
+
+        Returns {source: optimized copy} for copy_assets to place instead.
+        """
+        start = time.perf_counter()
+        budgets = TEXTURE_BUDGETS if self.optimize_textures else None
+        optimization = optimize_textures(self.project, asset_plan.source_hashes, self.texture_cache,
+                                         budgets, self.workers, self.texture_format, cancel)
+        check_cancelled(cancel)
+        report.optimized_textures = optimization.optimized
+        report.scaled_textures = optimization.scaled
+        report.texture_bytes_saved = optimization.bytes_saved
+        report.asset_errors.extend(optimization.errors)
+        report.stage_times['textures'] = time.perf_counter() - start
+        return optimization.replacements
+
+    def copy_assets(self, mod_folder, previous=None, manifest=None, report=None, progress=None,
+                    asset_plan=None, replacements=None, output_folder=None, cancel=None):
+        """Copy textures and sounds, skipping those already up to date.
+
+        Copies run on a thread pool; progress(done, total, description) is
+        called after each file. replacements maps sources to files to place
+        in their stead, such as optimized textures; a DDS replacement is
+        placed as .dds. Changed files are written to output_folder, which
+        defaults to mod_folder. Once cancel is set the remaining files are
+        skipped. Errors are collected in report.asset_errors.
+        """
+        manifest = manifest if manifest is not None else new_manifest()
+        output_folder = output_folder or mod_folder
+        report = report or BuildReport()
+        asset_plan = asset_plan or AssetPlan(self.project, self.asset_layout, self.hash_cache.sha256)
+        previous_files = previous['files'] if previous else {}
+        start = time.perf_counter()
+
+        def update_asset(description, source, output_path):
+            if cancel is not None and cancel.is_set():
+                return None
+            key = manifest_key(output_folder, output_path)
+            dest_path = manifest_path(mod_folder, key)
+            replacement = replacements and replacements.get(source)
+            if replacement:
+                source, source_sha256 = replacement, self.hash_cache.sha256(replacement)
+            else:
+                source_sha256 = asset_plan.source_hashes[source]
+            entry = previous_files.get(key)
+            if (entry and entry.get('source_sha256') == source_sha256 and
+                    is_unchanged_on_disk(dest_path, entry)):
+                manifest['files'][key] = entry
+                return None
+            if same_content(source, dest_path, self.hash_cache.sha256):
+                # Left by a build without a manifest, or by an earlier layout
+                manifest['files'][key] = dict(file_entry(dest_path, source_sha256), source_sha256=source_sha256)
+                return None
+
+            staged = self.asset_store and self.asset_store.lookup(source_sha256, os.path.splitext(source)[1])
+            method = copy_file(staged or source, output_path, self.copy_mode)
+            manifest['files'][key] = dict(file_entry(output_path, source_sha256), source_sha256=source_sha256)
+            return method
+
+        jobs = asset_plan.jobs
+        if replacements:
+            jobs = [
+                (description, source,
+                 os.path.splitext(destination)[0] + os.path.splitext(replacements[source])[1])
+                if source in replacements else (description, source, destination)
+                for description, source, destination in jobs
+            ]
+        copy_report = run_copy_jobs(jobs, output_folder, update_asset, progress=progress)
+
+        report.copied_assets.extend(copy_report.copied)
+        report.skipped_assets += copy_report.skipped
+        report.asset_errors.extend(asset_plan.errors + copy_report.errors)
+        report.bytes_written += copy_report.bytes_copied
+        report.copy_methods = copy_report.methods
+        report.stage_times['assets'] = time.perf_counter() - start
+        return report
+
+    def carry_over(self, mod_folder, staging_folder, previous, manifest, report):
+        """Hardlink the files this build left unchanged into staging_folder,
+        or copy them with keep_previous set.
+
+        Files the previous build wrote and this build did not are dropped
+        and listed in report.removed_files. Files the mod maker did not
+        write, such as a Preview.png, are kept on incremental builds.
+        """
+        previous_files = previous.get('files', {}) if previous else {}
+        report.removed_files.extend(key for key in previous_files if key not in manifest['files'])
+        if not os.path.isdir(mod_folder):
+            return
+
+        for directory, _, filenames in os.walk(mod_folder):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                key = manifest_key(mod_folder, path)
+                if key == MANIFEST_NAME:
+                    continue
+                if key in manifest['files'] or (previous is not None and key not in previous_files):
+                    destination = manifest_path(staging_folder, key)
+                    if not os.path.exists(destination):
+                        os.makedirs(os.path.dirname(destination), exist_ok=True)
+                        link_or_copy(path, destination, not self.keep_previous)
@@ -0,0 +1,460 @@
+"""
+Rimworld Mod Maker - Command Line Module
+Headless commands that build mods from exported project files.
+
+Nothing in here may import tkinter, directly or through tabs, managers or
+utils, so that builds run on machines without a display.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from assets import (
+    HashCache, default_hash_cache_path, COPY_MODES, DEFAULT_COPY_MODE, ASSET_LAYOUTS,
+    DEFAULT_ASSET_LAYOUT
+)
+from builder import ModBuilder, BuildError, EXECUTORS, BUILD_PROFILES, DEFAULT_BUILD_PROFILE, profile_options
+from deploy import deploy_mod
+from generators import (
+    XML_ENGINES, DEFAULT_XML_ENGINE, PATCH_MODES, DEFAULT_PATCH_MODE, XML_LAYOUTS, DEFAULT_XML_LAYOUT,
+    default_fragment_cache_path
+)
+from project import ModProject
+from textures import TextureInspector, default_texture_info_path, lint_textures, MAX_TEXTURE_SIZE, TEXTURE_FORMATS, DEFAULT_TEXTURE_FORMAT
+
+
+def build_project(project_path, output_directory, jobs=None, executor="thread", clean=False,
+                  progress=None, hash_cache_path=None, texture_warning=None, **builder_options):
+    """Build one exported project into output_directory/<mod name>.
+
+    builder_options (copy_mode, asset_layout, engine, patch_mode,
+    extract_parents, keep_previous, ...) are passed on to ModBuilder.
+    Asset hashes are cached in hash_cache_path if given, and texture
+    headers next to it. With texture_warning set, the textures are linted
+    first and texture_warning(description, source, problem) is called
+    for each problem. Returns (mod folder, BuildReport).
+    """
+    project = ModProject.load(project_path)
+
+    mod_name = project.mod_info['name'].strip()
+    if not mod_name:
+        raise BuildError(f"{project_path}: mod name is required")
+
+    mod_folder = os.path.join(output_directory, mod_name)
+    if os.path.exists(mod_folder) and not clean and not ModBuilder.has_manifest(mod_folder):
+        raise BuildError(f"'{mod_folder}' already exists and was not built by the mod maker; "
+                         f"pass --clean to replace it")
+
+    hash_cache = HashCache(hash_cache_path)
+    if texture_warning:
+        # Headers are looked up by content hash, so unchanged textures are only stat()ed
+        inspector = TextureInspector(hash_cache.sha256, default_texture_info_path() if hash_cache_path else None)
+        for problem in lint_textures(project, inspector):
+            texture_warning(*problem)
+        inspector.save()
+
+    # With clean set the existing folder is replaced as a whole, but only
+    # once the new build is complete
+    builder = ModBuilder(project, workers=jobs, executor=executor, hash_cache=hash_cache, **builder_options)
+    return mod_folder, builder.build(mod_folder, incremental=not clean, progress=progress)
+
+
+def build_command(args):
+    """python main.py build project.json --out DIR"""
+    def texture_warning(description, source, problem):
+        print(f"Warning: {description} ({source}): {problem}", file=sys.stderr)
+
+    try:
+        progress = print_progress if sys.stderr.isatty() else None
+        mod_folder, report = build_project(args.project, args.out, args.jobs, args.executor,
+                                           args.clean, progress, texture_warning=texture_warning,
+                                           **builder_options(args))
+    except (BuildError, OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Built {mod_folder}")
+    for line in report.format_stage_times():
+        print(f"  {line}")
+    methods = ", ".join(f"{count} by {method}" for method, count in sorted(report.copy_methods.items()))
+    print(f"  assets: {len(report.copied_assets)} copied{f' ({methods})' if methods else ''}, "
+          f"{report.skipped_assets} unchanged, {len(report.asset_errors)} failed, "
+          f"{report.hashed_assets} hashed")
+    if args.optimize_textures or args.texture_format != "png":
+        print(f"  textures: {report.optimized_textures} processed as {args.texture_format}, "
+              f"{len(report.scaled_textures)} scaled down, size change {-report.texture_bytes_saved:+d} bytes")
+    if report.cached_defs or report.rendered_defs:
+        print(f"  defs: {report.rendered_defs} rendered, {report.cached_defs} from the fragment cache")
+    if report.parent_bytes_saved:
+        saved = ", ".join(f"{key} {-size:+d}" for key, size in sorted(report.parent_bytes_saved.items()))
+        print(f"  parent defs: {sum(report.parent_bytes_saved.values())} bytes saved ({saved})")
+    if report.patch_operations:
+        print(f"  research patches: {report.patch_operations[args.patch_mode]} XPath evaluations "
+              f"(per_def: {report.patch_operations['per_def']}, "
+              f"grouped: {report.patch_operations['grouped']}, "
+              f"inline: {report.patch_operations['inline']})")
+    for description, source, error in report.asset_errors:
+        print(f"Warning: could not copy {description} from {source}: {error}", file=sys.stderr)
+    return 0
+
+
+def find_project_files(sources):
+    """Expand directories and glob patterns into a sorted list of project files"""
+    project_files = set()
+    for source in sources:
+        if os.path.isdir(source):
+            matches = glob.glob(os.path.join(source, "*.json"))
+        else:
+            matches = glob.glob(source)
+        if not matches:
+            raise BuildError(f"No project files found in '{source}'")
+        project_files.update(os.path.abspath(path) for path in matches)
+    return sorted(project_files)
+
+
+def batch_build_worker(project_path, output_directory, executor, clean, builder_options):
+    """Build one project of a batch and return its summary entry.
+
+    Runs in a worker process; the stages of each project run serially
+    since the batch already keeps every worker busy.
+    """
+    start = time.perf_counter()
+    result = {'project': project_path, 'mod_folder': None, 'duration': 0.0,
+              'bytes_written': 0, 'ok': False, 'error': None}
+    try:
+        mod_folder, report = build_project(project_path, output_directory, 1, executor, clean,
+                                           **builder_options)
+        result['mod_folder'] = mod_folder
+        result['bytes_written'] = report.bytes_written
+        result['skipped_stages'] = len(report.skipped_stages)
+        result['asset_errors'] = [f"{description}: {error}" for description, _, error in report.asset_errors]
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = str(e)
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+def claim_mod_folders(project_files):
+    """Return {project: error} for projects that would build into the same
+    mod folder as an earlier project of the batch"""
+    owners = {}
+    conflicts = {}
+    for project_path in project_files:
+        try:
+            mod_name = ModProject.load(project_path).mod_info['name'].strip()
+        except (OSError, ValueError):
+            continue  # Reported by the worker that tries to build it
+        if mod_name in owners:
+            conflicts[project_path] = f"mod name '{mod_name}' is also used by {owners[mod_name]}"
+        else:
+            owners[mod_name] = project_path
+    return conflicts
+
+
+def batch_command(args):
+    """python main.py batch DIR|GLOB... --out DIR --jobs N"""
+    start = time.perf_counter()
+    try:
+        project_files = find_project_files(args.projects)
+    except BuildError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    conflicts = claim_mod_folders(project_files)
+    results = [
+        {'project': project_path, 'mod_folder': None, 'duration': 0.0,
+         'bytes_written': 0, 'ok': False, 'error': error}
+        for project_path, error in conflicts.items()
+    ]
+
+    to_build = [path for path in project_files if path not in conflicts]
+    workers = args.jobs or min(len(to_build), os.cpu_count() or 1) or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(batch_build_worker, project_path, args.out, args.executor,
+                        args.clean, builder_options(args))
+            for project_path in to_build
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = "ok" if result['ok'] else f"FAILED: {result['error']}"
+            print(f"{os.path.basename(result['project'])}: {result['duration']:.2f}s, "
+                  f"{result['bytes_written']} bytes, {status}")
+
+    results.sort(key=lambda result: result['project'])
+    failures = [result for result in results if not result['ok']]
+    summary = {
+        'projects': len(results),
+        'failed': len(failures),
+        'jobs': workers,
+        'total_time': time.perf_counter() - start,
+        'bytes_written': sum(result['bytes_written'] for result in results),
+        'results': results
+    }
+
+    summary_path = args.summary or os.path.join(args.out, "batch_summary.json")
+    os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Built {len(results) - len(failures)} of {len(results)} projects "
+          f"in {summary['total_time']:.2f}s; summary written to {summary_path}")
+    for result in failures:
+        print(f"Error: {result['project']}: {result['error']}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def lint_command(args):
+    """python main.py lint project.json [--max-texture-size N]"""
+    try:
+        problems = lint_textures(ModProject.load(args.project), max_size=args.max_texture_size)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for description, source, problem in problems:
+        print(f"{description} ({source}): {problem}")
+    textures = len({source for _, source, _ in problems})
+    print(f"{len(problems)} problems in {textures} textures" if problems else "No texture problems found")
+    return 1 if problems else 0
+
+
+def deploy_command(args):
+    """python main.py deploy MOD_FOLDER --mods DIR"""
+    try:
+        report = deploy_mod(args.mod_folder, args.mods, args.copy_mode, args.keep_previous, args.clean)
+    except (BuildError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    methods = ", ".join(f"{count} by {method}" for method, count in sorted(report.copy_methods.items()))
+    print(f"Deployed {report.target} in {report.total_time:.3f}s")
+    print(f"  files: {len(report.copied)} transferred{f' ({methods})' if methods else ''}, "
+          f"{report.unchanged} unchanged, {len(report.removed)} removed, {report.bytes_copied} bytes")
+    return 0
+
+
+def rollback_command(args):
+    """python main.py rollback MOD_FOLDER"""
+    try:
+        ModBuilder.restore_previous(args.mod_folder)
+    except (BuildError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Restored the previous build of {args.mod_folder}; run rollback again to undo")
+    return 0
+
+
+def benchmark_command(args):
+    """python main.py benchmark [--sizes N,N,...] [--results FILE] [--baseline FILE] [--compare-layout LAYOUT]"""
+    import benchmarks
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(",")]
+        stages = args.stages.split(",") if args.stages else None
+        baseline = benchmarks.load_results(args.baseline) if args.baseline else None
+        document = benchmarks.run_benchmarks(sizes, stages, generator_options(args), args.copy_mode,
+                                             asset_layout=args.asset_layout, repeats=args.repeats)
+        if args.compare_layout:
+            other_options = dict(generator_options(args), layout=args.compare_layout)
+            other = benchmarks.run_benchmarks(sizes, stages, other_options, args.copy_mode,
+                                              asset_layout=args.asset_layout, repeats=args.repeats)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if args.compare_layout:
+        print(f"{args.compare_layout} -> {args.layout}:")
+        for line in benchmarks.compare_results(document, other):
+            print(line)
+
+    if args.results:
+        benchmarks.save_results(document, args.results)
+        print(f"Results written to {args.results}")
+
+    problems = benchmarks.find_superlinear_stages(document)
+    if baseline and baseline.get('generator_options') != document['generator_options']:
+        print(f"Note: the baseline was measured with {baseline.get('generator_options')}, "
+              f"not {document['generator_options']}", file=sys.stderr)
+    if baseline:
+        problems += benchmarks.find_regressions(document, baseline, args.tolerance)
+    for problem in problems:
+        print(f"Regression: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+def print_progress(done, total, description):
+    """Show asset copy progress on a single terminal line"""
+    end = "\n" if done == total else ""
+    print(f"\r  assets: {done}/{total}", end=end, file=sys.stderr, flush=True)
+
+
+def generator_options(args):
+    """Return the XMLGenerator options selected on the command line"""
+    options = {'engine': args.engine, 'patch_mode': args.patch_mode, 'extract_parents': args.extract_parents,
+               'shard_defs': args.shard_defs, 'shard_bytes': args.shard_bytes}
+    if args.layout:
+        options['layout'] = args.layout  # Otherwise up to the build profile
+    return options
+
+
+def builder_options(args):
+    """Return the ModBuilder options selected on the command line"""
+    return profile_options(args.profile, **generator_options(args), copy_mode=args.copy_mode,
+                           asset_layout=args.asset_layout,
+                           hash_cache_path=None if args.no_hash_cache else default_hash_cache_path(),
+                           optimize_textures=args.optimize_textures, texture_format=args.texture_format,
+                           keep_previous=args.keep_previous,
+                           fragment_cache=None if args.no_fragment_cache else default_fragment_cache_path())
+
+
+def add_build_options(parser):
+    """Options shared by every command that runs the build pipeline"""
+    parser.add_argument("--executor", choices=EXECUTORS, default="thread",
+                        help="run generation stages on threads or processes (default: thread)")
+    parser.add_argument("--profile", choices=BUILD_PROFILES, default=DEFAULT_BUILD_PROFILE,
+                        help="dev builds write readable XML, release builds compact XML "
+                             f"(default: {DEFAULT_BUILD_PROFILE})")
+    parser.add_argument("--engine", choices=XML_ENGINES, default=DEFAULT_XML_ENGINE,
+                        help=f"XML serialization engine (default: {DEFAULT_XML_ENGINE})")
+    parser.add_argument("--layout", choices=XML_LAYOUTS, default=None,
+                        help="indent the XML (pretty) or write it without whitespace (compact) "
+                             "(default: that of the profile)")
+    parser.add_argument("--patch-mode", choices=PATCH_MODES, default=DEFAULT_PATCH_MODE,
+                        help="write research prerequisites into the mod's own defs (inline), or "
+                             "patch them in with one operation per set of prerequisites (grouped) "
+                             f"or per unlocked def (per_def) (default: {DEFAULT_PATCH_MODE})")
+    parser.add_argument("--extract-parents", action="store_true",
+                        help="move fields that the defs of a file share into abstract parent defs, "
+                             "for smaller Defs files")
+    add_shard_options(parser)
+    parser.add_argument("--copy-mode", choices=COPY_MODES, default=DEFAULT_COPY_MODE,
+                        help="copy assets, or hardlink/reflink them for fast local builds "
+                             f"(default: {DEFAULT_COPY_MODE})")
+    parser.add_argument("--asset-layout", choices=ASSET_LAYOUTS, default=DEFAULT_ASSET_LAYOUT,
+                        help="store each distinct texture/sound once (shared) or once per def (per_def) "
+                             f"(default: {DEFAULT_ASSET_LAYOUT})")
+    parser.add_argument("--optimize-textures", action="store_true",
+                        help="repack textures losslessly and scale down those larger than the size "
+                             "budget of their content type (results are cached)")
+    parser.add_argument("--texture-format", choices=TEXTURE_FORMATS, default=DEFAULT_TEXTURE_FORMAT,
+                        help="place textures as PNG, uncompressed DDS or block compressed DDS "
+                             f"(dds-bc, needs NumPy), with mipmaps (default: {DEFAULT_TEXTURE_FORMAT})")
+    parser.add_argument("--no-hash-cache", action="store_true",
+                        help="hash every asset again instead of trusting the cached hashes of files "
+                             "whose size and modification time did not change")
+    parser.add_argument("--no-fragment-cache", action="store_true",
+                        help="build every def of a changed Defs file again instead of reusing the "
+                             "cached XML of unchanged defs")
+    parser.add_argument("--clean", action="store_true",
+                        help="replace an existing mod folder instead of updating it incrementally")
+    parser.add_argument("--keep-previous", action="store_true",
+                        help="keep the build that is replaced, for the rollback command; unchanged "
+                             "files are copied instead of hardlinked so that the kept build stays as it was")
+
+
+def add_shard_options(parser):
+    """Options that split large Defs files, shared with the benchmark command"""
+    parser.add_argument("--shard-defs", type=int, default=None, metavar="N",
+                        help="split each Defs file into files of at most N defs, assigned by a hash "
+                             "of their defName, so that an edit only rewrites one of them")
+    parser.add_argument("--shard-bytes", type=int, default=None, metavar="N",
+                        help="split each Defs file into files of at most N bytes of defs")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="Rimworld Mod Maker. Run without arguments to start the GUI."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build a mod from an exported project file")
+    build.add_argument("project", help="project JSON written by File > Export Mod Data")
+    build.add_argument("--out", required=True, metavar="DIR",
+                       help="output directory; the mod is written to DIR/<mod name>")
+    build.add_argument("--jobs", type=int, default=None, metavar="N",
+                       help="number of generation workers (default: one per CPU)")
+    add_build_options(build)
+    build.set_defaults(handler=build_command)
+
+    batch = commands.add_parser("batch", help="build many exported projects, one worker process each")
+    batch.add_argument("projects", nargs="+", metavar="DIR|GLOB",
+                       help="directories of project JSON files or glob patterns matching them")
+    batch.add_argument("--out", required=True, metavar="DIR",
+                       help="output directory; each mod is written to DIR/<mod name>")
+    batch.add_argument("--jobs", type=int, default=None, metavar="N",
+                       help="number of projects built at once (default: one per CPU)")
+    batch.add_argument("--summary", metavar="FILE",
+                       help="where to write the JSON summary (default: DIR/batch_summary.json)")
+    add_build_options(batch)
+    batch.set_defaults(handler=batch_command)
+
+    lint = commands.add_parser("lint", help="check the textures of an exported project file")
+    lint.add_argument("project", help="project JSON written by File > Export Mod Data")
+    lint.add_argument("--max-texture-size", type=int, default=MAX_TEXTURE_SIZE, metavar="PIXELS",
+                      help=f"largest texture side not reported as oversized (default: {MAX_TEXTURE_SIZE})")
+    lint.set_defaults(handler=lint_command)
+
+    deploy = commands.add_parser("deploy", help="sync a built mod into the game's Mods folder")
+    deploy.add_argument("mod_folder", help="the mod folder, DIR/<mod name> of the build command")
+    deploy.add_argument("--mods", required=True, metavar="DIR",
+                        help="the RimWorld Mods folder; the mod is synced to DIR/<mod name>")
+    deploy.add_argument("--copy-mode", choices=COPY_MODES, default=DEFAULT_COPY_MODE,
+                        help="copy changed files, or hardlink/reflink them from the build "
+                             f"(default: {DEFAULT_COPY_MODE})")
+    deploy.add_argument("--keep-previous", action="store_true",
+                        help="keep the deployment that is replaced, for the rollback command; unchanged "
+                             "files are copied instead of hardlinked so that the kept one stays as it was")
+    deploy.add_argument("--clean", action="store_true",
+                        help="replace a folder that was not deployed by the mod maker")
+    deploy.set_defaults(handler=deploy_command)
+
+    rollback = commands.add_parser("rollback", help="swap a mod folder with the build or deployment kept by --keep-previous")
+    rollback.add_argument("mod_folder", help="the mod folder, DIR/<mod name> of the build command")
+    rollback.set_defaults(handler=rollback_command)
+
+    benchmark = commands.add_parser("benchmark", help="measure how the build stages scale on synthetic projects")
+    benchmark.add_argument("--sizes", default="100,1000,10000", metavar="N,N,...",
+                           help="defs per content type of each synthetic project (default: 100,1000,10000)")
+    benchmark.add_argument("--stages", metavar="STAGE,...",
+                           help="stages to measure (default: every generation stage and assets)")
+    benchmark.add_argument("--results", metavar="FILE", help="write the results as JSON")
+    benchmark.add_argument("--baseline", metavar="FILE",
+                           help="flag stages slower, bigger or different than in this results file")
+    benchmark.add_argument("--tolerance", type=float, default=0.25, metavar="FRACTION",
+                           help="allowed slowdown against the baseline (default: 0.25)")
+    benchmark.add_argument("--repeats", type=int, default=3, metavar="N",
+                           help="runs per stage and size; the fastest one is compared (default: 3)")
+    benchmark.add_argument("--engine", choices=XML_ENGINES, default=DEFAULT_XML_ENGINE,
+                           help=f"XML serialization engine (default: {DEFAULT_XML_ENGINE})")
+    benchmark.add_argument("--patch-mode", choices=PATCH_MODES, default=DEFAULT_PATCH_MODE,
+                           help=f"research unlock patch mode (default: {DEFAULT_PATCH_MODE})")
+    benchmark.add_argument("--layout", choices=XML_LAYOUTS, default=DEFAULT_XML_LAYOUT,
+                           help=f"XML layout (default: {DEFAULT_XML_LAYOUT})")
+    benchmark.add_argument("--compare-layout", choices=XML_LAYOUTS, metavar="LAYOUT",
+                           help="also measure with this XML layout and compare the build time "
+                                "and output size")
+    benchmark.add_argument("--extract-parents", action="store_true",
+                           help="move shared def fields into abstract parent defs")
+    add_shard_options(benchmark)
+    benchmark.add_argument("--copy-mode", choices=COPY_MODES, default=DEFAULT_COPY_MODE,
+                           help=f"asset copy mode (default: {DEFAULT_COPY_MODE})")
+    benchmark.add_argument("--asset-layout", choices=ASSET_LAYOUTS, default=DEFAULT_ASSET_LAYOUT,
+                           help=f"asset layout (default: {DEFAULT_ASSET_LAYOUT})")
+    benchmark.set_defaults(handler=benchmark_command)
+
+    return parser
+
+
+def run_cli(argv):
+    """Parse command line arguments and run the requested command"""
+    args = create_parser().parse_args(argv)
+    return args.handler(args)
@@ -0,0 +1,237 @@
+"""
+Rimworld Mod Maker - DDS Export Module
+Converts PNG textures to DDS files with a full mipmap chain, which the game
+can upload without decoding a PNG first. Uncompressed RGBA8 works
+everywhere; block compression (BC1/BC3) needs NumPy.
+"""
+
+import os
+import struct
+
+from textures import read_png_rgba, _downscale
+
+try:
+    import numpy
+except ImportError:  # Block compression is unavailable without it
+    numpy = None
+
+
+# "dds" is uncompressed RGBA8. "dds-bc" uses BC1 for opaque textures and
+# BC3 for textures with transparency, at 1/8 and 1/4 of the size.
+DDS_FORMATS = ("dds", "dds-bc")
+
+# RimWorld reads DDS rows bottom to top, like the textures Unity uploads
+FLIP_VERTICALLY = True
+
+_DDSD_CAPS = 0x1
+_DDSD_HEIGHT = 0x2
+_DDSD_WIDTH = 0x4
+_DDSD_PITCH = 0x8
+_DDSD_PIXELFORMAT = 0x1000
+_DDSD_MIPMAPCOUNT = 0x20000
+_DDSD_LINEARSIZE = 0x80000
+_DDPF_ALPHAPIXELS = 0x1
+_DDPF_FOURCC = 0x4
+_DDPF_RGB = 0x40
+_DDSCAPS_COMPLEX = 0x8
+_DDSCAPS_TEXTURE = 0x1000
+_DDSCAPS_MIPMAP = 0x400000
+
+# Magic, the 124 byte DDS_HEADER with its 32 byte DDS_PIXELFORMAT
+_HEADER = struct.Struct("<4s7I44x2I4s5I5I")
+
+
+def check_dds_format(texture_format):
+    """Raise ValueError for formats that cannot be written here"""
+    if texture_format not in DDS_FORMATS:
+        raise ValueError(f"Unknown DDS format '{texture_format}', expected one of {', '.join(DDS_FORMATS)}")
+    if texture_format == "dds-bc" and numpy is None:
+        raise ValueError("Block compressed DDS export needs NumPy; install it or use the 'dds' format")
+
+
+def dds_header(width, height, mipmaps, fourcc=None):
+    """Return the 128 byte header of a DDS file.
+
+    Without a fourcc the pixels are 32-bit BGRA (A8R8G8B8).
+    """
+    flags = _DDSD_CAPS | _DDSD_HEIGHT | _DDSD_WIDTH | _DDSD_PIXELFORMAT | _DDSD_MIPMAPCOUNT
+    caps = _DDSCAPS_TEXTURE | (_DDSCAPS_COMPLEX | _DDSCAPS_MIPMAP if mipmaps > 1 else 0)
+    if fourcc:
+        block_size = 8 if fourcc == b"DXT1" else 16
+        pitch = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+        return _HEADER.pack(b"DDS ", 124, flags | _DDSD_LINEARSIZE, height, width, pitch, 0, mipmaps,
+                            32, _DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0,
+                            caps, 0, 0, 0, 0)
+    return _HEADER.pack(b"DDS ", 124, flags | _DDSD_PITCH, height, width, width * 4, 0, mipmaps,
+                        32, _DDPF_RGB | _DDPF_ALPHAPIXELS, b"\0\0\0\0", 32,
+                        0x00FF0000, 0x0000FF00, 0x000000FF, 0xFF000000,
+                        caps, 0, 0, 0, 0)
+
+
+def mip_size(n):
+    """Return the size of the next mip level along a side of n pixels"""
+    return max(1, n // 2)
+
+
+def _half_numpy(pixels):
+    """Halve an (height, width, 4) image to mip_size() of each side with the
+    same alpha weighted box filter as textures._downscale. Odd sides drop
+    their last row/column; a side of 1 stays 1."""
+    for axis in (0, 1):
+        size = pixels.shape[axis]
+        if size == 1:
+            pixels = numpy.repeat(pixels, 2, axis=axis)
+        elif size % 2:
+            pixels = pixels[:size - 1] if axis == 0 else pixels[:, :size - 1]
+    quads = pixels.reshape(pixels.shape[0] // 2, 2, pixels.shape[1] // 2, 2, 4).astype(numpy.uint32)
+    alpha = quads[..., 3].sum(axis=(1, 3))
+    color = (quads[..., :3] * quads[..., 3:]).sum(axis=(1, 3))
+    out = numpy.zeros(alpha.shape + (4,), dtype=numpy.uint8)
+    visible = alpha > 0
+    out[visible, :3] = (color[visible] + alpha[visible, None] // 2) // alpha[visible, None]
+    out[..., 3] = (alpha + 2) // 4
+    return out
+
+
+def _half(rows, width, height):
+    """Pure Python version of _half_numpy() on RGBA rows"""
+    if height > 1:
+        rows = rows[:height - height % 2]
+    if width > 1 and width % 2:
+        width -= 1
+        rows = [row[:width * 4] for row in rows]
+    rows, _, _ = _downscale(rows, width, len(rows), 4, 3, 2)
+    return rows, mip_size(width), mip_size(height)
+
+
+def mipmap_chain(width, height, rows):
+    """Return [(width, height, RGBA rows)] from the image down to 1x1, each
+    level mip_size() of the one before as the DDS format requires"""
+    levels = [(width, height, rows)]
+    if numpy is not None:
+        pixels = numpy.frombuffer(b"".join(rows), dtype=numpy.uint8).reshape(height, width, 4)
+        while pixels.shape[0] > 1 or pixels.shape[1] > 1:
+            pixels = _half_numpy(pixels)
+            levels.append((pixels.shape[1], pixels.shape[0], [row.tobytes() for row in pixels]))
+        return levels
+    while width > 1 or height > 1:
+        rows, width, height = _half(rows, width, height)
+        levels.append((width, height, rows))
+    return levels
+
+
+def _bgra(rows):
+    data = bytearray(b"".join(rows))
+    data[0::4], data[2::4] = data[2::4], data[0::4]
+    return bytes(data)
+
+
+def _blocks(rows, width, height):
+    """Split RGBA rows into 4x4 blocks, shape (blocks, 16, 4), repeating
+    the last row and column of images that are not a multiple of 4"""
+    pixels = numpy.frombuffer(b"".join(rows), dtype=numpy.uint8).reshape(height, width, 4)
+    pixels = numpy.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    block_rows, block_columns = pixels.shape[0] // 4, pixels.shape[1] // 4
+    return pixels.reshape(block_rows, 4, block_columns, 4, 4).swapaxes(1, 2).reshape(-1, 16, 4)
+
+
+def _expand565(color):
+    r, g, b = color >> 11, (color >> 5) & 0x3F, color & 0x1F
+    return numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+
+
+def _encode_color_blocks(blocks):
+    """Encode the colour of every block in four-colour mode, returning
+    (blocks, 4) little-endian uint16 words: both endpoints and the indices"""
+    rgb = blocks[:, :, :3].astype(numpy.int32)
+    low = rgb.min(axis=1)
+    high = rgb.max(axis=1)
+    # Move the endpoints inwards a little; the extremes are rarely the best fit
+    inset = (high - low) >> 4
+    low, high = low + inset, high - inset
+
+    def pack565(color):
+        return ((color[:, 0] >> 3) << 11) | ((color[:, 1] >> 2) << 5) | (color[:, 2] >> 3)
+
+    color0, color1 = pack565(high), pack565(low)
+    # Four-colour mode needs color0 > color1
+    swap = color0 < color1
+    color0, color1 = numpy.where(swap, color1, color0), numpy.where(swap, color0, color1)
+
+    end0, end1 = _expand565(color0), _expand565(color1)
+    palette = numpy.stack([end0, end1, (2 * end0 + end1) // 3, (end0 + 2 * end1) // 3], axis=1)
+    distances = ((rgb[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    indices = distances.argmin(axis=-1).astype(numpy.uint32)
+    indices[color0 == color1] = 0  # Solid blocks; the decoder would use three-colour mode
+
+    bits = (indices << (2 * numpy.arange(16, dtype=numpy.uint32))).sum(axis=1, dtype=numpy.uint32)
+    return numpy.stack([color0, color1, bits & 0xFFFF, bits >> 16], axis=1).astype("<u2")
+
+
+def _encode_alpha_blocks(blocks):
+    """Encode the alpha of every block as BC3 alpha, returning (blocks, 8) bytes"""
+    alpha = blocks[:, :, 3].astype(numpy.int32)
+    alpha0 = alpha.max(axis=1)
+    alpha1 = alpha.min(axis=1)
+    # Eight-value mode: both endpoints and six values between them
+    steps = numpy.array([0, 7, 1, 2, 3, 4, 5, 6])  # Weight of alpha1 in sevenths, per index
+    palette = (alpha0[:, None] * (7 - steps) + alpha1[:, None] * steps) // 7
+    indices = numpy.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=-1).astype(numpy.uint64)
+    indices[alpha0 == alpha1] = 0
+
+    bits = (indices << (3 * numpy.arange(16, dtype=numpy.uint64))).sum(axis=1, dtype=numpy.uint64)
+    out = numpy.empty((len(blocks), 8), dtype=numpy.uint8)
+    out[:, 0] = alpha0
+    out[:, 1] = alpha1
+    for byte in range(6):
+        out[:, 2 + byte] = (bits >> numpy.uint64(8 * byte)) & numpy.uint64(0xFF)
+    return out
+
+
+def encode_bc(rows, width, height, with_alpha):
+    """Return the BC3 data of an image if with_alpha is set, else BC1"""
+    blocks = _blocks(rows, width, height)
+    color = _encode_color_blocks(blocks)
+    if not with_alpha:
+        return color.tobytes()
+    return numpy.concatenate([_encode_alpha_blocks(blocks), color.view(numpy.uint8)], axis=1).tobytes()
+
+
+def write_dds(source, destination, texture_format="dds", max_size=None):
+    """Convert a PNG to a DDS file with mipmaps.
+
+    Images larger than max_size are scaled down by a power of two first.
+    Returns (original size, new size, new dimensions or None if the image
+    was not scaled), like textures.optimize_png.
+    """
+    check_dds_format(texture_format)
+    width, height, rows = read_png_rgba(source)
+    scaled = None
+    factor = 1
+    while max_size and max(width, height) > max_size * factor:
+        factor *= 2
+    if factor > 1:
+        rows, width, height = _downscale(rows, width, height, 4, 3, factor)
+        scaled = (width, height)
+    if FLIP_VERTICALLY:
+        rows = rows[::-1]
+
+    levels = mipmap_chain(width, height, rows)
+    # The game only accepts block compressed textures whose size is a
+    # multiple of the 4x4 block size
+    if texture_format == "dds-bc" and not (width % 4 or height % 4):
+        with_alpha = any(b"\xff" * width != bytes(row[3::4]) for row in rows)
+        fourcc = b"DXT5" if with_alpha else b"DXT1"
+        data = [encode_bc(level_rows, level_width, level_height, with_alpha)
+                for level_width, level_height, level_rows in levels]
+    else:
+        fourcc = None
+        data = [_bgra(level_rows) for _, _, level_rows in levels]
+
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(dds_header(width, height, len(levels), fourcc))
+        for level in data:
+            f.write(level)
+    os.replace(tmp_path, destination)
+    return os.path.getsize(source), os.path.getsize(destination), scaled
@@ -0,0 +1,272 @@
+"""
+Rimworld Mod Maker - Deploy Module
+Syncs a built mod into the game's Mods folder, transferring only the files
+that changed since the last deploy.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from assets import copy_file, default_hash_cache_path, file_lock, file_sha256, run_copy_jobs, DEFAULT_COPY_MODE
+from builder import (
+    BuildCancelled, BuildError, ModBuilder, MANIFEST_NAME, build_folder, create_mod_structure, file_entry,
+    is_unchanged_on_disk, link_or_copy, load_manifest, manifest_key, manifest_path, recover_interrupted_swap,
+    replace_folder, save_manifest
+)
+
+
+# Where the GUI keeps its speculative builds, next to the asset hash cache,
+# one folder per output folder named by this many hex digits of its hash
+SHADOW_BUILD_NAME = "shadow_build"
+SHADOW_KEY_LENGTH = 16
+
+
+class DeployReport:
+    """Outcome of syncing a mod folder into a Mods directory"""
+
+    def __init__(self):
+        self.target = None
+        self.copied = []    # Keys of the files transferred
+        self.unchanged = 0  # Files linked over from the previous deployment
+        self.removed = []   # Keys of stale files the deployment no longer has
+        self.bytes_copied = 0
+        self.copy_methods = {}
+        self.total_time = 0.0
+
+
+def list_files(folder):
+    """Return {manifest key: path} for every file in folder but the manifest"""
+    files = {}
+    for directory, _, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            key = manifest_key(folder, path)
+            if key != MANIFEST_NAME:
+                files[key] = path
+    return files
+
+
+def deploy_mod(mod_folder, mods_directory, copy_mode=DEFAULT_COPY_MODE, keep_previous=False,
+               clean=False, progress=None, name=None):
+    """Sync the build in mod_folder to mods_directory/<name>, which
+    defaults to the name of mod_folder.
+
+    Like rsync, a file is only transferred if its size, modification time
+    and content hash do not all match the deployed copy. Hashes come from
+    the build manifest and from the manifest deployed with the files, so
+    unchanged files are only stat()ed. The deployment is assembled in a
+    staging folder, with unchanged files hardlinked from the current one,
+    and swapped in like a build; keep_previous keeps the replaced one for
+    ModBuilder.restore_previous(), copying unchanged files instead so that
+    the two do not share them. Only files an earlier deployment placed
+    are removed; files added to the target since, such as a Preview.png,
+    are kept unless clean is set. A target folder that was not deployed
+    by the mod maker is only replaced with clean set. progress is passed
+    on to run_copy_jobs. Returns a DeployReport.
+    """
+    start = time.perf_counter()
+    manifest = load_manifest(mod_folder)
+    if manifest is None:
+        raise BuildError(f"'{mod_folder}' has no build manifest; build it with the mod maker first")
+
+    report = DeployReport()
+    target = report.target = os.path.join(mods_directory, name or os.path.basename(os.path.normpath(mod_folder)))
+    if os.path.abspath(target) == os.path.abspath(mod_folder):
+        raise BuildError(f"'{mod_folder}' is already in '{mods_directory}'")
+    recover_interrupted_swap(target)
+    deployed_manifest = load_manifest(target)
+    if os.path.exists(target) and deployed_manifest is None and not clean:
+        raise BuildError(f"'{target}' already exists and was not deployed by the mod maker; "
+                         f"pass --clean to replace it")
+    deployed_files = deployed_manifest['files'] if deployed_manifest and not clean else {}
+
+    built_files = manifest['files']
+    target_files = {}
+
+    def sync_file(key, source, staging_path):
+        current = manifest_path(target, key)
+        entry = built_files.get(key)
+        # A build output edited since the build no longer matches its hash
+        sha256 = entry['sha256'] if entry and is_unchanged_on_disk(source, entry) else None
+        source_stat = os.stat(source)
+        try:
+            current_stat = os.stat(current) if not clean else None
+        except OSError:
+            current_stat = None
+
+        same = False
+        if current_stat and current_stat.st_size == source_stat.st_size:
+            deployed = deployed_files.get(key)
+            if current_stat.st_mtime_ns == source_stat.st_mtime_ns:
+                same = True
+            elif sha256 and deployed and deployed.get('sha256') == sha256 and is_unchanged_on_disk(current, deployed):
+                same = True
+            else:
+                sha256 = sha256 or file_sha256(source)
+                same = file_sha256(current) == sha256
+
+        if same:
+            link_or_copy(current, staging_path, not keep_previous)
+            method = None
+        else:
+            method = copy_file(source, staging_path, copy_mode)
+        # Every deployed file is recorded, so that the next deployment
+        # knows which files it may remove
+        target_files[key] = dict(entry or {}, **file_entry(staging_path, sha256))
+        return method
+
+    staging_folder = build_folder(target, "staging")
+    if os.path.exists(staging_folder):
+        shutil.rmtree(staging_folder)  # Left by a deploy that was killed
+    try:
+        create_mod_structure(staging_folder)
+        source_files = list_files(mod_folder)
+        jobs = [(key, path, key) for key, path in source_files.items()]
+        copy_report = run_copy_jobs(jobs, staging_folder, sync_file, progress=progress)
+        if copy_report.errors:
+            key, source, error = copy_report.errors[0]
+            raise BuildError(f"Could not deploy {len(copy_report.errors)} files, e.g. {key}: {error}")
+        if os.path.isdir(target) and not clean:
+            for key, path in list_files(target).items():
+                if key in source_files:
+                    continue
+                if key in deployed_files:
+                    report.removed.append(key)
+                else:
+                    # Added to the deployed mod by hand
+                    destination = manifest_path(staging_folder, key)
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    link_or_copy(path, destination, not keep_previous)
+        save_manifest(staging_folder, dict(manifest, files=target_files))
+    except BaseException:
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        raise
+
+    report.removed.sort()
+    replace_folder(staging_folder, target, keep_previous)
+
+    report.copied = sorted(copy_report.copied)
+    report.unchanged = copy_report.skipped
+    report.bytes_copied = copy_report.bytes_copied
+    report.copy_methods = copy_report.methods
+    report.total_time = time.perf_counter() - start
+    return report
+
+
+def default_shadow_build_path():
+    """Return the folder the GUI keeps its speculative builds in"""
+    return os.path.join(os.path.dirname(default_hash_cache_path()), SHADOW_BUILD_NAME)
+
+
+class ShadowBuilder:
+    """Keeps a build of the project being edited up to date in the background.
+
+    request() hands over a new snapshot; a single worker thread builds only
+    the latest one into the shadow folder of its output folder, cancelling
+    a build that a newer snapshot made obsolete. Since builds are
+    incremental, publish() then only has to bring the shadow build up to
+    date, which for a snapshot already built means checking the manifest,
+    and sync it into the output folder with deploy_mod(). Every output
+    folder has a shadow folder of its own under folder, locked while it is
+    built so that several running apps do not build into the same one.
+    A background build that fails for any other reason than being
+    cancelled or locked leaves its exception in last_error.
+    builder_options (hash_cache, asset_store, fragment_cache, ...) are
+    passed on to every ModBuilder.
+    """
+
+    def __init__(self, folder, **builder_options):
+        self.folder = folder
+        self.builder_options = builder_options
+        self._pending = None
+        self._cancel = threading.Event()
+        self._stopped = False
+        self.last_error = None
+        self._condition = threading.Condition()
+        # Held for every build of the shadow folder
+        self._build_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def shadow_folder(self, target):
+        """Return the folder target is built in before it is published"""
+        key = hashlib.sha256(os.path.abspath(target).encode('utf-8')).hexdigest()[:SHADOW_KEY_LENGTH]
+        return os.path.join(self.folder, key)
+
+    def request(self, project, target, **options):
+        """Build project for the output folder target in the background;
+        options are ModBuilder options that may change between builds, such
+        as texture_format"""
+        with self._condition:
+            self._pending = (project, target, options)
+            self._cancel.set()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                (project, target, options), self._pending = self._pending, None
+                self._cancel = cancel = threading.Event()
+            with self._build_lock:
+                try:
+                    with file_lock(self._lock_path(target), blocking=False):
+                        # One stage at a time, to leave the user's editing responsive
+                        self._build(project, target, dict(options, workers=1), cancel)
+                except BuildCancelled:
+                    continue  # A newer snapshot or publish() took over
+                except BlockingIOError:
+                    continue  # Another app is building the same output
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+            with self._condition:
+                self.last_error = error
+
+    def take_error(self):
+        """Return the exception of the last background build and forget it,
+        or None if it succeeded"""
+        with self._condition:
+            error, self.last_error = self.last_error, None
+        return error
+
+    def _lock_path(self, target):
+        return os.path.join(self.shadow_folder(target), "lock")
+
+    def _build(self, project, target, options, cancel=None, progress=None, stage_progress=None):
+        builder = ModBuilder(project, **dict(self.builder_options, **options))
+        return builder.build(os.path.join(self.shadow_folder(target), "mod"), progress=progress, cancel=cancel,
+                             stage_progress=stage_progress)
+
+    def publish(self, project, output_directory, name, keep_previous=False, clean=False,
+                progress=None, cancel=None, stage_progress=None, **options):
+        """Bring the shadow build up to date with project and sync it to
+        output_directory/<name>. Returns (BuildReport, DeployReport)."""
+        with self._condition:
+            self._pending = None
+            self._cancel.set()
+        target = os.path.join(output_directory, name)
+        with self._build_lock, file_lock(self._lock_path(target)):
+            build_report = self._build(project, target, options, cancel, progress, stage_progress)
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelled("Build cancelled")
+            # Published files are links to the shadow build, which is
+            # replaced rather than written to by later builds
+            deploy_report = deploy_mod(os.path.join(self.shadow_folder(target), "mod"), output_directory,
+                                       "hardlink", keep_previous, clean, name=name)
+        return build_report, deploy_report
+
+    def shutdown(self):
+        """Cancel the running build and stop the worker thread"""
+        with self._condition:
+            self._stopped = True
+            self._cancel.set()
+            self._condition.notify()
+        self._thread.join()
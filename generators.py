@@ -5,29 +5,705 @@ Contains all methods for generating RimWorld-compatible XML files.
 
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
+import contextlib
+import filecmp
+import hashlib
+import io
+import json
 import os
+import re
+import sqlite3
+import time
+
+from project import RESEARCH_UNLOCK_FIELDS, THING_CONTENT_TYPES, build_unlock_index
+
+
+# Bump whenever the generated XML changes for the same input, so that
+# incremental builds know their previous output is out of date.
+GENERATOR_VERSION = 3
+
+# Serialization engines understood by XMLGenerator. "stream" writes each def
+# straight to the output file; "minidom" is the original ElementTree ->
+# minidom round-trip and is kept for comparison.
+XML_ENGINES = ("stream", "minidom")
+DEFAULT_XML_ENGINE = "stream"
+
+# Whitespace written between elements, as (indent, newline). "pretty" is
+# the layout of minidom.toprettyxml; "compact" writes no whitespace the
+# game does not need, for release builds.
+XML_LAYOUTS = {
+    "pretty": ("  ", "\n"),
+    "compact": ("", "")
+}
+DEFAULT_XML_LAYOUT = "pretty"
+
+# How research unlocks reach their ThingDefs. RimWorld evaluates the XPath
+# of every patch operation against the whole combined Defs document, so
+# "inline" writes researchPrerequisites straight into the mod's own defs and
+# only patches defs from elsewhere, "grouped" patches every def with one
+# operation per set of research prerequisites, and "per_def" patches every
+# def with an operation of its own.
+PATCH_MODES = ("inline", "grouped", "per_def")
+DEFAULT_PATCH_MODE = "inline"
+
+# The serialized XML of single defs is kept in an SQLite database next to
+# the asset hash cache; past FRAGMENT_CACHE_LIMIT bytes of XML the least
+# recently used fragments are dropped
+FRAGMENT_CACHE_NAME = "def_fragments.sqlite3"
+FRAGMENT_CACHE_LIMIT = 64 * 1024 * 1024
+# Fragments are looked up this many defs at a time
+FRAGMENT_BATCH_SIZE = 500
+# The last use of a fragment is only recorded again after this many seconds,
+# so that builds of unchanged defs do not rewrite the whole table
+FRAGMENT_TOUCH_SECONDS = 24 * 60 * 60
+
+# Abstract parent defs extracted from a Defs file are named
+# <packageId>_<file name>_<hash of their content>, since parent names are
+# shared by every loaded mod. They are only made for at least
+# PARENT_MIN_GROUP defs with the same tag and parent that together shrink
+# by PARENT_MIN_SAVED bytes, as each one is resolved at game load.
+PARENT_MIN_GROUP = 2
+PARENT_MIN_SAVED = 512
+# Sharded Defs files are split by the bits of a hash of each defName, at
+# most this many times
+MAX_SHARD_BITS = 64
+
+# Def fields that RimWorld does not inherit from a parent
+_NOT_INHERITED = {"defName"}
+
+# Characters that are not allowed anywhere in an XML 1.0 document
+_INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def package_id(mod_info):
+    """Return the packageId of a mod"""
+    return f"modmaker.{(mod_info['name'] or 'mymod').lower().replace(' ', '')}"
+
+
+def own_thing_def_names(app):
+    """Return the defNames of all ThingDefs the project defines itself"""
+    return {
+        record['defName']
+        for content_type in THING_CONTENT_TYPES
+        for record in getattr(app, content_type)
+    }
+
+
+def group_research_unlocks(research_projects, exclude=()):
+    """Group unlocked defs by their research prerequisites.
+
+    Returns a list of (prerequisites, defNames); every group becomes a
+    single patch operation. Defs in exclude are left out.
+    """
+    groups = {}
+    for def_name, prerequisites in build_unlock_index(research_projects).items():
+        if def_name not in exclude:
+            groups.setdefault(tuple(prerequisites), []).append(def_name)
+    return list(groups.items())
+
+
+def count_research_patch_operations(app):
+    """Return the number of patch operations, and so of XPath evaluations
+    done by the game, for each patch mode"""
+    return {
+        "per_def": sum(
+            len(research.get(field, []))
+            for research in app.research
+            for field in RESEARCH_UNLOCK_FIELDS.values()
+        ),
+        "grouped": len(group_research_unlocks(app.research)),
+        "inline": len(group_research_unlocks(app.research, own_thing_def_names(app)))
+    }
+
+
+def _escape_xml(data):
+    """Escape character data the same way minidom does when writing"""
+    if _INVALID_XML_CHARS.search(data):
+        raise ValueError(f"Invalid XML character in {data!r}")
+    return data.replace("&", "&amp;").replace("<", "&lt;"). \
+        replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def _normalize_newlines(text):
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+@contextlib.contextmanager
+def _replace_if_changed(path):
+    """Open a temporary file for writing and move it over path afterwards.
+    
+    If path already holds exactly the same bytes the temporary file is
+    dropped instead, so unchanged outputs keep their mtime.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            yield f
+        if os.path.isfile(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def default_fragment_cache_path():
+    """Return where the def fragment cache lives for the current user"""
+    from assets import default_hash_cache_path
+    return os.path.join(os.path.dirname(default_hash_cache_path()), FRAGMENT_CACHE_NAME)
+
+
+class FragmentCache:
+    """Serialized XML of single defs, keyed by a hash of everything the def
+    is built from.
+    
+    New fragments and the use of old ones are only written back by close(),
+    which also evicts the least recently used fragments once the cache holds
+    more than limit bytes. Uses are recorded at most once a day per
+    fragment. An unreadable database disables the cache rather than failing
+    the build. Each generator stage opens its own connection.
+    """
+    
+    def __init__(self, path, limit=FRAGMENT_CACHE_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._new = {}
+        self._used = set()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._connection = sqlite3.connect(path, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS fragments "
+                                     "(key TEXT PRIMARY KEY, xml TEXT NOT NULL, "
+                                     "size INTEGER NOT NULL, used REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS fragments_used ON fragments (used)")
+            self._connection.commit()
+        except (OSError, sqlite3.Error):
+            self._connection = None
+    
+    def get_many(self, keys):
+        """Return {key: XML} for those of keys that are cached"""
+        if self._connection is None:
+            self.misses += len(keys)
+            return {}
+        found = {}
+        stale = time.time() - FRAGMENT_TOUCH_SECONDS
+        try:
+            for start in range(0, len(keys), FRAGMENT_BATCH_SIZE):
+                batch = keys[start:start + FRAGMENT_BATCH_SIZE]
+                query = f"SELECT key, xml, used FROM fragments WHERE key IN ({','.join('?' * len(batch))})"
+                for key, xml, used in self._connection.execute(query, batch):
+                    found[key] = xml
+                    if used < stale:
+                        self._used.add(key)
+        except sqlite3.Error:
+            pass
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+    
+    def put(self, key, xml):
+        """Remember the XML for key until close()"""
+        self._new[key] = xml
+    
+    def close(self):
+        """Store new fragments, mark the used ones and evict the oldest"""
+        if self._connection is None:
+            return
+        now = time.time()
+        try:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO fragments (key, xml, size, used) VALUES (?, ?, ?, ?)",
+                    ((key, xml, len(xml), now) for key, xml in self._new.items()))
+                self._connection.executemany("UPDATE fragments SET used = ? WHERE key = ?",
+                                             ((now, key) for key in self._used))
+                total = 0
+                if self._new:
+                    total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM fragments").fetchone()[0]
+                if total > self.limit:
+                    evicted = []
+                    for key, size in self._connection.execute("SELECT key, size FROM fragments ORDER BY used"):
+                        if total <= self.limit:
+                            break
+                        evicted.append((key,))
+                        total -= size
+                    self._connection.executemany("DELETE FROM fragments WHERE key = ?", evicted)
+        except sqlite3.Error:
+            pass  # Another build holds the lock for too long; the fragments are rebuilt next time
+        finally:
+            self._connection.close()
+            self._connection = None
+
+
+def render_element(elem, depth, indent="  ", newl="\n"):
+    """Serialize elem exactly as StreamXMLWriter.element() would at depth"""
+    buffer = io.StringIO()
+    StreamXMLWriter(buffer, indent, newl)._write_element(elem, indent * depth)
+    return buffer.getvalue()
+
+
+def _shard_hash(def_name):
+    return int.from_bytes(hashlib.sha256(def_name.encode('utf-8')).digest()[:MAX_SHARD_BITS // 8], 'big')
+
+
+def assign_shards(def_counts, max_defs=None, def_sizes=None, max_bytes=None):
+    """Split defNames into shards of at most max_defs defs and max_bytes bytes.
+    
+    def_counts maps each defName to the number of defs written for it,
+    def_sizes to their size in bytes. Shards are named by a prefix of the
+    bits of a hash of the defName: everything starts in shard "", and a
+    shard over a limit is split in two by the next bit, so that a def
+    stays in its shard until that shard itself grows too large. A single
+    def over a limit gets a shard of its own. Returns {prefix: [defName]}
+    with the defNames in their original order.
+    """
+    hashes = {def_name: _shard_hash(def_name) for def_name in def_counts}
+    shards = {}
+    
+    def split(prefix, def_names):
+        too_many = max_defs and sum(def_counts[def_name] for def_name in def_names) > max_defs
+        too_big = max_bytes and sum(def_sizes[def_name] for def_name in def_names) > max_bytes
+        if len(def_names) > 1 and (too_many or too_big) and len(prefix) < MAX_SHARD_BITS:
+            shift = MAX_SHARD_BITS - 1 - len(prefix)
+            for bit in (0, 1):
+                half = [def_name for def_name in def_names if (hashes[def_name] >> shift) & 1 == bit]
+                if half:
+                    split(prefix + str(bit), half)
+        else:
+            shards[prefix] = def_names
+    
+    split("", list(def_counts))
+    return dict(sorted(shards.items()))
+
+
+def _signature(elem):
+    """Return a hashable value equal for elements that serialize alike"""
+    return (elem.tag, tuple(elem.attrib.items()), elem.text, elem.tail,
+            tuple(_signature(child) for child in elem))
+
+
+def _is_compound(elem):
+    """Check whether RimWorld merges elem with the same node of a parent
+    field by field, rather than replacing it or appending to it as a list"""
+    if len(elem) == 0 or elem.attrib or (elem.text or "").strip():
+        return False
+    tags = [child.tag for child in elem]
+    return "li" not in tags and len(set(tags)) == len(tags)
+
+
+def _xml_size(text):
+    return len(text.encode('utf-8'))
+
+
+def _plan_shared(nodes, depth, exclude=(), indent="  ", newl="\n"):
+    """Find the children that all nodes, at depth, have in common.
+    
+    Children of compound nodes are compared one by one, so that a
+    statBases block can give its common stats to a parent and keep the
+    rest; lists and values are only shared when identical in every node.
+    Returns ([(child of the first node, the same child of every node,
+    plan of a compound child or None)], bytes saved by moving them).
+    """
+    plan = []
+    saved = 0
+    by_tag = []
+    for node in nodes:
+        children = {}
+        for child in node:
+            children.setdefault(child.tag, []).append(child)
+        by_tag.append(children)
+    
+    for child in nodes[0]:
+        if child.tag in exclude:
+            continue
+        matches = [children.get(child.tag, ()) for children in by_tag]
+        if any(len(found) != 1 for found in matches):
+            continue  # Missing somewhere, or a repeated tag
+        matches = [found[0] for found in matches]
+        
+        signature = _signature(child)
+        if all(_signature(match) == signature for match in matches[1:]):
+            plan.append((child, matches, None))
+            saved += (len(nodes) - 1) * _xml_size(render_element(child, depth, indent, newl))
+        elif all(_is_compound(match) for match in matches):
+            inner, inner_saved = _plan_shared(matches, depth + 1, (), indent, newl)
+            # Children left with nothing of their own drop the node, the
+            # parent gets one
+            prefix = indent * depth
+            wrapper = _xml_size(f"{prefix}<{child.tag}>{newl}{prefix}</{child.tag}>{newl}")
+            emptied = sum(1 for match in matches if len(match) == len(inner))
+            if inner and inner_saved + (emptied - 1) * wrapper > 0:
+                plan.append((child, matches, inner))
+                saved += inner_saved + (emptied - 1) * wrapper
+    return plan, saved
+
+
+def _apply_shared(nodes, plan):
+    """Remove what _plan_shared() found from nodes and return it"""
+    shared = []
+    for child, matches, inner in plan:
+        if inner is None:
+            for node, match in zip(nodes, matches):
+                node.remove(match)
+            shared.append(child)
+        else:
+            container = ET.Element(child.tag)
+            container.extend(_apply_shared(matches, inner))
+            for node, match in zip(nodes, matches):
+                if len(match) == 0:
+                    node.remove(match)
+            shared.append(container)
+    return shared
+
+
+def extract_parent_defs(defs, name, indent="  ", newl="\n"):
+    """Move the fields that defs share into Abstract="True" parent defs.
+    
+    Defs with the same tag and attributes get a parent once there are at
+    least PARENT_MIN_GROUP of them and the file shrinks by PARENT_MIN_SAVED
+    bytes. Parents are named <name>_<hash>, so name must be unique across
+    mods. Returns (parents followed by the defs, bytes saved).
+    """
+    groups = {}
+    for def_elem in defs:
+        key = (def_elem.tag, tuple(def_elem.attrib.items()))
+        groups.setdefault(key, []).append(def_elem)
+    
+    parents = []
+    total_saved = 0
+    for (tag, attrib), members in groups.items():
+        if len(members) < PARENT_MIN_GROUP:
+            continue
+        plan, saved = _plan_shared(members, 2, _NOT_INHERITED, indent, newl)
+        if not plan:
+            continue
+        
+        # Subtract the parent's own tags and the longer ParentName of every
+        # child. The parent is named after a hash of its content, but the
+        # length of the name is known up front.
+        name_size = _xml_size(f"{name}_") + 8
+        base_name = dict(attrib).get("ParentName")
+        base_attrib = f' ParentName="{_escape_xml(base_name)}"' if base_name else ""
+        saved -= _xml_size(f'{indent}<{tag} Name=""{base_attrib} Abstract="True">{newl}{indent}</{tag}>{newl}')
+        saved -= name_size
+        if base_name:
+            saved -= len(members) * (name_size - _xml_size(_escape_xml(base_name)))
+        else:
+            saved -= len(members) * (_xml_size(' ParentName=""') + name_size)
+        if saved < PARENT_MIN_SAVED:
+            continue
+        
+        shared = _apply_shared(members, plan)
+        digest = hashlib.sha256(repr([_signature(elem) for elem in shared]).encode('utf-8')).hexdigest()
+        parent_name = f"{name}_{digest[:8]}"
+        parent = ET.Element(tag, Name=parent_name)
+        if base_name:
+            parent.set("ParentName", base_name)
+        parent.set("Abstract", "True")
+        parent.extend(shared)
+        parents.append(parent)
+        for member in members:
+            member.set("ParentName", parent_name)
+        total_saved += saved
+    return parents + list(defs), total_saved
+
+
+class StreamXMLWriter:
+    """Write XML straight to a file handle.
+    
+    The layout is identical to ``minidom.toprettyxml`` for the documents the
+    generators produce, or to ``toxml`` with an empty indent and newl, but
+    elements are serialized as soon as they are handed over, so only one def
+    has to be held in memory at a time.
+    """
+    
+    def __init__(self, stream, indent="  ", newl="\n"):
+        self.stream = stream
+        self.indent = indent
+        self.newl = newl
+        self._open = []  # [tag, has_children] for each open element
+    
+    def start_document(self):
+        """Write the XML declaration"""
+        self.stream.write('<?xml version="1.0" ?>' + self.newl)
+    
+    def start(self, tag, attrib=None):
+        """Open an element whose children will be written later"""
+        self._start_children()
+        self.stream.write(self.indent * len(self._open) + "<" + tag + self._format_attrib(attrib))
+        self._open.append([tag, False])
+    
+    def end(self):
+        """Close the most recently opened element"""
+        tag, has_children = self._open.pop()
+        if has_children:
+            self.stream.write(f"{self.indent * len(self._open)}</{tag}>{self.newl}")
+        else:
+            self.stream.write("/>" + self.newl)
+    
+    def element(self, elem):
+        """Serialize a complete ElementTree element at the current depth"""
+        self._start_children()
+        self._write_element(elem, self.indent * len(self._open))
+    
+    def fragment(self, text):
+        """Write an element rendered by render_element() at the current depth"""
+        self._start_children()
+        self.stream.write(text)
+    
+    def _start_children(self):
+        """Finish the start tag of the parent once it gets its first child"""
+        if self._open and not self._open[-1][1]:
+            self.stream.write(">" + self.newl)
+            self._open[-1][1] = True
+    
+    def _format_attrib(self, attrib):
+        if not attrib:
+            return ""
+        return "".join(f' {name}="{_escape_xml(value)}"' for name, value in attrib.items())
+    
+    def _write_element(self, elem, indent):
+        write = self.stream.write
+        write(indent + "<" + elem.tag + self._format_attrib(elem.attrib))
+        
+        # Text, child elements and tails in document order. The XML parser
+        # behind minidom normalizes line endings, so do the same here.
+        nodes = []
+        if elem.text:
+            nodes.append(_normalize_newlines(elem.text))
+        for child in elem:
+            nodes.append(child)
+            if child.tail:
+                nodes.append(_normalize_newlines(child.tail))
+        
+        if not nodes:
+            write("/>" + self.newl)
+            return
+        
+        write(">")
+        if len(nodes) == 1 and isinstance(nodes[0], str):
+            write(_escape_xml(nodes[0]))
+        else:
+            write(self.newl)
+            child_indent = indent + self.indent
+            for node in nodes:
+                if isinstance(node, str):
+                    write(_escape_xml(child_indent + node + self.newl))
+                else:
+                    self._write_element(node, child_indent)
+            write(indent)
+        write(f"</{elem.tag}>{self.newl}")
 
 
 class XMLGenerator:
-    def __init__(self, app):
+    def __init__(self, app, engine=DEFAULT_XML_ENGINE, patch_mode=DEFAULT_PATCH_MODE, fragment_cache=None,
+                 extract_parents=False, shard_defs=None, shard_bytes=None, layout=DEFAULT_XML_LAYOUT):
+        if engine not in XML_ENGINES:
+            raise ValueError(f"Unknown XML engine '{engine}'")
+        if patch_mode not in PATCH_MODES:
+            raise ValueError(f"Unknown patch mode '{patch_mode}'")
+        if layout not in XML_LAYOUTS:
+            raise ValueError(f"Unknown XML layout '{layout}'")
+        if (shard_defs is not None and shard_defs < 1) or (shard_bytes is not None and shard_bytes < 1):
+            raise ValueError("Shard limits must be positive")
         self.app = app
+        self.engine = engine
+        self.patch_mode = patch_mode
+        self.layout = layout
+        self.indent, self.newl = XML_LAYOUTS[layout]
+        # A FragmentCache; with the stream engine, defs found in it are
+        # written without building them again
+        self.fragment_cache = fragment_cache
+        # Whether fields shared by the defs of a file are moved into
+        # abstract parent defs
+        self.extract_parents = extract_parents
+        # Split each Defs file into shards of at most this many defs and
+        # bytes; None for no limit
+        self.shard_defs = shard_defs
+        self.shard_bytes = shard_bytes
+        # Path -> bytes that parent extraction saved in that file
+        self.parent_bytes_saved = {}
+        # Every file written by this generator, in the order written
+        self.written_files = []
+        self._unlock_targets = None
+    
+    def _open_output(self, path):
+        """Open an output file, leaving it untouched if the content is unchanged"""
+        self.written_files.append(path)
+        return _replace_if_changed(path)
+    
+    def _write_xml(self, path, root_tag, elements):
+        """Write a document with the given root tag and child elements to path"""
+        if self.engine == "minidom":
+            root = ET.Element(root_tag)
+            root.extend(elements)
+            rough_string = ET.tostring(root, 'unicode')
+            reparsed = minidom.parseString(rough_string)
+            
+            with self._open_output(path) as f:
+                if self.layout == "compact":
+                    f.write(reparsed.toxml())
+                else:
+                    f.write(reparsed.toprettyxml(indent=self.indent))
+            return
+        
+        with self._open_output(path) as f:
+            writer = StreamXMLWriter(f, self.indent, self.newl)
+            writer.start_document()
+            writer.start(root_tag)
+            for element in elements:
+                writer.element(element)
+            writer.end()
+    
+    def _write_defs(self, path, *groups):
+        """Write a Defs file from (build method, records) groups.
+        
+        With a shard limit, the defs are spread over Name_<shard>.xml files
+        by assign_shards() instead, keeping the defs built from one record
+        together. A byte limit needs the size of every def, so the defs are
+        serialized up front and the shards are written from that XML.
+        """
+        if not self.shard_defs and not self.shard_bytes:
+            self._write_defs_file(path, groups)
+            return
+        
+        def_counts = {}
+        for build_def, records in groups:
+            for record in records:
+                def_counts[record['defName']] = def_counts.get(record['defName'], 0) + 1
+        def_sizes = rendered = None
+        if self.shard_bytes:
+            def_sizes = dict.fromkeys(def_counts, 0)
+            rendered = [list(self._rendered_defs(build_def, records)) for build_def, records in groups]
+            for (build_def, records), fragments in zip(groups, rendered):
+                for record, xml in zip(records, fragments):
+                    def_sizes[record['defName']] += len(xml.encode('utf-8'))
+        
+        shards = assign_shards(def_counts, self.shard_defs, def_sizes, self.shard_bytes)
+        shard_of = {def_name: prefix for prefix, def_names in shards.items() for def_name in def_names}
+        stem, extension = os.path.splitext(path)
+        for prefix in shards:
+            shard_groups = [(build_def, [record for record in records if shard_of[record['defName']] == prefix])
+                            for build_def, records in groups]
+            shard_fragments = rendered and [
+                xml for (build_def, records), fragments in zip(groups, rendered)
+                for record, xml in zip(records, fragments) if shard_of[record['defName']] == prefix
+            ]
+            self._write_defs_file(f"{stem}_{prefix}{extension}" if prefix else path, shard_groups,
+                                  shard_fragments)
+    
+    def _write_defs_file(self, path, groups, fragments=None):
+        """Write one Defs file from (build method, records) groups.
+        
+        Defs are built one at a time; with a fragment cache, those whose
+        record did not change are copied from the cache instead, and
+        fragments, the defs already serialized in order, are written as
+        they are. Extracting parent defs needs all defs of the file at once
+        and bypasses the fragment cache.
+        """
+        if self.extract_parents:
+            self._write_defs_with_parents(path, groups)
+            return
+        
+        if fragments is None and (self.engine == "minidom" or self.fragment_cache is None):
+            self._write_xml(path, "Defs", (build_def(record) for build_def, records in groups
+                                           for record in records))
+            return
+        
+        with self._open_output(path) as f:
+            writer = StreamXMLWriter(f, self.indent, self.newl)
+            writer.start_document()
+            writer.start("Defs")
+            if fragments is None:
+                fragments = (xml for build_def, records in groups for xml in self._rendered_defs(build_def, records))
+            for xml in fragments:
+                writer.fragment(xml)
+            writer.end()
+    
+    def _rendered_defs(self, build_def, records):
+        """Yield the serialized def of every record, from the fragment cache where possible"""
+        for start in range(0, len(records), FRAGMENT_BATCH_SIZE):
+            batch = records[start:start + FRAGMENT_BATCH_SIZE]
+            if self.fragment_cache is None:
+                cached = {}
+                keys = [None] * len(batch)
+            else:
+                keys = [self._fragment_key(build_def, record) for record in batch]
+                cached = self.fragment_cache.get_many(keys)
+            for key, record in zip(keys, batch):
+                xml = cached.get(key)
+                if xml is None:
+                    xml = render_element(build_def(record), 1, self.indent, self.newl)
+                    if self.fragment_cache is not None:
+                        self.fragment_cache.put(key, xml)
+                yield xml
+    
+    def _write_defs_with_parents(self, path, groups):
+        """Write a Defs file with shared fields moved into abstract parents"""
+        defs = [build_def(record) for build_def, records in groups for record in records]
+        # Parent names are global, so they start with the mod's packageId
+        mod_name = re.sub(r"[^A-Za-z0-9_]", "_", package_id(self.app.get_mod_info()))
+        name = f"{mod_name}_{os.path.splitext(os.path.basename(path))[0]}"
+        elements, self.parent_bytes_saved[path] = extract_parent_defs(defs, name, self.indent, self.newl)
+        self._write_xml(path, "Defs", elements)
+    
+    def _fragment_key(self, build_def, record):
+        """Hash everything the def built from record depends on"""
+        prerequisites = None
+        if self.patch_mode == "inline" and self.app.research:
+            if self._unlock_targets is None:
+                self._unlock_targets = build_unlock_index(self.app.research)
+            prerequisites = self._unlock_targets.get(record.get('defName'))
+        payload = json.dumps([GENERATOR_VERSION, build_def.__name__, self.patch_mode, self.layout, prerequisites,
+                              record],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _add_research_prerequisites(self, thing_def, def_name):
+        """Write the research projects that unlock def_name into its ThingDef.
+        
+        Only done in "inline" patch mode; the other modes add them with
+        patches instead.
+        """
+        if self.patch_mode != "inline" or not self.app.research:
+            return
+        if self._unlock_targets is None:
+            self._unlock_targets = build_unlock_index(self.app.research)
+        prerequisites = self._unlock_targets.get(def_name)
+        if not prerequisites:
+            return
+        
+        research_prerequisites = thing_def.find("researchPrerequisites")
+        if research_prerequisites is None:
+            research_prerequisites = ET.SubElement(thing_def, "researchPrerequisites")
+        existing = {li.text for li in research_prerequisites}
+        for research_defname in prerequisites:
+            if research_defname not in existing:
+                prerequisite = ET.SubElement(research_prerequisites, "li")
+                prerequisite.text = research_defname
     
     def generate_about_xml(self, mod_folder):
         """Generate About.xml file"""
+        mod_info = self.app.get_mod_info()
         root = ET.Element("ModMetaData")
         
         # Basic mod information
         name = ET.SubElement(root, "name")
-        name.text = self.app.name_entry.get() or "My Rimworld Mod"
+        name.text = mod_info['name'] or "My Rimworld Mod"
         
         author = ET.SubElement(root, "author")
-        author.text = self.app.author_entry.get() or "Unknown Author"
+        author.text = mod_info['author'] or "Unknown Author"
         
         version = ET.SubElement(root, "version")
-        version.text = self.app.version_entry.get() or "1.0.0"
+        version.text = mod_info['version'] or "1.0.0"
         
         description = ET.SubElement(root, "description")
-        description.text = self.app.description_text.get("1.0", "end-1c") or "A custom Rimworld mod."
+        description.text = mod_info['description'] or "A custom Rimworld mod."
         
         # Target version
         target_version = ET.SubElement(root, "targetVersion")
@@ -37,993 +713,973 @@ class XMLGenerator:
         dependencies = ET.SubElement(root, "modDependencies")
         
         # Package ID
-        package_id = ET.SubElement(root, "packageId")
-        package_id.text = f"modmaker.{(self.app.name_entry.get() or 'mymod').lower().replace(' ', '')}"
+        package_id_elem = ET.SubElement(root, "packageId")
+        package_id_elem.text = package_id(mod_info)
         
         # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
-        
         about_path = os.path.join(mod_folder, "About", "About.xml")
         os.makedirs(os.path.dirname(about_path), exist_ok=True)
         
-        with open(about_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        self._write_xml(about_path, root.tag, list(root))
     
     def generate_items_xml(self, defs_folder):
         """Generate ThingDefs for items"""
         if not self.app.items:
             return
         
-        root = ET.Element("Defs")
+        items_path = os.path.join(defs_folder, "Items.xml")
+        self._write_defs(items_path, (self._build_item_def, self.app.items))
+    
+    def _build_item_def(self, item):
+        """Build the ThingDef element for a single item"""
+        thing_def = ET.Element("ThingDef")
         
-        for item in self.app.items:
-            thing_def = ET.SubElement(root, "ThingDef")
-            
-            # DefName
-            defname = ET.SubElement(thing_def, "defName")
-            defname.text = item['defName']
-            
-            # Label
-            label = ET.SubElement(thing_def, "label")
-            label.text = item['label']
-            
-            # Description
-            description = ET.SubElement(thing_def, "description")
-            description.text = item['description']
-            
-            # Category
-            category = ET.SubElement(thing_def, "category")
-            category.text = item['category']
-            
-            # Thing class
-            thing_class = ET.SubElement(thing_def, "thingClass")
-            thing_class.text = "ThingWithComps"
-            
-            # Drawertype
-            drawer_type = ET.SubElement(thing_def, "drawerType")
-            drawer_type.text = "MapMeshOnly"
-            
-            # Use hit points
-            use_hit_points = ET.SubElement(thing_def, "useHitPoints")
-            use_hit_points.text = "false"
-            
-            # Selectable
-            selectable = ET.SubElement(thing_def, "selectable")
-            selectable.text = "true"
-            
-            # Rotatable
-            rotatable = ET.SubElement(thing_def, "rotatable")
-            rotatable.text = "false"
-            
-            # Stack limit
-            stack_limit = ET.SubElement(thing_def, "stackLimit")
-            stack_limit.text = str(item['stackLimit'])
-            
-            # Graphic data
-            graphic_data = ET.SubElement(thing_def, "graphicData")
-            texture_path = ET.SubElement(graphic_data, "texPath")
-            texture_path.text = f"Things/{item['defName']}"
-            graphic_class = ET.SubElement(graphic_data, "graphicClass")
-            graphic_class.text = "Graphic_StackCount"
-            
-            # Sound interact
-            if item.get('sound'):
-                sound_interact = ET.SubElement(thing_def, "soundInteract")
-                sound_interact.text = f"Standard_Drop"  # Default RimWorld sound
-            
-            # Stats
-            stat_bases = ET.SubElement(thing_def, "statBases")
-            
-            market_value = ET.SubElement(stat_bases, "MarketValue")
-            market_value.text = str(item['marketValue'])
-            
-            mass = ET.SubElement(stat_bases, "Mass")
-            mass.text = str(item['mass'])
-            
-            # Thing categories
-            thing_categories = ET.SubElement(thing_def, "thingCategories")
-            thing_category = ET.SubElement(thing_categories, "li")
-            thing_category.text = item['category']
+        # DefName
+        defname = ET.SubElement(thing_def, "defName")
+        defname.text = item['defName']
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Label
+        label = ET.SubElement(thing_def, "label")
+        label.text = item['label']
         
-        items_path = os.path.join(defs_folder, "Items.xml")
-        with open(items_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Description
+        description = ET.SubElement(thing_def, "description")
+        description.text = item['description']
+        
+        # Category
+        category = ET.SubElement(thing_def, "category")
+        category.text = item['category']
+        
+        # Thing class
+        thing_class = ET.SubElement(thing_def, "thingClass")
+        thing_class.text = "ThingWithComps"
+        
+        # Drawertype
+        drawer_type = ET.SubElement(thing_def, "drawerType")
+        drawer_type.text = "MapMeshOnly"
+        
+        # Use hit points
+        use_hit_points = ET.SubElement(thing_def, "useHitPoints")
+        use_hit_points.text = "false"
+        
+        # Selectable
+        selectable = ET.SubElement(thing_def, "selectable")
+        selectable.text = "true"
+        
+        # Rotatable
+        rotatable = ET.SubElement(thing_def, "rotatable")
+        rotatable.text = "false"
+        
+        # Stack limit
+        stack_limit = ET.SubElement(thing_def, "stackLimit")
+        stack_limit.text = str(item['stackLimit'])
+        
+        # Graphic data
+        graphic_data = ET.SubElement(thing_def, "graphicData")
+        texture_path = ET.SubElement(graphic_data, "texPath")
+        texture_path.text = item.get('texPath') or f"Things/{item['defName']}"
+        graphic_class = ET.SubElement(graphic_data, "graphicClass")
+        graphic_class.text = "Graphic_StackCount"
+        
+        # Sound interact
+        if item.get('sound'):
+            sound_interact = ET.SubElement(thing_def, "soundInteract")
+            sound_interact.text = f"Standard_Drop"  # Default RimWorld sound
+        
+        # Stats
+        stat_bases = ET.SubElement(thing_def, "statBases")
+        
+        market_value = ET.SubElement(stat_bases, "MarketValue")
+        market_value.text = str(item['marketValue'])
+        
+        mass = ET.SubElement(stat_bases, "Mass")
+        mass.text = str(item['mass'])
+        
+        # Thing categories
+        thing_categories = ET.SubElement(thing_def, "thingCategories")
+        thing_category = ET.SubElement(thing_categories, "li")
+        thing_category.text = item['category']
+        
+        self._add_research_prerequisites(thing_def, item['defName'])
+        
+        return thing_def
     
     def generate_weapons_xml(self, defs_folder):
         """Generate ThingDefs for weapons"""
         if not self.app.weapons:
             return
         
-        root = ET.Element("Defs")
+        weapons_path = os.path.join(defs_folder, "Weapons.xml")
+        self._write_defs(weapons_path, (self._build_weapon_def, self.app.weapons))
+    
+    def _build_weapon_def(self, weapon):
+        """Build the ThingDef element for a single weapon"""
+        thing_def = ET.Element("ThingDef", ParentName="BaseWeapon")
         
-        for weapon in self.app.weapons:
-            thing_def = ET.SubElement(root, "ThingDef", ParentName="BaseWeapon")
-            
-            # DefName
-            defname = ET.SubElement(thing_def, "defName")
-            defname.text = weapon['defName']
-            
-            # Label
-            label = ET.SubElement(thing_def, "label")
-            label.text = weapon['label']
-            
-            # Description
-            description = ET.SubElement(thing_def, "description")
-            description.text = weapon['description']
-            
-            # Thing class
-            if weapon['weaponType'] == "Melee":
-                thing_class = ET.SubElement(thing_def, "thingClass")
-                thing_class.text = "ThingWithComps"
-                weapon_class = "Melee"
-            else:
-                thing_class = ET.SubElement(thing_def, "thingClass")
-                thing_class.text = "ThingWithComps"
-                weapon_class = "Ranged"
-            
-            # Category
-            category = ET.SubElement(thing_def, "category")
-            category.text = "Item"
+        # DefName
+        defname = ET.SubElement(thing_def, "defName")
+        defname.text = weapon['defName']
+        
+        # Label
+        label = ET.SubElement(thing_def, "label")
+        label.text = weapon['label']
+        
+        # Description
+        description = ET.SubElement(thing_def, "description")
+        description.text = weapon['description']
+        
+        # Thing class
+        if weapon['weaponType'] == "Melee":
+            thing_class = ET.SubElement(thing_def, "thingClass")
+            thing_class.text = "ThingWithComps"
+            weapon_class = "Melee"
+        else:
+            thing_class = ET.SubElement(thing_def, "thingClass")
+            thing_class.text = "ThingWithComps"
+            weapon_class = "Ranged"
+        
+        # Category
+        category = ET.SubElement(thing_def, "category")
+        category.text = "Item"
+        
+        # Tech level
+        tech_level = ET.SubElement(thing_def, "techLevel")
+        tech_level.text = "Industrial"
+        
+        # Graphic data
+        graphic_data = ET.SubElement(thing_def, "graphicData")
+        texture_path = ET.SubElement(graphic_data, "texPath")
+        texture_path.text = weapon.get('texPath') or f"Things/{weapon['defName']}"
+        graphic_class = ET.SubElement(graphic_data, "graphicClass")
+        graphic_class.text = "Graphic_Single"
+        
+        # Sound interact
+        if weapon.get('sound'):
+            sound_interact = ET.SubElement(thing_def, "soundInteract")
+            sound_interact.text = f"Interact_BeatFire"  # Default weapon sound
+        
+        # Stats
+        stat_bases = ET.SubElement(thing_def, "statBases")
+        
+        market_value = ET.SubElement(stat_bases, "MarketValue")
+        market_value.text = str(weapon['marketValue'])
+        
+        mass = ET.SubElement(stat_bases, "Mass")
+        mass.text = str(weapon['mass'])
+        
+        # Weapon specific stats
+        if weapon['weaponType'] == "Melee":
+            melee_weapon_damage_multiplier = ET.SubElement(stat_bases, "MeleeWeapon_DamageMultiplier")
+            melee_weapon_damage_multiplier.text = "1.0"
             
-            # Tech level
-            tech_level = ET.SubElement(thing_def, "techLevel")
-            tech_level.text = "Industrial"
+            melee_weapon_cooldown = ET.SubElement(stat_bases, "MeleeWeapon_CooldownMultiplier")
+            melee_weapon_cooldown.text = "1.0"
+        
+        # Tools (for melee weapons)
+        if weapon['weaponType'] == "Melee":
+            tools = ET.SubElement(thing_def, "tools")
+            tool = ET.SubElement(tools, "li")
             
-            # Graphic data
-            graphic_data = ET.SubElement(thing_def, "graphicData")
-            texture_path = ET.SubElement(graphic_data, "texPath")
-            texture_path.text = f"Things/{weapon['defName']}"
-            graphic_class = ET.SubElement(graphic_data, "graphicClass")
-            graphic_class.text = "Graphic_Single"
+            tool_label = ET.SubElement(tool, "label")
+            tool_label.text = f"{weapon['label']} blade"
             
-            # Sound interact
-            if weapon.get('sound'):
-                sound_interact = ET.SubElement(thing_def, "soundInteract")
-                sound_interact.text = f"Interact_BeatFire"  # Default weapon sound
+            capacities = ET.SubElement(tool, "capacities")
+            capacity = ET.SubElement(capacities, "li")
+            capacity.text = "Cut" if weapon['damageType'] == "Cut" else "Blunt"
             
-            # Stats
-            stat_bases = ET.SubElement(thing_def, "statBases")
+            power = ET.SubElement(tool, "power")
+            power.text = str(weapon['damage'])
             
-            market_value = ET.SubElement(stat_bases, "MarketValue")
-            market_value.text = str(weapon['marketValue'])
+            cooldown = ET.SubElement(tool, "cooldownTime")
+            cooldown.text = "2.0"
+        
+        # Verbs (for ranged weapons)
+        if weapon['weaponType'] == "Ranged":
+            verbs = ET.SubElement(thing_def, "verbs")
+            verb = ET.SubElement(verbs, "li")
             
-            mass = ET.SubElement(stat_bases, "Mass")
-            mass.text = str(weapon['mass'])
+            verb_class = ET.SubElement(verb, "verbClass")
+            verb_class.text = "Verb_Shoot"
             
-            # Weapon specific stats
-            if weapon['weaponType'] == "Melee":
-                melee_weapon_damage_multiplier = ET.SubElement(stat_bases, "MeleeWeapon_DamageMultiplier")
-                melee_weapon_damage_multiplier.text = "1.0"
-                
-                melee_weapon_cooldown = ET.SubElement(stat_bases, "MeleeWeapon_CooldownMultiplier")
-                melee_weapon_cooldown.text = "1.0"
+            has_standard_command = ET.SubElement(verb, "hasStandardCommand")
+            has_standard_command.text = "true"
             
-            # Tools (for melee weapons)
-            if weapon['weaponType'] == "Melee":
-                tools = ET.SubElement(thing_def, "tools")
-                tool = ET.SubElement(tools, "li")
-                
-                tool_label = ET.SubElement(tool, "label")
-                tool_label.text = f"{weapon['label']} blade"
-                
-                capacities = ET.SubElement(tool, "capacities")
-                capacity = ET.SubElement(capacities, "li")
-                capacity.text = "Cut" if weapon['damageType'] == "Cut" else "Blunt"
-                
-                power = ET.SubElement(tool, "power")
-                power.text = str(weapon['damage'])
-                
-                cooldown = ET.SubElement(tool, "cooldownTime")
-                cooldown.text = "2.0"
+            default_projectile = ET.SubElement(verb, "defaultProjectile")
+            default_projectile.text = "Bullet_Rifle"
             
-            # Verbs (for ranged weapons)
-            if weapon['weaponType'] == "Ranged":
-                verbs = ET.SubElement(thing_def, "verbs")
-                verb = ET.SubElement(verbs, "li")
-                
-                verb_class = ET.SubElement(verb, "verbClass")
-                verb_class.text = "Verb_Shoot"
-                
-                has_standard_command = ET.SubElement(verb, "hasStandardCommand")
-                has_standard_command.text = "true"
-                
-                default_projectile = ET.SubElement(verb, "defaultProjectile")
-                default_projectile.text = "Bullet_Rifle"
-                
-                warmup_time = ET.SubElement(verb, "warmupTime")
-                warmup_time.text = "1.0"
-                
-                range_value = ET.SubElement(verb, "range")
-                range_value.text = "25"
-                
-                sound_cast = ET.SubElement(verb, "soundCast")
-                sound_cast.text = "Shot_AssaultRifle"
+            warmup_time = ET.SubElement(verb, "warmupTime")
+            warmup_time.text = "1.0"
             
-            # Equipment type
-            equipment_type = ET.SubElement(thing_def, "equipmentType")
-            equipment_type.text = "Primary"
+            range_value = ET.SubElement(verb, "range")
+            range_value.text = "25"
             
-            # Thing categories
-            thing_categories = ET.SubElement(thing_def, "thingCategories")
-            thing_category = ET.SubElement(thing_categories, "li")
-            thing_category.text = "WeaponsRanged" if weapon['weaponType'] == "Ranged" else "WeaponsMelee"
+            sound_cast = ET.SubElement(verb, "soundCast")
+            sound_cast.text = "Shot_AssaultRifle"
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Equipment type
+        equipment_type = ET.SubElement(thing_def, "equipmentType")
+        equipment_type.text = "Primary"
         
-        weapons_path = os.path.join(defs_folder, "Weapons.xml")
-        with open(weapons_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Thing categories
+        thing_categories = ET.SubElement(thing_def, "thingCategories")
+        thing_category = ET.SubElement(thing_categories, "li")
+        thing_category.text = "WeaponsRanged" if weapon['weaponType'] == "Ranged" else "WeaponsMelee"
+        
+        self._add_research_prerequisites(thing_def, weapon['defName'])
+        
+        return thing_def
     
     def generate_buildings_xml(self, defs_folder):
         """Generate ThingDefs for buildings"""
         if not self.app.buildings:
             return
         
-        root = ET.Element("Defs")
+        buildings_path = os.path.join(defs_folder, "Buildings.xml")
+        self._write_defs(buildings_path, (self._build_building_def, self.app.buildings))
+    
+    def _build_building_def(self, building):
+        """Build the ThingDef element for a single building"""
+        thing_def = ET.Element("ThingDef", ParentName="BuildingBase")
         
-        for building in self.app.buildings:
-            thing_def = ET.SubElement(root, "ThingDef", ParentName="BuildingBase")
-            
-            # DefName
-            defname = ET.SubElement(thing_def, "defName")
-            defname.text = building['defName']
-            
-            # Label
-            label = ET.SubElement(thing_def, "label")
-            label.text = building['label']
-            
-            # Description
-            description = ET.SubElement(thing_def, "description")
-            description.text = building['description']
-            
-            # Thing class
-            thing_class = ET.SubElement(thing_def, "thingClass")
-            thing_class.text = "Building"
-            
-            # Category
-            category = ET.SubElement(thing_def, "category")
-            category.text = "Building"
-            
-            # Building properties
-            building_props = ET.SubElement(thing_def, "building")
-            building_props.set("Class", "Building")
-            
-            # Graphic data
-            graphic_data = ET.SubElement(thing_def, "graphicData")
-            texture_path = ET.SubElement(graphic_data, "texPath")
-            texture_path.text = f"Things/{building['defName']}"
-            graphic_class = ET.SubElement(graphic_data, "graphicClass")
-            graphic_class.text = "Graphic_Single"
-            
-            # Size
-            size_parts = building['size'].split(',')
-            if len(size_parts) == 2:
-                size_elem = ET.SubElement(thing_def, "size")
-                size_elem.text = f"({size_parts[0].strip()},{size_parts[1].strip()})"
-            
-            # Altitudes
-            altitude_layer = ET.SubElement(thing_def, "altitudeLayer")
-            altitude_layer.text = "Building"
-            
-            # Passability
-            passability = ET.SubElement(thing_def, "passability")
-            passability.text = "PassThroughOnly"
-            
-            # Block wind
-            block_wind = ET.SubElement(thing_def, "blockWind")
-            block_wind.text = "true"
-            
-            # Fillage
-            fillage = ET.SubElement(thing_def, "fillage")
-            fillage.text = "Partial"
-            
-            # Coversleepers
-            cover_sleepers = ET.SubElement(thing_def, "coversleepers")
-            cover_sleepers.text = "true"
-            
-            # Blocking sleep
-            blocking_sleep_is_fire = ET.SubElement(thing_def, "blockLight")
-            blocking_sleep_is_fire.text = "true"
-            
-            # Rotatable
-            rotatable = ET.SubElement(thing_def, "rotatable")
-            rotatable.text = "false"
-            
-            # Selectable
-            selectable = ET.SubElement(thing_def, "selectable")
-            selectable.text = "true"
-            
-            # Drawertype
-            drawer_type = ET.SubElement(thing_def, "drawerType")
-            drawer_type.text = "MapMeshAndRealTime"
-            
-            # Repairability
-            repairability = ET.SubElement(thing_def, "repairability")
-            repairability.text = "Repairability_Normal"
-            
-            # Terrain affordance needed
-            terrain_affordance_needed = ET.SubElement(thing_def, "terrainAffordanceNeeded")
-            terrain_affordance_needed.text = "Light"
-            
-            # Stats
-            stat_bases = ET.SubElement(thing_def, "statBases")
-            
-            max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
-            max_hit_points.text = str(building['hitPoints'])
-            
-            work_to_build = ET.SubElement(stat_bases, "WorkToBuild")
-            work_to_build.text = str(building['workToBuild'])
-            
-            flammability = ET.SubElement(stat_bases, "Flammability")
-            flammability.text = "1.0"
-            
-            # Building
-            building_elem = ET.SubElement(thing_def, "building")
-            is_inert = ET.SubElement(building_elem, "isInert")
-            is_inert.text = "true"
-            
-            # Cost list (basic materials)
-            cost_list = ET.SubElement(thing_def, "costList")
-            steel_cost = ET.SubElement(cost_list, "Steel")
-            steel_cost.text = "25"
-            
-            # Research prerequisites (empty for now)
-            research_prerequisites = ET.SubElement(thing_def, "researchPrerequisites")
+        # DefName
+        defname = ET.SubElement(thing_def, "defName")
+        defname.text = building['defName']
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Label
+        label = ET.SubElement(thing_def, "label")
+        label.text = building['label']
         
-        buildings_path = os.path.join(defs_folder, "Buildings.xml")
-        with open(buildings_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Description
+        description = ET.SubElement(thing_def, "description")
+        description.text = building['description']
+        
+        # Thing class
+        thing_class = ET.SubElement(thing_def, "thingClass")
+        thing_class.text = "Building"
+        
+        # Category
+        category = ET.SubElement(thing_def, "category")
+        category.text = "Building"
+        
+        # Building properties
+        building_props = ET.SubElement(thing_def, "building")
+        building_props.set("Class", "Building")
+        
+        # Graphic data
+        graphic_data = ET.SubElement(thing_def, "graphicData")
+        texture_path = ET.SubElement(graphic_data, "texPath")
+        texture_path.text = building.get('texPath') or f"Things/{building['defName']}"
+        graphic_class = ET.SubElement(graphic_data, "graphicClass")
+        graphic_class.text = "Graphic_Single"
+        
+        # Size
+        size_parts = building['size'].split(',')
+        if len(size_parts) == 2:
+            size_elem = ET.SubElement(thing_def, "size")
+            size_elem.text = f"({size_parts[0].strip()},{size_parts[1].strip()})"
+        
+        # Altitudes
+        altitude_layer = ET.SubElement(thing_def, "altitudeLayer")
+        altitude_layer.text = "Building"
+        
+        # Passability
+        passability = ET.SubElement(thing_def, "passability")
+        passability.text = "PassThroughOnly"
+        
+        # Block wind
+        block_wind = ET.SubElement(thing_def, "blockWind")
+        block_wind.text = "true"
+        
+        # Fillage
+        fillage = ET.SubElement(thing_def, "fillage")
+        fillage.text = "Partial"
+        
+        # Coversleepers
+        cover_sleepers = ET.SubElement(thing_def, "coversleepers")
+        cover_sleepers.text = "true"
+        
+        # Blocking sleep
+        blocking_sleep_is_fire = ET.SubElement(thing_def, "blockLight")
+        blocking_sleep_is_fire.text = "true"
+        
+        # Rotatable
+        rotatable = ET.SubElement(thing_def, "rotatable")
+        rotatable.text = "false"
+        
+        # Selectable
+        selectable = ET.SubElement(thing_def, "selectable")
+        selectable.text = "true"
+        
+        # Drawertype
+        drawer_type = ET.SubElement(thing_def, "drawerType")
+        drawer_type.text = "MapMeshAndRealTime"
+        
+        # Repairability
+        repairability = ET.SubElement(thing_def, "repairability")
+        repairability.text = "Repairability_Normal"
+        
+        # Terrain affordance needed
+        terrain_affordance_needed = ET.SubElement(thing_def, "terrainAffordanceNeeded")
+        terrain_affordance_needed.text = "Light"
+        
+        # Stats
+        stat_bases = ET.SubElement(thing_def, "statBases")
+        
+        max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
+        max_hit_points.text = str(building['hitPoints'])
+        
+        work_to_build = ET.SubElement(stat_bases, "WorkToBuild")
+        work_to_build.text = str(building['workToBuild'])
+        
+        flammability = ET.SubElement(stat_bases, "Flammability")
+        flammability.text = "1.0"
+        
+        # Building
+        building_elem = ET.SubElement(thing_def, "building")
+        is_inert = ET.SubElement(building_elem, "isInert")
+        is_inert.text = "true"
+        
+        # Cost list (basic materials)
+        cost_list = ET.SubElement(thing_def, "costList")
+        steel_cost = ET.SubElement(cost_list, "Steel")
+        steel_cost.text = "25"
+        
+        # Research prerequisites, filled in from the research unlocks
+        research_prerequisites = ET.SubElement(thing_def, "researchPrerequisites")
+        self._add_research_prerequisites(thing_def, building['defName'])
+        
+        return thing_def
     
     def generate_cosmetics_xml(self, defs_folder):
         """Generate ThingDefs for cosmetics/apparel"""
         if not self.app.cosmetics:
             return
         
-        root = ET.Element("Defs")
+        cosmetics_path = os.path.join(defs_folder, "Apparel.xml")
+        self._write_defs(cosmetics_path, (self._build_cosmetic_def, self.app.cosmetics))
+    
+    def _build_cosmetic_def(self, cosmetic):
+        """Build the ThingDef element for a single cosmetic"""
+        thing_def = ET.Element("ThingDef", ParentName="ApparelBase")
         
-        for cosmetic in self.app.cosmetics:
-            thing_def = ET.SubElement(root, "ThingDef", ParentName="ApparelBase")
-            
-            # DefName
-            defname = ET.SubElement(thing_def, "defName")
-            defname.text = cosmetic['defName']
-            
-            # Label
-            label = ET.SubElement(thing_def, "label")
-            label.text = cosmetic['label']
-            
-            # Description
-            description = ET.SubElement(thing_def, "description")
-            description.text = cosmetic['description']
-            
-            # Tech level
-            tech_level = ET.SubElement(thing_def, "techLevel")
-            tech_level.text = "Industrial"
-            
-            # Graphic data
-            graphic_data = ET.SubElement(thing_def, "graphicData")
-            texture_path = ET.SubElement(graphic_data, "texPath")
-            texture_path.text = f"Things/{cosmetic['defName']}"
-            graphic_class = ET.SubElement(graphic_data, "graphicClass")
-            graphic_class.text = "Graphic_Single"
-            
-            # Generate wearable
-            generate_allowable_designators = ET.SubElement(thing_def, "generateAllowableDesignators")
-            generate_allowable_designators.text = "true"
-            
-            # Use hit points
-            use_hit_points = ET.SubElement(thing_def, "useHitPoints")
-            use_hit_points.text = "true"
-            
-            # Path cost
-            path_cost = ET.SubElement(thing_def, "pathCost")
-            path_cost.text = "15"
-            
-            # Selectable
-            selectable = ET.SubElement(thing_def, "selectable")
-            selectable.text = "true"
-            
-            # Apparel
-            apparel = ET.SubElement(thing_def, "apparel")
-            
-            # Body part groups
-            body_part_groups = ET.SubElement(apparel, "bodyPartGroups")
-            for part in cosmetic['bodyParts'].split(','):
-                part = part.strip()
-                if part:
-                    part_elem = ET.SubElement(body_part_groups, "li")
-                    part_elem.text = part
-            
-            # Worngrafix
-            worn_graphic = ET.SubElement(apparel, "wornGraphicPath")
-            worn_graphic.text = f"Things/Apparel/{cosmetic['defName']}"
-            
-            # Layers
-            layers = ET.SubElement(apparel, "layers")
-            layer_elem = ET.SubElement(layers, "li")
-            layer_elem.text = cosmetic['layer']
-            
-            # Default outfit tags
-            default_outfit_tags = ET.SubElement(apparel, "defaultOutfitTags")
-            tag = ET.SubElement(default_outfit_tags, "li")
-            tag.text = "Worker"
-            
-            # Stats
-            stat_bases = ET.SubElement(thing_def, "statBases")
-            
-            max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
-            max_hit_points.text = "100"
-            
-            market_value = ET.SubElement(stat_bases, "MarketValue")
-            market_value.text = str(cosmetic['marketValue'])
-            
-            mass = ET.SubElement(stat_bases, "Mass")
-            mass.text = str(cosmetic['mass'])
-            
-            work_to_make = ET.SubElement(stat_bases, "WorkToMake")
-            work_to_make.text = str(cosmetic['workToMake'])
-            
-            # Armor ratings if any
-            if float(cosmetic['armorSharp']) > 0:
-                armor_sharp = ET.SubElement(stat_bases, "ArmorRating_Sharp")
-                armor_sharp.text = str(cosmetic['armorSharp'])
-            
-            if float(cosmetic['armorBlunt']) > 0:
-                armor_blunt = ET.SubElement(stat_bases, "ArmorRating_Blunt")
-                armor_blunt.text = str(cosmetic['armorBlunt'])
-            
-            if float(cosmetic['armorHeat']) > 0:
-                armor_heat = ET.SubElement(stat_bases, "ArmorRating_Heat")
-                armor_heat.text = str(cosmetic['armorHeat'])
-            
-            # Equip delay
-            equip_delay = ET.SubElement(stat_bases, "EquipDelay")
-            equip_delay.text = "1.5"
-            
-            # Thing categories
-            thing_categories = ET.SubElement(thing_def, "thingCategories")
-            thing_category = ET.SubElement(thing_categories, "li")
-            thing_category.text = "Apparel"
-            
-            # Trading tags
-            trading_tags = ET.SubElement(thing_def, "tradeTags")
-            trade_tag = ET.SubElement(trading_tags, "li")
-            trade_tag.text = "Clothing"
+        # DefName
+        defname = ET.SubElement(thing_def, "defName")
+        defname.text = cosmetic['defName']
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Label
+        label = ET.SubElement(thing_def, "label")
+        label.text = cosmetic['label']
         
-        cosmetics_path = os.path.join(defs_folder, "Apparel.xml")
-        with open(cosmetics_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Description
+        description = ET.SubElement(thing_def, "description")
+        description.text = cosmetic['description']
+        
+        # Tech level
+        tech_level = ET.SubElement(thing_def, "techLevel")
+        tech_level.text = "Industrial"
+        
+        # Graphic data
+        graphic_data = ET.SubElement(thing_def, "graphicData")
+        texture_path = ET.SubElement(graphic_data, "texPath")
+        texture_path.text = cosmetic.get('texPath') or f"Things/{cosmetic['defName']}"
+        graphic_class = ET.SubElement(graphic_data, "graphicClass")
+        graphic_class.text = "Graphic_Single"
+        
+        # Generate wearable
+        generate_allowable_designators = ET.SubElement(thing_def, "generateAllowableDesignators")
+        generate_allowable_designators.text = "true"
+        
+        # Use hit points
+        use_hit_points = ET.SubElement(thing_def, "useHitPoints")
+        use_hit_points.text = "true"
+        
+        # Path cost
+        path_cost = ET.SubElement(thing_def, "pathCost")
+        path_cost.text = "15"
+        
+        # Selectable
+        selectable = ET.SubElement(thing_def, "selectable")
+        selectable.text = "true"
+        
+        # Apparel
+        apparel = ET.SubElement(thing_def, "apparel")
+        
+        # Body part groups
+        body_part_groups = ET.SubElement(apparel, "bodyPartGroups")
+        for part in cosmetic['bodyParts'].split(','):
+            part = part.strip()
+            if part:
+                part_elem = ET.SubElement(body_part_groups, "li")
+                part_elem.text = part
+        
+        # Worngrafix
+        worn_graphic = ET.SubElement(apparel, "wornGraphicPath")
+        worn_graphic.text = f"Things/Apparel/{cosmetic['defName']}"
+        
+        # Layers
+        layers = ET.SubElement(apparel, "layers")
+        layer_elem = ET.SubElement(layers, "li")
+        layer_elem.text = cosmetic['layer']
+        
+        # Default outfit tags
+        default_outfit_tags = ET.SubElement(apparel, "defaultOutfitTags")
+        tag = ET.SubElement(default_outfit_tags, "li")
+        tag.text = "Worker"
+        
+        # Stats
+        stat_bases = ET.SubElement(thing_def, "statBases")
+        
+        max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
+        max_hit_points.text = "100"
+        
+        market_value = ET.SubElement(stat_bases, "MarketValue")
+        market_value.text = str(cosmetic['marketValue'])
+        
+        mass = ET.SubElement(stat_bases, "Mass")
+        mass.text = str(cosmetic['mass'])
+        
+        work_to_make = ET.SubElement(stat_bases, "WorkToMake")
+        work_to_make.text = str(cosmetic['workToMake'])
+        
+        # Armor ratings if any
+        if float(cosmetic['armorSharp']) > 0:
+            armor_sharp = ET.SubElement(stat_bases, "ArmorRating_Sharp")
+            armor_sharp.text = str(cosmetic['armorSharp'])
+        
+        if float(cosmetic['armorBlunt']) > 0:
+            armor_blunt = ET.SubElement(stat_bases, "ArmorRating_Blunt")
+            armor_blunt.text = str(cosmetic['armorBlunt'])
+        
+        if float(cosmetic['armorHeat']) > 0:
+            armor_heat = ET.SubElement(stat_bases, "ArmorRating_Heat")
+            armor_heat.text = str(cosmetic['armorHeat'])
+        
+        # Equip delay
+        equip_delay = ET.SubElement(stat_bases, "EquipDelay")
+        equip_delay.text = "1.5"
+        
+        # Thing categories
+        thing_categories = ET.SubElement(thing_def, "thingCategories")
+        thing_category = ET.SubElement(thing_categories, "li")
+        thing_category.text = "Apparel"
+        
+        # Trading tags
+        trading_tags = ET.SubElement(thing_def, "tradeTags")
+        trade_tag = ET.SubElement(trading_tags, "li")
+        trade_tag.text = "Clothing"
+        
+        self._add_research_prerequisites(thing_def, cosmetic['defName'])
+        
+        return thing_def
     
     def generate_drugs_xml(self, defs_folder):
         """Generate ThingDefs for drugs"""
         if not self.app.drugs:
             return
         
-        root = ET.Element("Defs")
+        drugs_path = os.path.join(defs_folder, "Drugs.xml")
+        self._write_defs(drugs_path,
+                         (self._build_drug_def, self.app.drugs),
+                         # Generate the hediff (effect) def
+                         (self._build_drug_hediff_def, self.app.drugs))
+    
+    def _build_drug_def(self, drug):
+        """Build the ThingDef element for a single drug"""
+        thing_def = ET.Element("ThingDef", ParentName="DrugBase")
         
-        for drug in self.app.drugs:
-            thing_def = ET.SubElement(root, "ThingDef", ParentName="DrugBase")
-            
-            # DefName
-            defname = ET.SubElement(thing_def, "defName")
-            defname.text = drug['defName']
-            
-            # Label
-            label = ET.SubElement(thing_def, "label")
-            label.text = drug['label']
-            
-            # Description
-            description = ET.SubElement(thing_def, "description")
-            description.text = drug['description']
-            
-            # Tech level
-            tech_level = ET.SubElement(thing_def, "techLevel")
-            tech_level.text = "Industrial"
-            
-            # Graphic data
-            graphic_data = ET.SubElement(thing_def, "graphicData")
-            texture_path = ET.SubElement(graphic_data, "texPath")
-            texture_path.text = f"Things/{drug['defName']}"
-            graphic_class = ET.SubElement(graphic_data, "graphicClass")
-            graphic_class.text = "Graphic_StackCount"
-            
-            # Social properness
-            social_properness = ET.SubElement(thing_def, "socialProperness")
-            social_properness.text = "Rude"
-            
-            # Use hit points
-            use_hit_points = ET.SubElement(thing_def, "useHitPoints")
-            use_hit_points.text = "true"
-            
-            # Stackable
-            stackable = ET.SubElement(thing_def, "stackLimit")
-            stackable.text = "75"
-            
-            # Stats
-            stat_bases = ET.SubElement(thing_def, "statBases")
-            
-            max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
-            max_hit_points.text = "50"
-            
-            market_value = ET.SubElement(stat_bases, "MarketValue")
-            market_value.text = str(drug['marketValue'])
-            
-            mass = ET.SubElement(stat_bases, "Mass")
-            mass.text = str(drug['mass'])
-            
-            flammability = ET.SubElement(stat_bases, "Flammability")
-            flammability.text = "1.0"
-            
-            deterioration_rate = ET.SubElement(stat_bases, "DeteriorationRate")
-            deterioration_rate.text = "6.0"
-            
-            # Nutrition if it provides any
-            if float(drug['nutrition']) > 0:
-                nutrition = ET.SubElement(stat_bases, "Nutrition")
-                nutrition.text = str(drug['nutrition'])
-            
-            # Thing categories
-            thing_categories = ET.SubElement(thing_def, "thingCategories")
-            thing_category = ET.SubElement(thing_categories, "li")
-            thing_category.text = "Drugs"
-            
-            # Ingestible properties
-            ingestible = ET.SubElement(thing_def, "ingestible")
-            
-            food_type = ET.SubElement(ingestible, "foodType")
-            food_type.text = "Processed"
-            
-            joy_kind = ET.SubElement(ingestible, "joyKind")
-            joy_kind.text = "Chemical"
-            
-            joy_offset = ET.SubElement(ingestible, "joy")
-            joy_offset.text = str(drug['joy'])
-            
-            base_ingestion_ticks = ET.SubElement(ingestible, "baseIngestTicks")
-            base_ingestion_ticks.text = "240"
-            
-            chair_search_radius = ET.SubElement(ingestible, "chairSearchRadius")
-            chair_search_radius.text = "4"
-            
-            nurseable = ET.SubElement(ingestible, "nurseable")
-            nurseable.text = "true"
-            
-            # Drug category and addiction
-            drug_category = ET.SubElement(ingestible, "drugCategory")
-            drug_category.text = "Hard"
-            
-            addiction_chance = ET.SubElement(ingestible, "addictiveness")
-            addiction_chance.text = str(drug['addictionChance'])
-            
-            min_tolerance = ET.SubElement(ingestible, "minToleranceToAddict")
-            min_tolerance.text = "0.1"
-            
-            # Tolerance building
-            tolerance_chemical = ET.SubElement(ingestible, "toleranceChemical")
-            tolerance_chemical.text = drug['defName']
-            
-            # Outcome effects
-            outcome_doers = ET.SubElement(ingestible, "outcomeDoers")
-            
-            # Main effect
-            outcome = ET.SubElement(outcome_doers, "li", Class="IngestionOutcomeDoer_GiveHediff")
-            hediff_def = ET.SubElement(outcome, "hediffDef")
-            hediff_def.text = f"{drug['defName']}_Effect"
-            severity = ET.SubElement(outcome, "severity")
-            severity.text = "1.0"
-            tolerance_chemical_outcome = ET.SubElement(outcome, "toleranceChemical")
-            tolerance_chemical_outcome.text = drug['defName']
-            divide_by_body_size = ET.SubElement(outcome, "divideByBodySize")
-            divide_by_body_size.text = "true"
-            
-            # Tolerance effect
-            tolerance_outcome = ET.SubElement(outcome_doers, "li", Class="IngestionOutcomeDoer_OffsetTolerance")
-            tolerance_chemical_tolerance = ET.SubElement(tolerance_outcome, "toleranceChemical")
-            tolerance_chemical_tolerance.text = drug['defName']
-            tolerance_offset = ET.SubElement(tolerance_outcome, "offset")
-            tolerance_offset.text = str(drug['toleranceGain'])
-            
-            # Trading tags
-            trading_tags = ET.SubElement(thing_def, "tradeTags")
-            trade_tag = ET.SubElement(trading_tags, "li")
-            trade_tag.text = "ExoticMisc"
-        
-        # Generate the hediff (effect) def
-        for drug in self.app.drugs:
-            hediff_def = ET.SubElement(root, "HediffDef")
-            
-            # DefName
-            hediff_defname = ET.SubElement(hediff_def, "defName")
-            hediff_defname.text = f"{drug['defName']}_Effect"
-            
-            # Label
-            hediff_label = ET.SubElement(hediff_def, "label")
-            hediff_label.text = f"{drug['label']} effect"
-            
-            # Label noun
-            label_noun = ET.SubElement(hediff_def, "labelNoun")
-            label_noun.text = f"{drug['label']} effect"
-            
-            # Description
-            hediff_description = ET.SubElement(hediff_def, "description")
-            hediff_description.text = f"Active effects of {drug['label']}."
-            
-            # Hediff class
-            hediff_class = ET.SubElement(hediff_def, "hediffClass")
-            hediff_class.text = "HediffWithComps"
-            
-            # Default label color
-            default_label_color = ET.SubElement(hediff_def, "defaultLabelColor")
-            default_label_color.text = "(1,0,0.5)"
-            
-            # Scene overlay
-            scene_overlay = ET.SubElement(hediff_def, "scenarioCanAdd")
-            scene_overlay.text = "true"
-            
-            # Max severity
-            max_severity = ET.SubElement(hediff_def, "maxSeverity")
-            max_severity.text = "1.0"
-            
-            # Is bad
-            is_bad = ET.SubElement(hediff_def, "isBad")
-            is_bad.text = "false"
-            
-            # Comps
-            comps = ET.SubElement(hediff_def, "comps")
-            
-            # Severity per day comp
-            severity_comp = ET.SubElement(comps, "li", Class="HediffComp_SeverityPerDay")
-            severity_per_day = ET.SubElement(severity_comp, "severityPerDay")
-            severity_per_day.text = str(-24.0 / float(drug['duration']))  # Duration in hours to severity decay
-            
-            # Effects on different body parts
-            stages = ET.SubElement(hediff_def, "stages")
-            stage = ET.SubElement(stages, "li")
+        # DefName
+        defname = ET.SubElement(thing_def, "defName")
+        defname.text = drug['defName']
+        
+        # Label
+        label = ET.SubElement(thing_def, "label")
+        label.text = drug['label']
+        
+        # Description
+        description = ET.SubElement(thing_def, "description")
+        description.text = drug['description']
+        
+        # Tech level
+        tech_level = ET.SubElement(thing_def, "techLevel")
+        tech_level.text = "Industrial"
+        
+        # Graphic data
+        graphic_data = ET.SubElement(thing_def, "graphicData")
+        texture_path = ET.SubElement(graphic_data, "texPath")
+        texture_path.text = drug.get('texPath') or f"Things/{drug['defName']}"
+        graphic_class = ET.SubElement(graphic_data, "graphicClass")
+        graphic_class.text = "Graphic_StackCount"
+        
+        # Social properness
+        social_properness = ET.SubElement(thing_def, "socialProperness")
+        social_properness.text = "Rude"
+        
+        # Use hit points
+        use_hit_points = ET.SubElement(thing_def, "useHitPoints")
+        use_hit_points.text = "true"
+        
+        # Stackable
+        stackable = ET.SubElement(thing_def, "stackLimit")
+        stackable.text = "75"
+        
+        # Stats
+        stat_bases = ET.SubElement(thing_def, "statBases")
+        
+        max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
+        max_hit_points.text = "50"
+        
+        market_value = ET.SubElement(stat_bases, "MarketValue")
+        market_value.text = str(drug['marketValue'])
+        
+        mass = ET.SubElement(stat_bases, "Mass")
+        mass.text = str(drug['mass'])
+        
+        flammability = ET.SubElement(stat_bases, "Flammability")
+        flammability.text = "1.0"
+        
+        deterioration_rate = ET.SubElement(stat_bases, "DeteriorationRate")
+        deterioration_rate.text = "6.0"
+        
+        # Nutrition if it provides any
+        if float(drug['nutrition']) > 0:
+            nutrition = ET.SubElement(stat_bases, "Nutrition")
+            nutrition.text = str(drug['nutrition'])
+        
+        # Thing categories
+        thing_categories = ET.SubElement(thing_def, "thingCategories")
+        thing_category = ET.SubElement(thing_categories, "li")
+        thing_category.text = "Drugs"
+        
+        # Ingestible properties
+        ingestible = ET.SubElement(thing_def, "ingestible")
+        
+        food_type = ET.SubElement(ingestible, "foodType")
+        food_type.text = "Processed"
+        
+        joy_kind = ET.SubElement(ingestible, "joyKind")
+        joy_kind.text = "Chemical"
+        
+        joy_offset = ET.SubElement(ingestible, "joy")
+        joy_offset.text = str(drug['joy'])
+        
+        base_ingestion_ticks = ET.SubElement(ingestible, "baseIngestTicks")
+        base_ingestion_ticks.text = "240"
+        
+        chair_search_radius = ET.SubElement(ingestible, "chairSearchRadius")
+        chair_search_radius.text = "4"
+        
+        nurseable = ET.SubElement(ingestible, "nurseable")
+        nurseable.text = "true"
+        
+        # Drug category and addiction
+        drug_category = ET.SubElement(ingestible, "drugCategory")
+        drug_category.text = "Hard"
+        
+        addiction_chance = ET.SubElement(ingestible, "addictiveness")
+        addiction_chance.text = str(drug['addictionChance'])
+        
+        min_tolerance = ET.SubElement(ingestible, "minToleranceToAddict")
+        min_tolerance.text = "0.1"
+        
+        # Tolerance building
+        tolerance_chemical = ET.SubElement(ingestible, "toleranceChemical")
+        tolerance_chemical.text = drug['defName']
+        
+        # Outcome effects
+        outcome_doers = ET.SubElement(ingestible, "outcomeDoers")
+        
+        # Main effect
+        outcome = ET.SubElement(outcome_doers, "li", Class="IngestionOutcomeDoer_GiveHediff")
+        hediff_def = ET.SubElement(outcome, "hediffDef")
+        hediff_def.text = f"{drug['defName']}_Effect"
+        severity = ET.SubElement(outcome, "severity")
+        severity.text = "1.0"
+        tolerance_chemical_outcome = ET.SubElement(outcome, "toleranceChemical")
+        tolerance_chemical_outcome.text = drug['defName']
+        divide_by_body_size = ET.SubElement(outcome, "divideByBodySize")
+        divide_by_body_size.text = "true"
+        
+        # Tolerance effect
+        tolerance_outcome = ET.SubElement(outcome_doers, "li", Class="IngestionOutcomeDoer_OffsetTolerance")
+        tolerance_chemical_tolerance = ET.SubElement(tolerance_outcome, "toleranceChemical")
+        tolerance_chemical_tolerance.text = drug['defName']
+        tolerance_offset = ET.SubElement(tolerance_outcome, "offset")
+        tolerance_offset.text = str(drug['toleranceGain'])
+        
+        # Trading tags
+        trading_tags = ET.SubElement(thing_def, "tradeTags")
+        trade_tag = ET.SubElement(trading_tags, "li")
+        trade_tag.text = "ExoticMisc"
+        
+        self._add_research_prerequisites(thing_def, drug['defName'])
+        
+        return thing_def
+    
+    def _build_drug_hediff_def(self, drug):
+        """Build the HediffDef element for a single drug's effect"""
+        hediff_def = ET.Element("HediffDef")
+        
+        # DefName
+        hediff_defname = ET.SubElement(hediff_def, "defName")
+        hediff_defname.text = f"{drug['defName']}_Effect"
+        
+        # Label
+        hediff_label = ET.SubElement(hediff_def, "label")
+        hediff_label.text = f"{drug['label']} effect"
+        
+        # Label noun
+        label_noun = ET.SubElement(hediff_def, "labelNoun")
+        label_noun.text = f"{drug['label']} effect"
+        
+        # Description
+        hediff_description = ET.SubElement(hediff_def, "description")
+        hediff_description.text = f"Active effects of {drug['label']}."
+        
+        # Hediff class
+        hediff_class = ET.SubElement(hediff_def, "hediffClass")
+        hediff_class.text = "HediffWithComps"
+        
+        # Default label color
+        default_label_color = ET.SubElement(hediff_def, "defaultLabelColor")
+        default_label_color.text = "(1,0,0.5)"
+        
+        # Scene overlay
+        scene_overlay = ET.SubElement(hediff_def, "scenarioCanAdd")
+        scene_overlay.text = "true"
+        
+        # Max severity
+        max_severity = ET.SubElement(hediff_def, "maxSeverity")
+        max_severity.text = "1.0"
+        
+        # Is bad
+        is_bad = ET.SubElement(hediff_def, "isBad")
+        is_bad.text = "false"
+        
+        # Comps
+        comps = ET.SubElement(hediff_def, "comps")
+        
+        # Severity per day comp
+        severity_comp = ET.SubElement(comps, "li", Class="HediffComp_SeverityPerDay")
+        severity_per_day = ET.SubElement(severity_comp, "severityPerDay")
+        severity_per_day.text = str(-24.0 / float(drug['duration']))  # Duration in hours to severity decay
+        
+        # Effects on different body parts
+        stages = ET.SubElement(hediff_def, "stages")
+        stage = ET.SubElement(stages, "li")
+        
+        # Stat offsets
+        if float(drug['painReduction']) != 0 or float(drug['moodOffset']) != 0 or float(drug['consciousnessOffset']) != 0:
+            stat_offsets = ET.SubElement(stage, "statOffsets")
             
-            # Stat offsets
-            if float(drug['painReduction']) != 0 or float(drug['moodOffset']) != 0 or float(drug['consciousnessOffset']) != 0:
-                stat_offsets = ET.SubElement(stage, "statOffsets")
-                
-                if float(drug['painReduction']) != 0:
-                    pain_sensitivity = ET.SubElement(stat_offsets, "PainShockThreshold")
-                    pain_sensitivity.text = str(drug['painReduction'])
-                
-                if float(drug['consciousnessOffset']) != 0:
-                    consciousness = ET.SubElement(stat_offsets, "Consciousness")
-                    consciousness.text = str(drug['consciousnessOffset'])
+            if float(drug['painReduction']) != 0:
+                pain_sensitivity = ET.SubElement(stat_offsets, "PainShockThreshold")
+                pain_sensitivity.text = str(drug['painReduction'])
             
-            # Mood offset
-            if float(drug['moodOffset']) != 0:
-                mood_offset = ET.SubElement(stage, "moodOffset")
-                mood_offset.text = str(drug['moodOffset'])
+            if float(drug['consciousnessOffset']) != 0:
+                consciousness = ET.SubElement(stat_offsets, "Consciousness")
+                consciousness.text = str(drug['consciousnessOffset'])
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Mood offset
+        if float(drug['moodOffset']) != 0:
+            mood_offset = ET.SubElement(stage, "moodOffset")
+            mood_offset.text = str(drug['moodOffset'])
         
-        drugs_path = os.path.join(defs_folder, "Drugs.xml")
-        with open(drugs_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        return hediff_def
     
     def generate_workbenches_xml(self, defs_folder):
         """Generate ThingDefs for workbenches"""
         if not self.app.workbenches:
             return
         
-        root = ET.Element("Defs")
+        workbenches_path = os.path.join(defs_folder, "Workbenches.xml")
+        self._write_defs(workbenches_path, (self._build_workbench_def, self.app.workbenches))
+    
+    def _build_workbench_def(self, workbench):
+        """Build the ThingDef element for a single workbench"""
+        thing_def = ET.Element("ThingDef", ParentName="BenchBase")
         
-        for workbench in self.app.workbenches:
-            thing_def = ET.SubElement(root, "ThingDef", ParentName="BenchBase")
-            
-            # DefName
-            defname = ET.SubElement(thing_def, "defName")
-            defname.text = workbench['defName']
-            
-            # Label
-            label = ET.SubElement(thing_def, "label")
-            label.text = workbench['label']
-            
-            # Description
-            description = ET.SubElement(thing_def, "description")
-            description.text = workbench['description']
-            
-            # Tech level
-            tech_level = ET.SubElement(thing_def, "techLevel")
-            tech_level.text = "Industrial"
-            
-            # Graphic data
-            graphic_data = ET.SubElement(thing_def, "graphicData")
-            texture_path = ET.SubElement(graphic_data, "texPath")
-            texture_path.text = f"Things/{workbench['defName']}"
-            graphic_class = ET.SubElement(graphic_data, "graphicClass")
-            graphic_class.text = "Graphic_Multi"
-            draw_size = ET.SubElement(graphic_data, "drawSize")
-            draw_size.text = f"({workbench['sizeX']},{workbench['sizeZ']})"
-            
-            # Cost list
-            cost_list = ET.SubElement(thing_def, "costList")
-            steel_cost = ET.SubElement(cost_list, "Steel")
-            steel_cost.text = str(workbench['steelCost'])
-            
-            if int(workbench['componentCost']) > 0:
-                component_cost = ET.SubElement(cost_list, "ComponentIndustrial")
-                component_cost.text = str(workbench['componentCost'])
-            
-            # Alt building
-            alt_building = ET.SubElement(thing_def, "altitudeLayer")
-            alt_building.text = "Building"
-            
-            # Pass ability
-            pass_ability = ET.SubElement(thing_def, "passability")
-            pass_ability.text = "PassThroughOnly"
-            
-            # Path cost
-            path_cost = ET.SubElement(thing_def, "pathCost")
-            path_cost.text = "50"
-            
-            # Block wind
-            block_wind = ET.SubElement(thing_def, "blockWind")
-            block_wind.text = "true"
-            
-            # Fillage
-            fillage = ET.SubElement(thing_def, "fillPercent")
-            fillage.text = "0.5"
-            
-            # Use hit points
-            use_hit_points = ET.SubElement(thing_def, "useHitPoints")
-            use_hit_points.text = "true"
-            
-            # Size
-            size = ET.SubElement(thing_def, "size")
-            size.text = f"({workbench['sizeX']},{workbench['sizeZ']})"
-            
-            # Stats
-            stat_bases = ET.SubElement(thing_def, "statBases")
-            
-            max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
-            max_hit_points.text = "180"
-            
-            market_value = ET.SubElement(stat_bases, "MarketValue")
-            market_value.text = str(workbench['marketValue'])
-            
-            work_to_make = ET.SubElement(stat_bases, "WorkToBuild")
-            work_to_make.text = str(workbench['workToBuild'])
-            
-            flammability = ET.SubElement(stat_bases, "Flammability")
-            flammability.text = "1.0"
-            
-            work_table_work_speed = ET.SubElement(stat_bases, "WorkTableWorkSpeedFactor")
-            work_table_work_speed.text = str(workbench['workSpeedFactor'])
-            
-            work_table_efficiency = ET.SubElement(stat_bases, "WorkTableEfficiencyFactor")
-            work_table_efficiency.text = str(workbench['efficiencyFactor'])
-            
-            # Thing categories
-            thing_categories = ET.SubElement(thing_def, "thingCategories")
-            thing_category = ET.SubElement(thing_categories, "li")
-            thing_category.text = "BuildingsProduction"
-            
-            # Building properties
-            building = ET.SubElement(thing_def, "building")
-            is_inert = ET.SubElement(building, "isInert")
-            is_inert.text = "true"
-            
-            is_edifice = ET.SubElement(building, "isEdifice")
-            is_edifice.text = "true"
-            
-            # Surface type
-            surface_type = ET.SubElement(building, "surfaceType")
-            surface_type.text = "Item"
-            
-            # Can place blueprints over
-            can_place_over = ET.SubElement(building, "canPlaceOverImpassablePlant")
-            can_place_over.text = "false"
-            
-            # AI destory holdable
-            ai_destory = ET.SubElement(building, "ai_chillDestination")
-            ai_destory.text = "false"
-            
-            # Designator dropdown group key
-            designation_category = ET.SubElement(thing_def, "designationCategory")
-            designation_category.text = "Production"
-            
-            # Inspectorstring extra
-            has_interact_cell = ET.SubElement(thing_def, "hasInteractionCell")
-            has_interact_cell.text = "true"
-            
-            interaction_cell_offset = ET.SubElement(thing_def, "interactionCellOffset")
-            interaction_cell_offset.text = "(0,0,-1)"
-            
-            # Recipe users
-            recipes = ET.SubElement(thing_def, "recipes")
-            # Add some default recipes based on workbench type
-            recipe = ET.SubElement(recipes, "li")
-            recipe.text = "Make_Apparel_BasicShirt"
-            
-            # Skill requirements
-            if workbench['skillRequired'] != "None":
-                skill_requirements = ET.SubElement(thing_def, "skillRequirements")
-                skill = ET.SubElement(skill_requirements, "li")
-                skill_def = ET.SubElement(skill, "skill")
-                skill_def.text = workbench['skillRequired']
-                min_level = ET.SubElement(skill, "minLevel")
-                min_level.text = str(workbench['skillLevel'])
-            
-            # Power consumption if needed
-            if int(workbench['powerConsumption']) > 0:
-                comp_power = ET.SubElement(thing_def, "comps")
-                power_comp = ET.SubElement(comp_power, "li", Class="CompProperties_Power")
-                comp_class = ET.SubElement(power_comp, "compClass")
-                comp_class.text = "CompPowerTrader"
-                base_power = ET.SubElement(power_comp, "basePowerConsumption")
-                base_power.text = str(workbench['powerConsumption'])
-                short_circuit = ET.SubElement(power_comp, "shortCircuitInRain")
-                short_circuit.text = "true"
-            
-            # Research prerequisites
-            research_prerequisites = ET.SubElement(thing_def, "researchPrerequisites")
-            research_prereq = ET.SubElement(research_prerequisites, "li")
-            research_prereq.text = "BasicFabrication"
-            
-            # Construction skill to build
-            construction_skill = ET.SubElement(thing_def, "constructionSkillPrerequisite")
-            construction_skill.text = "4"
-            
-            # Trading tags
-            trading_tags = ET.SubElement(thing_def, "tradeTags")
-            trade_tag = ET.SubElement(trading_tags, "li")
-            trade_tag.text = "Building"
+        # DefName
+        defname = ET.SubElement(thing_def, "defName")
+        defname.text = workbench['defName']
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Label
+        label = ET.SubElement(thing_def, "label")
+        label.text = workbench['label']
         
-        workbenches_path = os.path.join(defs_folder, "Workbenches.xml")
-        with open(workbenches_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Description
+        description = ET.SubElement(thing_def, "description")
+        description.text = workbench['description']
+        
+        # Tech level
+        tech_level = ET.SubElement(thing_def, "techLevel")
+        tech_level.text = "Industrial"
+        
+        # Graphic data
+        graphic_data = ET.SubElement(thing_def, "graphicData")
+        texture_path = ET.SubElement(graphic_data, "texPath")
+        texture_path.text = workbench.get('texPath') or f"Things/{workbench['defName']}"
+        graphic_class = ET.SubElement(graphic_data, "graphicClass")
+        graphic_class.text = "Graphic_Multi"
+        draw_size = ET.SubElement(graphic_data, "drawSize")
+        draw_size.text = f"({workbench['sizeX']},{workbench['sizeZ']})"
+        
+        # Cost list
+        cost_list = ET.SubElement(thing_def, "costList")
+        steel_cost = ET.SubElement(cost_list, "Steel")
+        steel_cost.text = str(workbench['steelCost'])
+        
+        if int(workbench['componentCost']) > 0:
+            component_cost = ET.SubElement(cost_list, "ComponentIndustrial")
+            component_cost.text = str(workbench['componentCost'])
+        
+        # Alt building
+        alt_building = ET.SubElement(thing_def, "altitudeLayer")
+        alt_building.text = "Building"
+        
+        # Pass ability
+        pass_ability = ET.SubElement(thing_def, "passability")
+        pass_ability.text = "PassThroughOnly"
+        
+        # Path cost
+        path_cost = ET.SubElement(thing_def, "pathCost")
+        path_cost.text = "50"
+        
+        # Block wind
+        block_wind = ET.SubElement(thing_def, "blockWind")
+        block_wind.text = "true"
+        
+        # Fillage
+        fillage = ET.SubElement(thing_def, "fillPercent")
+        fillage.text = "0.5"
+        
+        # Use hit points
+        use_hit_points = ET.SubElement(thing_def, "useHitPoints")
+        use_hit_points.text = "true"
+        
+        # Size
+        size = ET.SubElement(thing_def, "size")
+        size.text = f"({workbench['sizeX']},{workbench['sizeZ']})"
+        
+        # Stats
+        stat_bases = ET.SubElement(thing_def, "statBases")
+        
+        max_hit_points = ET.SubElement(stat_bases, "MaxHitPoints")
+        max_hit_points.text = "180"
+        
+        market_value = ET.SubElement(stat_bases, "MarketValue")
+        market_value.text = str(workbench['marketValue'])
+        
+        work_to_make = ET.SubElement(stat_bases, "WorkToBuild")
+        work_to_make.text = str(workbench['workToBuild'])
+        
+        flammability = ET.SubElement(stat_bases, "Flammability")
+        flammability.text = "1.0"
+        
+        work_table_work_speed = ET.SubElement(stat_bases, "WorkTableWorkSpeedFactor")
+        work_table_work_speed.text = str(workbench['workSpeedFactor'])
+        
+        work_table_efficiency = ET.SubElement(stat_bases, "WorkTableEfficiencyFactor")
+        work_table_efficiency.text = str(workbench['efficiencyFactor'])
+        
+        # Thing categories
+        thing_categories = ET.SubElement(thing_def, "thingCategories")
+        thing_category = ET.SubElement(thing_categories, "li")
+        thing_category.text = "BuildingsProduction"
+        
+        # Building properties
+        building = ET.SubElement(thing_def, "building")
+        is_inert = ET.SubElement(building, "isInert")
+        is_inert.text = "true"
+        
+        is_edifice = ET.SubElement(building, "isEdifice")
+        is_edifice.text = "true"
+        
+        # Surface type
+        surface_type = ET.SubElement(building, "surfaceType")
+        surface_type.text = "Item"
+        
+        # Can place blueprints over
+        can_place_over = ET.SubElement(building, "canPlaceOverImpassablePlant")
+        can_place_over.text = "false"
+        
+        # AI destory holdable
+        ai_destory = ET.SubElement(building, "ai_chillDestination")
+        ai_destory.text = "false"
+        
+        # Designator dropdown group key
+        designation_category = ET.SubElement(thing_def, "designationCategory")
+        designation_category.text = "Production"
+        
+        # Inspectorstring extra
+        has_interact_cell = ET.SubElement(thing_def, "hasInteractionCell")
+        has_interact_cell.text = "true"
+        
+        interaction_cell_offset = ET.SubElement(thing_def, "interactionCellOffset")
+        interaction_cell_offset.text = "(0,0,-1)"
+        
+        # Recipe users
+        recipes = ET.SubElement(thing_def, "recipes")
+        # Add some default recipes based on workbench type
+        recipe = ET.SubElement(recipes, "li")
+        recipe.text = "Make_Apparel_BasicShirt"
+        
+        # Skill requirements
+        if workbench['skillRequired'] != "None":
+            skill_requirements = ET.SubElement(thing_def, "skillRequirements")
+            skill = ET.SubElement(skill_requirements, "li")
+            skill_def = ET.SubElement(skill, "skill")
+            skill_def.text = workbench['skillRequired']
+            min_level = ET.SubElement(skill, "minLevel")
+            min_level.text = str(workbench['skillLevel'])
+        
+        # Power consumption if needed
+        if int(workbench['powerConsumption']) > 0:
+            comp_power = ET.SubElement(thing_def, "comps")
+            power_comp = ET.SubElement(comp_power, "li", Class="CompProperties_Power")
+            comp_class = ET.SubElement(power_comp, "compClass")
+            comp_class.text = "CompPowerTrader"
+            base_power = ET.SubElement(power_comp, "basePowerConsumption")
+            base_power.text = str(workbench['powerConsumption'])
+            short_circuit = ET.SubElement(power_comp, "shortCircuitInRain")
+            short_circuit.text = "true"
+        
+        # Research prerequisites
+        research_prerequisites = ET.SubElement(thing_def, "researchPrerequisites")
+        research_prereq = ET.SubElement(research_prerequisites, "li")
+        research_prereq.text = "BasicFabrication"
+        
+        # Construction skill to build
+        construction_skill = ET.SubElement(thing_def, "constructionSkillPrerequisite")
+        construction_skill.text = "4"
+        
+        # Trading tags
+        trading_tags = ET.SubElement(thing_def, "tradeTags")
+        trade_tag = ET.SubElement(trading_tags, "li")
+        trade_tag.text = "Building"
+        
+        self._add_research_prerequisites(thing_def, workbench['defName'])
+        
+        return thing_def
     
     def generate_research_xml(self, defs_folder):
         """Generate ResearchProjectDefs for research"""
         if not self.app.research:
             return
         
-        root = ET.Element("Defs")
+        research_path = os.path.join(defs_folder, "Research.xml")
+        self._write_defs(research_path, (self._build_research_def, self.app.research))
+    
+    def _build_research_def(self, research):
+        """Build the ResearchProjectDef element for a single research project"""
+        research_def = ET.Element("ResearchProjectDef")
         
-        for research in self.app.research:
-            research_def = ET.SubElement(root, "ResearchProjectDef")
-            
-            # DefName
-            defname = ET.SubElement(research_def, "defName")
-            defname.text = research['defName']
-            
-            # Label
-            label = ET.SubElement(research_def, "label")
-            label.text = research['label']
-            
-            # Description
-            description = ET.SubElement(research_def, "description")
-            description.text = research['description']
-            
-            # Base cost
-            base_cost = ET.SubElement(research_def, "baseCost")
-            base_cost.text = str(research['baseCost'])
-            
-            # Tech level
-            tech_level = ET.SubElement(research_def, "techLevel")
-            tech_level.text = research['techLevel']
-            
-            # Research tab
-            tab = ET.SubElement(research_def, "tab")
-            tab.text = "Main"
+        # DefName
+        defname = ET.SubElement(research_def, "defName")
+        defname.text = research['defName']
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Label
+        label = ET.SubElement(research_def, "label")
+        label.text = research['label']
         
-        research_path = os.path.join(defs_folder, "Research.xml")
-        with open(research_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Description
+        description = ET.SubElement(research_def, "description")
+        description.text = research['description']
+        
+        # Base cost
+        base_cost = ET.SubElement(research_def, "baseCost")
+        base_cost.text = str(research['baseCost'])
+        
+        # Tech level
+        tech_level = ET.SubElement(research_def, "techLevel")
+        tech_level.text = research['techLevel']
+        
+        # Research tab
+        tab = ET.SubElement(research_def, "tab")
+        tab.text = "Main"
+        
+        return research_def
     
     def generate_recipes_xml(self, defs_folder):
         """Generate RecipeDefs for recipes"""
         if not self.app.recipes:
             return
         
-        root = ET.Element("Defs")
+        recipes_path = os.path.join(defs_folder, "Recipes.xml")
+        self._write_defs(recipes_path, (self._build_recipe_def, self.app.recipes))
+    
+    def _build_recipe_def(self, recipe):
+        """Build the RecipeDef element for a single recipe"""
+        recipe_def = ET.Element("RecipeDef")
         
-        for recipe in self.app.recipes:
-            recipe_def = ET.SubElement(root, "RecipeDef")
-            
-            # DefName
-            defname = ET.SubElement(recipe_def, "defName")
-            defname.text = recipe['defName']
-            
-            # Label
-            label = ET.SubElement(recipe_def, "label")
-            label.text = recipe['label']
-            
-            # Description
-            description = ET.SubElement(recipe_def, "description")
-            description.text = recipe['description']
-            
-            # Job string
-            job_string = ET.SubElement(recipe_def, "jobString")
-            job_string.text = f"Making {recipe['label']}."
-            
-            # Work amount
-            work_amount = ET.SubElement(recipe_def, "workAmount")
-            work_amount.text = str(recipe['workAmount'])
-            
-            # Work skill
-            work_skill = ET.SubElement(recipe_def, "workSkill")
-            work_skill.text = "Crafting"
-            
-            # Effect working
-            effect_working = ET.SubElement(recipe_def, "effectWorking")
-            effect_working.text = "Cook"
-            
-            # Sound working
-            sound_working = ET.SubElement(recipe_def, "soundWorking")
-            sound_working.text = "Recipe_CookMeal"
-            
-            # Ingredients
-            ingredients = ET.SubElement(recipe_def, "ingredients")
-            
-            # Parse ingredient string (format: DefName:Count)
-            for ingredient_str in recipe['ingredients'].split(','):
-                ingredient_str = ingredient_str.strip()
-                if ':' in ingredient_str:
-                    ing_name, ing_count = ingredient_str.split(':', 1)
-                    ing_name = ing_name.strip()
-                    ing_count = ing_count.strip()
-                    
-                    ingredient = ET.SubElement(ingredients, "li")
-                    filter_elem = ET.SubElement(ingredient, "filter")
-                    things_defs = ET.SubElement(filter_elem, "thingDefs")
-                    thing_def = ET.SubElement(things_defs, "li")
-                    thing_def.text = ing_name
-                    
-                    count = ET.SubElement(ingredient, "count")
-                    count.text = ing_count
-            
-            # Products
-            products = ET.SubElement(recipe_def, "products")
-            product = ET.SubElement(products, recipe['product'])
-            product.text = str(recipe['productCount'])
-            
-            # Default ingredient filter
-            default_ingredient_filter = ET.SubElement(recipe_def, "defaultIngredientFilter")
-            categories = ET.SubElement(default_ingredient_filter, "categories")
-            category = ET.SubElement(categories, "li")
-            category.text = "Root"
-            
-            # Recipe users (what workbenches can use this recipe)
-            recipe_users = ET.SubElement(recipe_def, "recipeUsers")
-            user = ET.SubElement(recipe_users, "li")
-            user.text = "CraftingSpot"  # Basic crafting spot
+        # DefName
+        defname = ET.SubElement(recipe_def, "defName")
+        defname.text = recipe['defName']
         
-        # Write to file
-        rough_string = ET.tostring(root, 'unicode')
-        reparsed = minidom.parseString(rough_string)
+        # Label
+        label = ET.SubElement(recipe_def, "label")
+        label.text = recipe['label']
         
-        recipes_path = os.path.join(defs_folder, "Recipes.xml")
-        with open(recipes_path, 'w', encoding='utf-8') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        # Description
+        description = ET.SubElement(recipe_def, "description")
+        description.text = recipe['description']
+        
+        # Job string
+        job_string = ET.SubElement(recipe_def, "jobString")
+        job_string.text = f"Making {recipe['label']}."
+        
+        # Work amount
+        work_amount = ET.SubElement(recipe_def, "workAmount")
+        work_amount.text = str(recipe['workAmount'])
+        
+        # Work skill
+        work_skill = ET.SubElement(recipe_def, "workSkill")
+        work_skill.text = "Crafting"
+        
+        # Effect working
+        effect_working = ET.SubElement(recipe_def, "effectWorking")
+        effect_working.text = "Cook"
+        
+        # Sound working
+        sound_working = ET.SubElement(recipe_def, "soundWorking")
+        sound_working.text = "Recipe_CookMeal"
+        
+        # Ingredients
+        ingredients = ET.SubElement(recipe_def, "ingredients")
+        
+        # Parse ingredient string (format: DefName:Count)
+        for ingredient_str in recipe['ingredients'].split(','):
+            ingredient_str = ingredient_str.strip()
+            if ':' in ingredient_str:
+                ing_name, ing_count = ingredient_str.split(':', 1)
+                ing_name = ing_name.strip()
+                ing_count = ing_count.strip()
+                
+                ingredient = ET.SubElement(ingredients, "li")
+                filter_elem = ET.SubElement(ingredient, "filter")
+                things_defs = ET.SubElement(filter_elem, "thingDefs")
+                thing_def = ET.SubElement(things_defs, "li")
+                thing_def.text = ing_name
+                
+                count = ET.SubElement(ingredient, "count")
+                count.text = ing_count
+        
+        # Products
+        products = ET.SubElement(recipe_def, "products")
+        product = ET.SubElement(products, recipe['product'])
+        product.text = str(recipe['productCount'])
+        
+        # Default ingredient filter
+        default_ingredient_filter = ET.SubElement(recipe_def, "defaultIngredientFilter")
+        categories = ET.SubElement(default_ingredient_filter, "categories")
+        category = ET.SubElement(categories, "li")
+        category.text = "Root"
+        
+        # Recipe users (what workbenches can use this recipe)
+        recipe_users = ET.SubElement(recipe_def, "recipeUsers")
+        user = ET.SubElement(recipe_users, "li")
+        user.text = "CraftingSpot"  # Basic crafting spot
+        
+        return recipe_def
     
     def generate_research_unlock_patches(self, patches_folder):
         """Generate patches to add research prerequisites to items/weapons/buildings/cosmetics"""
@@ -1032,69 +1688,118 @@ class XMLGenerator:
         
         patches = []
         
-        for research in self.app.research:
-            research_defname = research['defName']
-            
-            # Create patches for items
-            for item_text in research['unlockedItems']:
-                if ' - ' in item_text:
-                    item_defname = item_text.split(' - ')[0]
-                    patches.append(self._create_research_patch(item_defname, research_defname))
-            
-            # Create patches for weapons
-            for weapon_text in research['unlockedWeapons']:
-                if ' - ' in weapon_text:
-                    weapon_defname = weapon_text.split(' - ')[0]
-                    patches.append(self._create_research_patch(weapon_defname, research_defname))
-            
-            # Create patches for buildings
-            for building_text in research['unlockedBuildings']:
-                if ' - ' in building_text:
-                    building_defname = building_text.split(' - ')[0]
-                    patches.append(self._create_research_patch(building_defname, research_defname))
-            
-            # Create patches for cosmetics
-            for cosmetic_text in research['unlockedCosmetics']:
-                if ' - ' in cosmetic_text:
-                    cosmetic_defname = cosmetic_text.split(' - ')[0]
-                    patches.append(self._create_research_patch(cosmetic_defname, research_defname))
-            
-            # Create patches for drugs
-            for drug_text in research['unlockedDrugs']:
-                if ' - ' in drug_text:
-                    drug_defname = drug_text.split(' - ')[0]
-                    patches.append(self._create_research_patch(drug_defname, research_defname))
-            
-            # Create patches for workbenches
-            for workbench_text in research['unlockedWorkbenches']:
-                if ' - ' in workbench_text:
-                    workbench_defname = workbench_text.split(' - ')[0]
-                    patches.append(self._create_research_patch(workbench_defname, research_defname))
+        if self.patch_mode == "per_def":
+            # One operation for every unlocked def of every research project
+            for research in self.app.research:
+                for field in RESEARCH_UNLOCK_FIELDS.values():
+                    for def_name in research[field]:
+                        patches.append(self._create_research_patch([def_name], [research['defName']]))
+        else:
+            # One operation for all defs that share the same prerequisites.
+            # In inline mode the mod's own defs already carry theirs.
+            exclude = own_thing_def_names(self.app) if self.patch_mode == "inline" else ()
+            for prerequisites, def_names in group_research_unlocks(self.app.research, exclude):
+                patches.append(self._create_research_patch(def_names, prerequisites))
         
         if patches:
             # Write patches to file
-            root = ET.Element("Patch")
-            
-            for patch in patches:
-                root.append(patch)
-            
-            rough_string = ET.tostring(root, 'unicode')
-            reparsed = minidom.parseString(rough_string)
-            
             patch_path = os.path.join(patches_folder, "ResearchUnlocks.xml")
-            with open(patch_path, 'w', encoding='utf-8') as f:
-                f.write(reparsed.toprettyxml(indent="  "))
+            self._write_xml(patch_path, "Patch", patches)
     
-    def _create_research_patch(self, def_name, research_defname):
-        """Create a research prerequisite patch for a specific def"""
+    def _create_research_patch(self, def_names, research_defnames):
+        """Create a patch adding the research prerequisites to the given defs"""
         operation = ET.Element("Operation", Class="PatchOperationAdd")
         
         xpath = ET.SubElement(operation, "xpath")
-        xpath.text = f"Defs/ThingDef[defName='{def_name}']"
+        predicate = " or ".join(f"defName='{def_name}'" for def_name in def_names)
+        xpath.text = f"Defs/ThingDef[{predicate}]"
         
         value = ET.SubElement(operation, "value")
         research_prerequisites = ET.SubElement(value, "researchPrerequisites")
-        prerequisite = ET.SubElement(research_prerequisites, "li")
-        prerequisite.text = research_defname
+        for research_defname in research_defnames:
+            prerequisite = ET.SubElement(research_prerequisites, "li")
+            prerequisite.text = research_defname
         
         return operation
+    
+    def generate_language_xml(self, mod_folder):
+        """Generate the English keyed language file with description keys"""
+        lang_folder = os.path.join(mod_folder, "Languages", "English", "Keyed")
+        
+        # Create a basic language file with keys for custom content
+        lang_content = []
+        lang_content.append('<?xml version="1.0" encoding="utf-8" ?>')
+        lang_content.append('<LanguageData>')
+        lang_content.append('')
+        lang_content.append('  <!-- Mod-specific translations can be added here -->')
+        
+        # Add language keys for items
+        if self.app.items:
+            lang_content.append('')
+            lang_content.append('  <!-- Items -->')
+            for item in self.app.items:
+                safe_name = item['defName'].replace(' ', '_')
+                if item.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{item["description"]}</{safe_name}.description>')
+        
+        # Add language keys for weapons
+        if self.app.weapons:
+            lang_content.append('')
+            lang_content.append('  <!-- Weapons -->')
+            for weapon in self.app.weapons:
+                safe_name = weapon['defName'].replace(' ', '_')
+                if weapon.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{weapon["description"]}</{safe_name}.description>')
+        
+        # Add language keys for buildings
+        if self.app.buildings:
+            lang_content.append('')
+            lang_content.append('  <!-- Buildings -->')
+            for building in self.app.buildings:
+                safe_name = building['defName'].replace(' ', '_')
+                if building.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{building["description"]}</{safe_name}.description>')
+        
+        # Add language keys for cosmetics
+        if self.app.cosmetics:
+            lang_content.append('')
+            lang_content.append('  <!-- Cosmetics -->')
+            for cosmetic in self.app.cosmetics:
+                safe_name = cosmetic['defName'].replace(' ', '_')
+                if cosmetic.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{cosmetic["description"]}</{safe_name}.description>')
+        
+        # Add language keys for drugs
+        if self.app.drugs:
+            lang_content.append('')
+            lang_content.append('  <!-- Drugs -->')
+            for drug in self.app.drugs:
+                safe_name = drug['defName'].replace(' ', '_')
+                if drug.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{drug["description"]}</{safe_name}.description>')
+        
+        # Add language keys for workbenches
+        if self.app.workbenches:
+            lang_content.append('')
+            lang_content.append('  <!-- Workbenches -->')
+            for workbench in self.app.workbenches:
+                safe_name = workbench['defName'].replace(' ', '_')
+                if workbench.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{workbench["description"]}</{safe_name}.description>')
+        
+        # Add language keys for research
+        if self.app.research:
+            lang_content.append('')
+            lang_content.append('  <!-- Research -->')
+            for research in self.app.research:
+                safe_name = research['defName'].replace(' ', '_')
+                if research.get('description'):
+                    lang_content.append(f'  <{safe_name}.description>{research["description"]}</{safe_name}.description>')
+        
+        lang_content.append('')
+        lang_content.append('</LanguageData>')
+        
+        # Write language file
+        lang_file_path = os.path.join(lang_folder, "ModLanguage.xml")
+        with self._open_output(lang_file_path) as f:
+            f.write('\n'.join(lang_content))
@@ -7,13 +7,31 @@ import tkinter as tk
 from tkinter import messagebox, filedialog
 from tkinter import END
 import os
-import shutil
+
+from assets import copy_assets
+from project import CONTENT_LABELS, unlock_reference
 
 
 class ContentManager:
     def __init__(self, app):
         self.app = app
     
+    def check_unique_defname(self, defname):
+        """Show an error and return False if any content already uses defname"""
+        existing = self.app.def_index.get(defname)
+        if existing:
+            messagebox.showerror("Error", f"{CONTENT_LABELS[existing[0]]} with DefName '{defname}' already exists!")
+            return False
+        return True
+    
+    def describe_unlocks(self, defname):
+        """Describe the research projects that unlock defname, for removal prompts"""
+        research_defnames = self.app.def_index.unlocked_by(defname)
+        if not research_defnames:
+            return ""
+        return (f"\n\nIt is unlocked by research {', '.join(research_defnames)} "
+                f"and will be removed from those projects.")
+    
     def add_item(self):
         """Add a new item to the mod"""
         defname = self.app.item_defname.get().strip()
@@ -24,11 +42,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for item in self.app.items:
-            if item['defName'] == defname:
-                messagebox.showerror("Error", f"Item with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             market_value = float(self.app.item_market_value.get() or "10.0")
@@ -53,6 +69,8 @@ class ContentManager:
         }
         
         self.app.items.append(item)
+        self.app.def_index.add("items", item)
+        self.app.schedule_shadow_build()
         self.app.items_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -83,8 +101,11 @@ class ContentManager:
         index = selection[0]
         item = self.app.items[index]
         
-        if messagebox.askyesno("Confirm", f"Remove item '{item['label']}'?"):
+        if messagebox.askyesno("Confirm", f"Remove item '{item['label']}'?" + self.describe_unlocks(item['defName'])):
+            self.app.def_index.drop_unlocks(item['defName'])
+            self.app.def_index.remove(item)
             del self.app.items[index]
+            self.app.schedule_shadow_build()
             self.app.items_listbox.delete(index)
             messagebox.showinfo("Success", "Item removed successfully!")
     
@@ -98,11 +119,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for weapon in self.app.weapons:
-            if weapon['defName'] == defname:
-                messagebox.showerror("Error", f"Weapon with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             damage = int(self.app.weapon_damage.get() or "10")
@@ -129,6 +148,8 @@ class ContentManager:
         }
         
         self.app.weapons.append(weapon)
+        self.app.def_index.add("weapons", weapon)
+        self.app.schedule_shadow_build()
         self.app.weapons_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -160,8 +181,11 @@ class ContentManager:
         index = selection[0]
         weapon = self.app.weapons[index]
         
-        if messagebox.askyesno("Confirm", f"Remove weapon '{weapon['label']}'?"):
+        if messagebox.askyesno("Confirm", f"Remove weapon '{weapon['label']}'?" + self.describe_unlocks(weapon['defName'])):
+            self.app.def_index.drop_unlocks(weapon['defName'])
+            self.app.def_index.remove(weapon)
             del self.app.weapons[index]
+            self.app.schedule_shadow_build()
             self.app.weapons_listbox.delete(index)
             messagebox.showinfo("Success", "Weapon removed successfully!")
     
@@ -175,11 +199,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for building in self.app.buildings:
-            if building['defName'] == defname:
-                messagebox.showerror("Error", f"Building with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             hitpoints = int(self.app.building_hitpoints.get() or "100")
@@ -202,6 +224,8 @@ class ContentManager:
         }
         
         self.app.buildings.append(building)
+        self.app.def_index.add("buildings", building)
+        self.app.schedule_shadow_build()
         self.app.buildings_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -231,8 +255,11 @@ class ContentManager:
         index = selection[0]
         building = self.app.buildings[index]
         
-        if messagebox.askyesno("Confirm", f"Remove building '{building['label']}'?"):
+        if messagebox.askyesno("Confirm", f"Remove building '{building['label']}'?" + self.describe_unlocks(building['defName'])):
+            self.app.def_index.drop_unlocks(building['defName'])
+            self.app.def_index.remove(building)
             del self.app.buildings[index]
+            self.app.schedule_shadow_build()
             self.app.buildings_listbox.delete(index)
             messagebox.showinfo("Success", "Building removed successfully!")
     
@@ -246,11 +273,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for cosmetic in self.app.cosmetics:
-            if cosmetic['defName'] == defname:
-                messagebox.showerror("Error", f"Cosmetic with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             armor_sharp = float(self.app.cosmetic_armor_sharp.get() or "0.0")
@@ -285,6 +310,8 @@ class ContentManager:
         }
         
         self.app.cosmetics.append(cosmetic)
+        self.app.def_index.add("cosmetics", cosmetic)
+        self.app.schedule_shadow_build()
         self.app.cosmetics_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -324,8 +351,11 @@ class ContentManager:
         index = selection[0]
         cosmetic = self.app.cosmetics[index]
         
-        if messagebox.askyesno("Confirm", f"Remove cosmetic '{cosmetic['label']}'?"):
+        if messagebox.askyesno("Confirm", f"Remove cosmetic '{cosmetic['label']}'?" + self.describe_unlocks(cosmetic['defName'])):
+            self.app.def_index.drop_unlocks(cosmetic['defName'])
+            self.app.def_index.remove(cosmetic)
             del self.app.cosmetics[index]
+            self.app.schedule_shadow_build()
             self.app.cosmetics_listbox.delete(index)
             messagebox.showinfo("Success", "Cosmetic removed successfully!")
     
@@ -339,11 +369,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for drug in self.app.drugs:
-            if drug['defName'] == defname:
-                messagebox.showerror("Error", f"Drug with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             addiction_chance = float(self.app.drug_addiction_chance.get() or "0.0")
@@ -382,6 +410,8 @@ class ContentManager:
         }
         
         self.app.drugs.append(drug)
+        self.app.def_index.add("drugs", drug)
+        self.app.schedule_shadow_build()
         self.app.drugs_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -426,8 +456,11 @@ class ContentManager:
         index = selection[0]
         drug = self.app.drugs[index]
         
-        if messagebox.askyesno("Confirm", f"Remove drug '{drug['label']}'?"):
+        if messagebox.askyesno("Confirm", f"Remove drug '{drug['label']}'?" + self.describe_unlocks(drug['defName'])):
+            self.app.def_index.drop_unlocks(drug['defName'])
+            self.app.def_index.remove(drug)
             del self.app.drugs[index]
+            self.app.schedule_shadow_build()
             self.app.drugs_listbox.delete(index)
             messagebox.showinfo("Success", "Drug removed successfully!")
     
@@ -441,11 +474,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for workbench in self.app.workbenches:
-            if workbench['defName'] == defname:
-                messagebox.showerror("Error", f"Workbench with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             hitpoints = int(self.app.workbench_hitpoints.get() or "180")
@@ -478,6 +509,8 @@ class ContentManager:
         }
         
         self.app.workbenches.append(workbench)
+        self.app.def_index.add("workbenches", workbench)
+        self.app.schedule_shadow_build()
         self.app.workbenches_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -515,8 +548,11 @@ class ContentManager:
         index = selection[0]
         workbench = self.app.workbenches[index]
         
-        if messagebox.askyesno("Confirm", f"Remove workbench '{workbench['label']}'?"):
+        if messagebox.askyesno("Confirm", f"Remove workbench '{workbench['label']}'?" + self.describe_unlocks(workbench['defName'])):
+            self.app.def_index.drop_unlocks(workbench['defName'])
+            self.app.def_index.remove(workbench)
             del self.app.workbenches[index]
+            self.app.schedule_shadow_build()
             self.app.workbenches_listbox.delete(index)
             messagebox.showinfo("Success", "Workbench removed successfully!")
     
@@ -530,11 +566,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for research in self.app.research:
-            if research['defName'] == defname:
-                messagebox.showerror("Error", f"Research with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             cost = int(self.app.research_cost.get() or "500")
@@ -544,13 +578,14 @@ class ContentManager:
         
         tech_level = self.app.research_tech_level.get()
         
-        # Get unlocked items, weapons, buildings, cosmetics, drugs, workbenches
-        unlocked_items = [self.app.research_unlocked_items.get(i) for i in self.app.research_unlocked_items.curselection()]
-        unlocked_weapons = [self.app.research_unlocked_weapons.get(i) for i in self.app.research_unlocked_weapons.curselection()]
-        unlocked_buildings = [self.app.research_unlocked_buildings.get(i) for i in self.app.research_unlocked_buildings.curselection()]
-        unlocked_cosmetics = [self.app.research_unlocked_cosmetics.get(i) for i in self.app.research_unlocked_cosmetics.curselection()]
-        unlocked_drugs = [self.app.research_unlocked_drugs.get(i) for i in self.app.research_unlocked_drugs.curselection()]
-        unlocked_workbenches = [self.app.research_unlocked_workbenches.get(i) for i in self.app.research_unlocked_workbenches.curselection()]
+        # Get unlocked items, weapons, buildings, cosmetics, drugs, workbenches,
+        # stored by defName so that later label changes do not break the link
+        unlocked_items = [unlock_reference(self.app.research_unlocked_items.get(i)) for i in self.app.research_unlocked_items.curselection()]
+        unlocked_weapons = [unlock_reference(self.app.research_unlocked_weapons.get(i)) for i in self.app.research_unlocked_weapons.curselection()]
+        unlocked_buildings = [unlock_reference(self.app.research_unlocked_buildings.get(i)) for i in self.app.research_unlocked_buildings.curselection()]
+        unlocked_cosmetics = [unlock_reference(self.app.research_unlocked_cosmetics.get(i)) for i in self.app.research_unlocked_cosmetics.curselection()]
+        unlocked_drugs = [unlock_reference(self.app.research_unlocked_drugs.get(i)) for i in self.app.research_unlocked_drugs.curselection()]
+        unlocked_workbenches = [unlock_reference(self.app.research_unlocked_workbenches.get(i)) for i in self.app.research_unlocked_workbenches.curselection()]
         
         research = {
             'defName': defname,
@@ -567,6 +602,8 @@ class ContentManager:
         }
         
         self.app.research.append(research)
+        self.app.def_index.add("research", research)
+        self.app.schedule_shadow_build()
         self.app.research_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -596,7 +633,9 @@ class ContentManager:
         research = self.app.research[index]
         
         if messagebox.askyesno("Confirm", f"Remove research '{research['label']}'?"):
+            self.app.def_index.remove(research)
             del self.app.research[index]
+            self.app.schedule_shadow_build()
             self.app.research_listbox.delete(index)
             messagebox.showinfo("Success", "Research removed successfully!")
     
@@ -610,11 +649,9 @@ class ContentManager:
             messagebox.showerror("Error", "DefName and Label are required!")
             return
         
-        # Check for duplicate defnames
-        for recipe in self.app.recipes:
-            if recipe['defName'] == defname:
-                messagebox.showerror("Error", f"Recipe with DefName '{defname}' already exists!")
-                return
+        # Check for duplicate defnames across all content types
+        if not self.check_unique_defname(defname):
+            return
         
         try:
             work = int(self.app.recipe_work.get() or "100")
@@ -637,6 +674,8 @@ class ContentManager:
         }
         
         self.app.recipes.append(recipe)
+        self.app.def_index.add("recipes", recipe)
+        self.app.schedule_shadow_build()
         self.app.recipes_listbox.insert(END, f"{defname} - {label}")
         
         # Clear form
@@ -664,7 +703,9 @@ class ContentManager:
         recipe = self.app.recipes[index]
         
         if messagebox.askyesno("Confirm", f"Remove recipe '{recipe['label']}'?"):
+            self.app.def_index.remove(recipe)
             del self.app.recipes[index]
+            self.app.schedule_shadow_build()
             self.app.recipes_listbox.delete(index)
             messagebox.showinfo("Success", "Recipe removed successfully!")
     
@@ -905,6 +946,7 @@ class AssetManager:
         if filename:
             self.app.selected_item_texture = filename
             self.app.item_texture_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_item_sound(self):
         """Select sound file for item"""
@@ -915,6 +957,7 @@ class AssetManager:
         if filename:
             self.app.selected_item_sound = filename
             self.app.item_sound_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_weapon_texture(self):
         """Select texture file for weapon"""
@@ -925,6 +968,7 @@ class AssetManager:
         if filename:
             self.app.selected_weapon_texture = filename
             self.app.weapon_texture_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_weapon_sound(self):
         """Select sound file for weapon"""
@@ -935,6 +979,7 @@ class AssetManager:
         if filename:
             self.app.selected_weapon_sound = filename
             self.app.weapon_sound_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_building_texture(self):
         """Select texture file for building"""
@@ -945,6 +990,7 @@ class AssetManager:
         if filename:
             self.app.selected_building_texture = filename
             self.app.building_texture_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_building_sound(self):
         """Select sound file for building"""
@@ -955,6 +1001,7 @@ class AssetManager:
         if filename:
             self.app.selected_building_sound = filename
             self.app.building_sound_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_cosmetic_texture(self):
         """Select texture file for cosmetic"""
@@ -965,6 +1012,7 @@ class AssetManager:
         if filename:
             self.app.selected_cosmetic_texture = filename
             self.app.cosmetic_texture_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_cosmetic_sound(self):
         """Select sound file for cosmetic"""
@@ -975,6 +1023,7 @@ class AssetManager:
         if filename:
             self.app.selected_cosmetic_sound = filename
             self.app.cosmetic_sound_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_drug_texture(self):
         """Select texture file for drug"""
@@ -985,6 +1034,7 @@ class AssetManager:
         if filename:
             self.app.selected_drug_texture = filename
             self.app.drug_texture_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_drug_sound(self):
         """Select sound file for drug"""
@@ -995,6 +1045,7 @@ class AssetManager:
         if filename:
             self.app.selected_drug_sound = filename
             self.app.drug_sound_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_workbench_texture(self):
         """Select texture file for workbench"""
@@ -1005,6 +1056,7 @@ class AssetManager:
         if filename:
             self.app.selected_workbench_texture = filename
             self.app.workbench_texture_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
     def select_workbench_sound(self):
         """Select sound file for workbench"""
@@ -1015,130 +1067,24 @@ class AssetManager:
         if filename:
             self.app.selected_workbench_sound = filename
             self.app.workbench_sound_label.config(text=os.path.basename(filename))
+            self.prefetch_asset(filename)
     
-    def copy_assets(self, mod_folder):
-        """Copy selected asset files to the mod folder"""
-        copied_assets = []
-        
-        # Create textures and sounds directories
-        textures_dir = os.path.join(mod_folder, "Textures", "Things")
-        sounds_dir = os.path.join(mod_folder, "Sounds")
-        
-        os.makedirs(textures_dir, exist_ok=True)
-        os.makedirs(sounds_dir, exist_ok=True)
+    def prefetch_asset(self, filename):
+        """Check, hash and stage a selected file in the background, warning
+        about files that are not a valid texture or sound"""
+        future = self.app.asset_prefetcher.submit(filename)
+        
+        def check_result():
+            if not future.done():
+                self.app.root.after(100, check_result)
+                return
+            try:
+                future.result()
+            except (OSError, ValueError) as e:
+                messagebox.showwarning("Asset Warning", f"This file may not work in RimWorld:\n{e}")
         
-        # Copy item assets
-        for item in self.app.items:
-            if item.get('texture'):
-                try:
-                    dest_path = os.path.join(textures_dir, f"{item['defName']}.png")
-                    shutil.copy2(item['texture'], dest_path)
-                    copied_assets.append(f"Item texture: {item['defName']}.png")
-                except Exception as e:
-                    print(f"Error copying item texture: {e}")
-            
-            if item.get('sound'):
-                try:
-                    ext = os.path.splitext(item['sound'])[1]
-                    dest_path = os.path.join(sounds_dir, f"{item['defName']}{ext}")
-                    shutil.copy2(item['sound'], dest_path)
-                    copied_assets.append(f"Item sound: {item['defName']}{ext}")
-                except Exception as e:
-                    print(f"Error copying item sound: {e}")
-        
-        # Copy weapon assets
-        for weapon in self.app.weapons:
-            if weapon.get('texture'):
-                try:
-                    dest_path = os.path.join(textures_dir, f"{weapon['defName']}.png")
-                    shutil.copy2(weapon['texture'], dest_path)
-                    copied_assets.append(f"Weapon texture: {weapon['defName']}.png")
-                except Exception as e:
-                    print(f"Error copying weapon texture: {e}")
-            
-            if weapon.get('sound'):
-                try:
-                    ext = os.path.splitext(weapon['sound'])[1]
-                    dest_path = os.path.join(sounds_dir, f"{weapon['defName']}{ext}")
-                    shutil.copy2(weapon['sound'], dest_path)
-                    copied_assets.append(f"Weapon sound: {weapon['defName']}{ext}")
-                except Exception as e:
-                    print(f"Error copying weapon sound: {e}")
-        
-        # Copy building assets
-        for building in self.app.buildings:
-            if building.get('texture'):
-                try:
-                    dest_path = os.path.join(textures_dir, f"{building['defName']}.png")
-                    shutil.copy2(building['texture'], dest_path)
-                    copied_assets.append(f"Building texture: {building['defName']}.png")
-                except Exception as e:
-                    print(f"Error copying building texture: {e}")
-            
-            if building.get('sound'):
-                try:
-                    ext = os.path.splitext(building['sound'])[1]
-                    dest_path = os.path.join(sounds_dir, f"{building['defName']}{ext}")
-                    shutil.copy2(building['sound'], dest_path)
-                    copied_assets.append(f"Building sound: {building['defName']}{ext}")
-                except Exception as e:
-                    print(f"Error copying building sound: {e}")
-        
-        # Copy cosmetic assets
-        for cosmetic in self.app.cosmetics:
-            if cosmetic.get('texture'):
-                try:
-                    dest_path = os.path.join(textures_dir, f"{cosmetic['defName']}.png")
-                    shutil.copy2(cosmetic['texture'], dest_path)
-                    copied_assets.append(f"Cosmetic texture: {cosmetic['defName']}.png")
-                except Exception as e:
-                    print(f"Error copying cosmetic texture: {e}")
-            
-            if cosmetic.get('sound'):
-                try:
-                    ext = os.path.splitext(cosmetic['sound'])[1]
-                    dest_path = os.path.join(sounds_dir, f"{cosmetic['defName']}{ext}")
-                    shutil.copy2(cosmetic['sound'], dest_path)
-                    copied_assets.append(f"Cosmetic sound: {cosmetic['defName']}{ext}")
-                except Exception as e:
-                    print(f"Error copying cosmetic sound: {e}")
-        
-        # Copy drug assets
-        for drug in self.app.drugs:
-            if drug.get('texture'):
-                try:
-                    dest_path = os.path.join(textures_dir, f"{drug['defName']}.png")
-                    shutil.copy2(drug['texture'], dest_path)
-                    copied_assets.append(f"Drug texture: {drug['defName']}.png")
-                except Exception as e:
-                    print(f"Error copying drug texture: {e}")
-            
-            if drug.get('sound'):
-                try:
-                    ext = os.path.splitext(drug['sound'])[1]
-                    dest_path = os.path.join(sounds_dir, f"{drug['defName']}{ext}")
-                    shutil.copy2(drug['sound'], dest_path)
-                    copied_assets.append(f"Drug sound: {drug['defName']}{ext}")
-                except Exception as e:
-                    print(f"Error copying drug sound: {e}")
-        
-        # Copy workbench assets
-        for workbench in self.app.workbenches:
-            if workbench.get('texture'):
-                try:
-                    dest_path = os.path.join(textures_dir, f"{workbench['defName']}.png")
-                    shutil.copy2(workbench['texture'], dest_path)
-                    copied_assets.append(f"Workbench texture: {workbench['defName']}.png")
-                except Exception as e:
-                    print(f"Error copying workbench texture: {e}")
-            
-            if workbench.get('sound'):
-                try:
-                    ext = os.path.splitext(workbench['sound'])[1]
-                    dest_path = os.path.join(sounds_dir, f"{workbench['defName']}{ext}")
-                    shutil.copy2(workbench['sound'], dest_path)
-                    copied_assets.append(f"Workbench sound: {workbench['defName']}{ext}")
-                except Exception as e:
-                    print(f"Error copying workbench sound: {e}")
-        
-        return copied_assets
+        check_result()
+    
+    def copy_assets(self, mod_folder, mode="copy", progress=None):
+        """Copy selected asset files to the mod folder, returning a CopyReport"""
+        return copy_assets(self.app, mod_folder, mode, progress=progress)
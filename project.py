@@ -0,0 +1,238 @@
+"""
+Rimworld Mod Maker - Project Model Module
+Contains a plain-data snapshot of a mod's content that can be built without the GUI.
+"""
+
+import copy
+import json
+
+
+# Content lists every project carries, in the order they are built
+CONTENT_TYPES = (
+    "items",
+    "weapons",
+    "buildings",
+    "cosmetics",
+    "drugs",
+    "workbenches",
+    "research",
+    "recipes"
+)
+
+# Display label of the records in each content list
+CONTENT_LABELS = {
+    "items": "Item",
+    "weapons": "Weapon",
+    "buildings": "Building",
+    "cosmetics": "Cosmetic",
+    "drugs": "Drug",
+    "workbenches": "Workbench",
+    "research": "Research",
+    "recipes": "Recipe"
+}
+
+# Research field listing the unlocked defs of each content type that
+# becomes a ThingDef
+RESEARCH_UNLOCK_FIELDS = {
+    "items": "unlockedItems",
+    "weapons": "unlockedWeapons",
+    "buildings": "unlockedBuildings",
+    "cosmetics": "unlockedCosmetics",
+    "drugs": "unlockedDrugs",
+    "workbenches": "unlockedWorkbenches"
+}
+THING_CONTENT_TYPES = tuple(RESEARCH_UNLOCK_FIELDS)
+
+DEFAULT_MOD_INFO = {
+    'name': '',
+    'author': '',
+    'version': '',
+    'description': ''
+}
+
+
+def unlock_reference(text):
+    """Return the defName a research unlock entry refers to.
+
+    Unlocks are stored as plain defNames. Older versions stored the
+    "defName - label" text shown in the research tab instead.
+    """
+    return text.split(' - ')[0].strip()
+
+
+def normalize_research_unlocks(research_projects):
+    """Rewrite the unlock lists of research records to unique plain defNames, in place"""
+    for research in research_projects:
+        for field in RESEARCH_UNLOCK_FIELDS.values():
+            references = []
+            seen = set()
+            for text in research.get(field) or []:
+                def_name = unlock_reference(text)
+                if def_name and def_name not in seen:
+                    seen.add(def_name)
+                    references.append(def_name)
+            research[field] = references
+    return research_projects
+
+
+def build_unlock_index(research_projects):
+    """Map every unlocked defName to the defNames of the research projects
+    that unlock it, both in first-seen order"""
+    unlocked_by = {}
+    for research in research_projects:
+        for field in RESEARCH_UNLOCK_FIELDS.values():
+            for def_name in research.get(field, []):
+                prerequisites = unlocked_by.setdefault(def_name, [])
+                if research['defName'] not in prerequisites:
+                    prerequisites.append(research['defName'])
+    return unlocked_by
+
+
+class ModProject:
+    """Mod content detached from the Tk widgets it was entered in.
+
+    Exposes the same content lists as ModMakerApp, so XMLGenerator can be
+    pointed at either. Projects hold only plain data and can be handed to
+    worker threads or pickled into worker processes.
+    """
+
+    def __init__(self, mod_info=None, settings=None, **content):
+        self.mod_info = dict(DEFAULT_MOD_INFO, **(mod_info or {}))
+        self.settings = dict(settings or {})
+        for content_type in CONTENT_TYPES:
+            setattr(self, content_type, list(content.get(content_type) or []))
+
+    @classmethod
+    def from_app(cls, app):
+        """Snapshot the content of a running ModMakerApp.
+
+        Records are copied, so the snapshot can be built on another thread
+        while the user keeps editing.
+        """
+        content = {content_type: copy.deepcopy(getattr(app, content_type)) for content_type in CONTENT_TYPES}
+        return cls(app.get_mod_info(), **content)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a project from the data written by FileUtils.export_mod_data"""
+        content = {content_type: data.get(content_type, []) for content_type in CONTENT_TYPES}
+        normalize_research_unlocks(content['research'])
+        return cls(data.get('mod_info'), data.get('settings'), **content)
+
+    @classmethod
+    def load(cls, path):
+        """Load a project exported with File > Export Mod Data"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        """Return the project in the export file format"""
+        data = {'mod_info': self.get_mod_info()}
+        for content_type in CONTENT_TYPES:
+            data[content_type] = getattr(self, content_type)
+        data['settings'] = dict(self.settings)
+        return data
+
+    def get_mod_info(self):
+        """Return the mod name, author, version and description"""
+        return dict(self.mod_info)
+
+
+class DefIndex:
+    """Hash map from defName to (content type, record) over all content lists.
+
+    Lets duplicate defNames be found in constant time across every content
+    type, and keeps a reverse index from each unlocked defName to the
+    research projects that unlock it. Whoever adds or removes records must
+    keep the index in sync, or call rebuild() after replacing the lists
+    wholesale.
+    """
+
+    def __init__(self):
+        self._defs = {}
+        self._unlocked_by = {}
+
+    @classmethod
+    def from_project(cls, project):
+        """Index the content lists of a ModProject or ModMakerApp"""
+        index = cls()
+        index.rebuild(project)
+        return index
+
+    def __contains__(self, def_name):
+        return def_name in self._defs
+
+    def __len__(self):
+        return len(self._defs)
+
+    def get(self, def_name):
+        """Return (content type, record) for def_name, or None"""
+        return self._defs.get(def_name)
+
+    def add(self, content_type, record):
+        """Index a record; returns False if its defName is already taken"""
+        def_name = record['defName']
+        if def_name in self._defs:
+            return False
+        self._defs[def_name] = (content_type, record)
+        if content_type == "research":
+            for unlocked in self._unlocks(record):
+                self._unlocked_by.setdefault(unlocked, []).append(def_name)
+        return True
+
+    def remove(self, record):
+        """Drop a record from the index.
+
+        Nothing is dropped unless the defName is indexed under this very
+        record, so removing the second copy of a duplicate left by an import
+        keeps the first one indexed.
+        """
+        entry = self._defs.get(record['defName'])
+        if entry is None or entry[1] is not record:
+            return
+        del self._defs[record['defName']]
+        if entry[0] == "research":
+            for unlocked in self._unlocks(record):
+                prerequisites = self._unlocked_by[unlocked]
+                prerequisites.remove(record['defName'])
+                if not prerequisites:
+                    del self._unlocked_by[unlocked]
+
+    def clear(self):
+        self._defs.clear()
+        self._unlocked_by.clear()
+
+    def unlocked_by(self, def_name):
+        """Return the defNames of the research projects that unlock def_name"""
+        return list(self._unlocked_by.get(def_name, ()))
+
+    def drop_unlocks(self, def_name):
+        """Remove def_name from the unlock lists of every research project"""
+        for research_defname in self._unlocked_by.pop(def_name, ()):
+            research = self._defs[research_defname][1]
+            for field in RESEARCH_UNLOCK_FIELDS.values():
+                if def_name in research.get(field, []):
+                    research[field].remove(def_name)
+
+    @staticmethod
+    def _unlocks(research):
+        """Return the unique defNames a research record unlocks"""
+        return dict.fromkeys(
+            def_name
+            for field in RESEARCH_UNLOCK_FIELDS.values()
+            for def_name in research.get(field, [])
+        )
+
+    def rebuild(self, project):
+        """Re-index every content list of project.
+
+        Returns (content type, record, existing content type) for each record
+        whose defName was already used by an earlier one.
+        """
+        self.clear()
+        duplicates = []
+        for content_type in CONTENT_TYPES:
+            for record in getattr(project, content_type):
+                if not self.add(content_type, record):
+                    duplicates.append((content_type, record, self._defs[record['defName']][0]))
+        return duplicates
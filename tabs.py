@@ -7,6 +7,13 @@ import tkinter as tk
 from tkinter import Label, Button, Entry, Text, Frame, Scrollbar, BooleanVar, Checkbutton, Listbox, ttk
 from tkinter import VERTICAL, RIGHT, Y, LEFT, BOTH, END
 
+from builder import BUILD_PROFILES, DEFAULT_BUILD_PROFILE
+from textures import TEXTURE_FORMATS, DEFAULT_TEXTURE_FORMAT
+
+
+# Choices for the most defs per Defs file
+SHARD_SIZE_CHOICES = ("no limit", "100", "500", "1000", "5000")
+
 
 class TabCreator:
     def __init__(self, app):
@@ -121,6 +128,40 @@ class TabCreator:
         Checkbutton(info_scrollable_frame, text="Textures", variable=self.app.include_textures).pack(anchor="w", pady=2)
         Checkbutton(info_scrollable_frame, text="Sounds", variable=self.app.include_sounds).pack(anchor="w", pady=2)
         Checkbutton(info_scrollable_frame, text="Languages", variable=self.app.include_languages).pack(anchor="w", pady=2)
+        
+        # Build options
+        profile_frame = Frame(info_scrollable_frame)
+        profile_frame.pack(anchor="w", pady=(10, 2))
+        Label(profile_frame, text="Build profile (release writes compact XML):").pack(side=LEFT)
+        self.app.build_profile = ttk.Combobox(profile_frame, width=10, state="readonly", values=list(BUILD_PROFILES))
+        self.app.build_profile.set(DEFAULT_BUILD_PROFILE)
+        self.app.build_profile.pack(side=LEFT, padx=(10, 0))
+        
+        self.app.optimize_textures = BooleanVar(value=False)
+        Checkbutton(info_scrollable_frame, text="Optimize textures (repack and scale down oversized PNGs)",
+                    variable=self.app.optimize_textures).pack(anchor="w", pady=2)
+        
+        format_frame = Frame(info_scrollable_frame)
+        format_frame.pack(anchor="w", pady=2)
+        Label(format_frame, text="Texture format:").pack(side=LEFT)
+        self.app.texture_format = ttk.Combobox(format_frame, width=10, state="readonly", values=TEXTURE_FORMATS)
+        self.app.texture_format.set(DEFAULT_TEXTURE_FORMAT)
+        self.app.texture_format.pack(side=LEFT, padx=(10, 0))
+        
+        self.app.keep_previous_build = BooleanVar(value=False)
+        Checkbutton(info_scrollable_frame, text="Keep the previous build (File > Restore Previous Build)",
+                    variable=self.app.keep_previous_build).pack(anchor="w", pady=2)
+        
+        self.app.extract_parents = BooleanVar(value=False)
+        Checkbutton(info_scrollable_frame, text="Move shared def fields into abstract parent defs (smaller Defs files)",
+                    variable=self.app.extract_parents).pack(anchor="w", pady=2)
+        
+        shard_frame = Frame(info_scrollable_frame)
+        shard_frame.pack(anchor="w", pady=2)
+        Label(shard_frame, text="Defs per file:").pack(side=LEFT)
+        self.app.shard_defs = ttk.Combobox(shard_frame, width=10, state="readonly", values=SHARD_SIZE_CHOICES)
+        self.app.shard_defs.set(SHARD_SIZE_CHOICES[0])
+        self.app.shard_defs.pack(side=LEFT, padx=(10, 0))
     
     def create_items_tab(self):
         # Items Tab
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from assets import AssetStore, HashCache
+
+
+class AssetStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.store_folder = os.path.join(self.folder, "store")
+        self.hash_cache = HashCache()
+
+    def source(self, name, size=100):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write((name.encode() * size)[:size])
+        return path
+
+    def stage_at(self, store, source, days_ago):
+        """Stage source and make its copy look last used days_ago"""
+        sha256 = store.stage(source)
+        path = store.path_for(sha256, ".png")
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns() - days_ago * 24 * 3600 * 10 ** 9, stat.st_mtime_ns))
+        return sha256
+
+    def test_least_recently_used_copies_are_evicted(self):
+        store = AssetStore(self.store_folder, self.hash_cache, limit=250)
+        old, middle, new = (self.stage_at(store, self.source(name), days)
+                            for name, days in (("old.png", 30), ("middle.png", 20), ("new.png", 10)))
+
+        # A new session that uses the old copy again
+        store = AssetStore(self.store_folder, self.hash_cache, limit=250)
+        self.assertIsNotNone(store.lookup(old, ".png"))
+        self.assertEqual(store.evict(), 100)
+        self.assertIsNotNone(store.lookup(old, ".png"))
+        self.assertIsNone(store.lookup(middle, ".png"))
+        self.assertIsNotNone(store.lookup(new, ".png"))
+
+    def test_copies_used_by_the_session_are_kept(self):
+        store = AssetStore(self.store_folder, self.hash_cache, limit=0)
+        sha256 = self.stage_at(store, self.source("texture.png"), 30)
+        self.assertEqual(store.evict(), 0)
+        self.assertEqual(AssetStore(self.store_folder, self.hash_cache, limit=0).evict(), 100)
+        self.assertIsNone(store.lookup(sha256, ".png"))
+
+
+if __name__ == "__main__":
+    unittest.main()
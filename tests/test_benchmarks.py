@@ -0,0 +1,19 @@
+import unittest
+
+from benchmarks import run_benchmarks
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_outputs_grow_with_the_project(self):
+        document = run_benchmarks(sizes=(2, 6), stages=["assets", "research_patches"], progress=None, repeats=1)
+        results = {(result['stage'], result['defs_per_type']): result for result in document['results']}
+        self.assertGreater(results["assets", 6]['files'], results["assets", 2]['files'])
+        self.assertGreater(results["assets", 6]['output_bytes'], results["assets", 2]['output_bytes'])
+        # Measured with grouped patches, as inline prerequisites write none
+        self.assertGreater(results["research_patches", 2]['output_bytes'], 0)
+        self.assertGreater(results["research_patches", 6]['output_bytes'],
+                           results["research_patches", 2]['output_bytes'])
+
+
+if __name__ == "__main__":
+    unittest.main()
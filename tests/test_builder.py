@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import builder
+from benchmarks import synthetic_project
+from builder import MANIFEST_NAME, LOCAL_BUILDS_FOLDER, ModBuilder, build_folder, recover_interrupted_swap
+
+
+def modification_times(folder):
+    """Return {path relative to folder: mtime in ns} of every file"""
+    times = {}
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            times[os.path.relpath(path, folder)] = os.stat(path).st_mtime_ns
+    return times
+
+
+class IncrementalBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": os.path.join(self.folder, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = synthetic_project(10)
+        self.mod_folder = os.path.join(self.folder, "Mods", "Benchmark")
+
+    def build(self):
+        return ModBuilder(self.project).build(self.mod_folder)
+
+    def test_unchanged_build_reuses_everything(self):
+        self.build()
+        before = modification_times(self.mod_folder)
+        report = self.build()
+
+        self.assertEqual(report.bytes_written, 0)
+        self.assertIn("items", report.skipped_stages)
+        self.assertEqual(report.removed_files, [])
+        after = modification_times(self.mod_folder)
+        del before[MANIFEST_NAME], after[MANIFEST_NAME]
+        self.assertEqual(before, after)
+
+    def test_changed_def_only_rewrites_its_file(self):
+        self.build()
+        before = modification_times(self.mod_folder)
+        self.project.items[0]['label'] = "changed item"
+        report = self.build()
+
+        self.assertNotIn("items", report.skipped_stages)
+        self.assertIn("weapons", report.skipped_stages)
+        after = modification_times(self.mod_folder)
+        weapons = os.path.join("Defs", "Weapons.xml")
+        self.assertEqual(before[weapons], after[weapons])
+        with open(os.path.join(self.mod_folder, "Defs", "Items.xml"), encoding='utf-8') as f:
+            self.assertIn("changed item", f.read())
+
+
+
+class StagedBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache = os.path.join(self.folder, "cache")
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": self.cache})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = synthetic_project(3)
+        self.mods = os.path.join(self.folder, "Mods")
+        self.mod_folder = os.path.join(self.mods, "Benchmark")
+        self.staging = build_folder(self.mod_folder, "staging")
+        self.swap = f"{self.staging}.swap"
+
+    def make_folder(self, path, content):
+        os.makedirs(path)
+        with open(os.path.join(path, "content.txt"), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def read_content(self, path):
+        with open(os.path.join(path, "content.txt"), encoding='utf-8') as f:
+            return f.read()
+
+    def test_staging_stays_out_of_the_mods_folder(self):
+        ModBuilder(self.project).build(self.mod_folder)
+        self.assertEqual(os.listdir(self.mods), ["Benchmark"])
+        self.assertTrue(self.staging.startswith(self.cache))
+
+    def test_staging_next_to_the_mod_on_another_file_system(self):
+        # A cache on another device cannot be renamed into place; a hidden
+        # sibling of the mod folder always can
+        with mock.patch.object(builder, "_device", lambda path: 1 if path.startswith(self.cache) else 2):
+            staging = build_folder(self.mod_folder, "staging")
+            self.assertEqual(os.path.dirname(os.path.dirname(staging)), os.path.join(self.mods, LOCAL_BUILDS_FOLDER))
+            ModBuilder(self.project).build(self.mod_folder)
+        self.assertTrue(os.path.isfile(os.path.join(self.mod_folder, MANIFEST_NAME)))
+
+    def test_recover_after_first_rename(self):
+        # The mod folder was moved to the swap folder, the new build is staged
+        os.makedirs(self.mods)
+        self.make_folder(self.swap, "old")
+        self.make_folder(self.staging, "new")
+        recover_interrupted_swap(self.mod_folder)
+        self.assertEqual(self.read_content(self.mod_folder), "old")
+        self.assertFalse(os.path.exists(self.swap))
+
+    def test_recover_after_second_rename(self):
+        # The new build is in place, the old one orphaned in the swap folder
+        self.make_folder(self.swap, "old")
+        self.make_folder(self.mod_folder, "new")
+        recover_interrupted_swap(self.mod_folder)
+        self.assertEqual(self.read_content(self.mod_folder), "new")
+        self.assertEqual(self.read_content(self.staging), "old")
+        self.assertFalse(os.path.exists(self.swap))
+
+    def test_recover_after_restore_was_interrupted(self):
+        previous = build_folder(self.mod_folder, "previous")
+        self.make_folder(f"{previous}.swap", "current")
+        self.make_folder(self.mod_folder, "previous")
+        recover_interrupted_swap(self.mod_folder)
+        self.assertEqual(self.read_content(previous), "current")
+
+    def test_recover_leaves_complete_swaps_alone(self):
+        self.make_folder(self.mod_folder, "current")
+        recover_interrupted_swap(self.mod_folder)
+        self.assertEqual(self.read_content(self.mod_folder), "current")
+        self.assertFalse(os.path.exists(self.staging))
+
+    def test_kept_build_does_not_share_files(self):
+        ModBuilder(self.project, keep_previous=True).build(self.mod_folder)
+        self.project.items[0]['label'] = "changed item"
+        ModBuilder(self.project, keep_previous=True).build(self.mod_folder)
+        weapons = os.path.join(self.mod_folder, "Defs", "Weapons.xml")
+        with open(weapons, encoding='utf-8') as f:
+            original = f.read()
+        # Edit an unchanged file of the live mod in place
+        with open(weapons, 'a', encoding='utf-8') as f:
+            f.write("<!-- edited -->")
+
+        ModBuilder.restore_previous(self.mod_folder)
+        with open(weapons, encoding='utf-8') as f:
+            self.assertEqual(f.read(), original)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import textures
+from benchmarks import create_dummy_assets, synthetic_project
+from tests.test_deploy import run_cli
+
+
+class BuildCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": os.path.join(self.folder, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.out = os.path.join(self.folder, "out")
+
+    def write_project(self, project, name="project.json"):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(project.to_dict(), f)
+        return path
+
+    def test_unchanged_textures_are_not_opened(self):
+        texture_paths, sound_paths = create_dummy_assets(os.path.join(self.folder, "sources"), 4)
+        project_path = self.write_project(synthetic_project(4, texture_paths, sound_paths))
+        read_png_header = mock.Mock(wraps=textures.read_png_header)
+        with mock.patch.object(textures, "read_png_header", read_png_header):
+            self.assertEqual(run_cli("build", project_path, "--out", self.out)[0], 0)
+            self.assertEqual(read_png_header.call_count, len(texture_paths))
+            # A later run finds every header through the hash cache
+            read_png_header.reset_mock()
+            self.assertEqual(run_cli("build", project_path, "--out", self.out)[0], 0)
+            read_png_header.assert_not_called()
+
+    def test_texture_problems_are_warnings(self):
+        project = synthetic_project(1)
+        project.items[0]['texture'] = os.path.join(self.folder, "missing.png")
+        code, error = run_cli("build", self.write_project(project), "--out", self.out)
+        self.assertEqual(code, 0)
+        self.assertIn("Warning: ", error)
+
+
+class BatchCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": os.path.join(self.folder, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.projects = os.path.join(self.folder, "projects")
+        os.makedirs(self.projects)
+        self.out = os.path.join(self.folder, "out")
+
+    def write(self, name, content):
+        with open(os.path.join(self.projects, name), 'w', encoding='utf-8') as f:
+            f.write(content if isinstance(content, str) else json.dumps(content.to_dict()))
+
+    def run_batch(self):
+        code, error = run_cli("batch", self.projects, "--out", self.out, "--jobs", "2")
+        with open(os.path.join(self.out, "batch_summary.json"), encoding='utf-8') as f:
+            summary = json.load(f)
+        return code, error, {os.path.basename(result['project']): result for result in summary['results']}
+
+    def test_failures_do_not_stop_the_batch(self):
+        self.write("a_good.json", synthetic_project(2))
+        self.write("b_broken.json", "{not json")
+        unnamed = synthetic_project(3)
+        unnamed.mod_info['name'] = " "
+        self.write("c_unnamed.json", unnamed)
+        self.write("d_duplicate.json", synthetic_project(2))
+
+        code, error, results = self.run_batch()
+        self.assertEqual(code, 1)
+        self.assertEqual(sorted(results), ["a_good.json", "b_broken.json", "c_unnamed.json", "d_duplicate.json"])
+        self.assertTrue(results["a_good.json"]['ok'])
+        self.assertTrue(os.path.isfile(os.path.join(self.out, "Benchmark 2", "Defs", "Items.xml")))
+        for name in ("b_broken.json", "c_unnamed.json", "d_duplicate.json"):
+            self.assertFalse(results[name]['ok'], name)
+            self.assertIn(f"{name}: {results[name]['error']}", error)
+        self.assertIn("mod name is required", results["c_unnamed.json"]['error'])
+        # The first project keeps the mod folder, the later one is not built
+        self.assertIn("a_good.json", results["d_duplicate.json"]['error'])
+        self.assertIsNone(results["d_duplicate.json"]['mod_folder'])
+
+    def test_foreign_output_folder_fails_one_project(self):
+        self.write("a.json", synthetic_project(2))
+        self.write("b.json", synthetic_project(3))
+        os.makedirs(os.path.join(self.out, "Benchmark 3"))
+        code, _, results = self.run_batch()
+        self.assertEqual(code, 1)
+        self.assertTrue(results["a.json"]['ok'])
+        self.assertIn("not built by the mod maker", results["b.json"]['error'])
+
+    def test_missing_projects(self):
+        code, error = run_cli("batch", os.path.join(self.folder, "nothing", "*.json"), "--out", self.out)
+        self.assertEqual(code, 1)
+        self.assertIn("No project files found", error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import dds
+from benchmarks import write_dummy_png
+
+
+def read_header(path):
+    """Return (dwMipMapCount, payload bytes, fourcc) of a DDS file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    fields = dds._HEADER.unpack(data[:dds._HEADER.size])
+    return fields[7], len(data) - dds._HEADER.size, fields[10]
+
+
+class DDSTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def write(self, width, height, texture_format="dds"):
+        source = os.path.join(self.folder, f"{width}x{height}.png")
+        destination = os.path.join(self.folder, f"{width}x{height}.dds")
+        write_dummy_png(source, width, height)
+        dds.write_dds(source, destination, texture_format)
+        return read_header(destination)
+
+    def test_mip_sizes_halve_down(self):
+        self.assertEqual([(w, h) for w, h, _ in dds.mipmap_chain(100, 60, [bytes(400)] * 60)],
+                         [(100, 60), (50, 30), (25, 15), (12, 7), (6, 3), (3, 1), (1, 1)])
+
+    def test_non_power_of_two_uncompressed(self):
+        # 100x60, 50x30, 25x15, 12x7, 6x3, 3x1, 1x1 at four bytes a pixel
+        self.assertEqual(self.write(100, 60)[:2], (7, 31924))
+        # 12x12, 6x6, 3x3, 1x1
+        self.assertEqual(self.write(12, 12)[:2], (4, 760))
+
+    def test_power_of_two_uncompressed(self):
+        self.assertEqual(self.write(64, 16)[:2], (7, (1024 + 256 + 64 + 16 + 4 + 2 + 1) * 4))
+
+    @unittest.skipIf(dds.numpy is None, "block compression needs NumPy")
+    def test_block_compressed(self):
+        # 12x12: 3x3, 2x2, 1x1 and 1x1 blocks of 8 (BC1) or 16 (BC3) bytes
+        mipmaps, payload, fourcc = self.write(12, 12, "dds-bc")
+        block_size = 8 if fourcc == b"DXT1" else 16
+        self.assertEqual((mipmaps, payload), (4, (9 + 4 + 1 + 1) * block_size))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import cli
+from benchmarks import synthetic_project
+from assets import file_lock
+from builder import MANIFEST_NAME, BuildError, ModBuilder
+from deploy import ShadowBuilder, deploy_mod
+
+
+def run_cli(*argv):
+    """Run a headless command, returning its exit code and stderr"""
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+        code = cli.run_cli(list(argv))
+    return code, stderr.getvalue()
+
+
+class DeployTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": os.path.join(self.folder, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = synthetic_project(3)
+        self.mod_folder = os.path.join(self.folder, "build", "Benchmark")
+        self.mods = os.path.join(self.folder, "Mods")
+        self.target = os.path.join(self.mods, "Benchmark")
+
+    def build(self):
+        ModBuilder(self.project).build(self.mod_folder)
+
+    def read(self, *parts):
+        with open(os.path.join(self.target, *parts), encoding='utf-8') as f:
+            return f.read()
+
+    def test_unchanged_deploy_transfers_nothing(self):
+        self.build()
+        first = deploy_mod(self.mod_folder, self.mods)
+        self.assertIn("Defs/Items.xml", first.copied)
+        second = deploy_mod(self.mod_folder, self.mods)
+        self.assertEqual(second.copied, [])
+        self.assertEqual(second.unchanged, len(first.copied))
+
+    def test_keeps_user_files_and_removes_stale_ones(self):
+        self.build()
+        deploy_mod(self.mod_folder, self.mods)
+        with open(os.path.join(self.target, "About", "Preview.png"), 'wb') as f:
+            f.write(b"preview")
+
+        self.project.items.clear()
+        self.build()
+        report = deploy_mod(self.mod_folder, self.mods)
+        self.assertEqual(report.removed, ["Defs/Items.xml"])
+        self.assertFalse(os.path.exists(os.path.join(self.target, "Defs", "Items.xml")))
+        self.assertTrue(os.path.exists(os.path.join(self.target, "About", "Preview.png")))
+
+        # clean replaces the folder as a whole
+        deploy_mod(self.mod_folder, self.mods, clean=True)
+        self.assertFalse(os.path.exists(os.path.join(self.target, "About", "Preview.png")))
+
+    def test_refuses_folders_it_did_not_deploy(self):
+        self.build()
+        os.makedirs(self.target)
+        with self.assertRaises(BuildError):
+            deploy_mod(self.mod_folder, self.mods)
+        with self.assertRaises(BuildError):
+            deploy_mod(os.path.join(self.folder, "missing"), self.mods)
+
+    def test_rollback(self):
+        self.build()
+        deploy_mod(self.mod_folder, self.mods)
+        original = self.read("Defs", "Items.xml")
+        self.project.items[0]['label'] = "changed item"
+        self.build()
+        deploy_mod(self.mod_folder, self.mods, keep_previous=True)
+        changed = self.read("Defs", "Items.xml")
+        self.assertIn("changed item", changed)
+
+        self.assertEqual(run_cli("rollback", self.target), (0, ""))
+        self.assertEqual(self.read("Defs", "Items.xml"), original)
+        # Rolling back again undoes the rollback
+        self.assertEqual(run_cli("rollback", self.target)[0], 0)
+        self.assertEqual(self.read("Defs", "Items.xml"), changed)
+
+    def test_rollback_without_previous_build(self):
+        self.build()
+        deploy_mod(self.mod_folder, self.mods)
+        code, error = run_cli("rollback", self.target)
+        self.assertEqual(code, 1)
+        self.assertIn("No previous build", error)
+
+    def test_deploy_command(self):
+        project_path = os.path.join(self.folder, "project.json")
+        with open(project_path, 'w', encoding='utf-8') as f:
+            json.dump(self.project.to_dict(), f)
+        out = os.path.join(self.folder, "out")
+        self.assertEqual(run_cli("build", project_path, "--out", out)[0], 0)
+        self.assertEqual(run_cli("deploy", os.path.join(out, "Benchmark 3"), "--mods", self.mods)[0], 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.mods, "Benchmark 3", "About", "About.xml")))
+
+
+
+class ShadowBuilderTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": os.path.join(self.folder, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = synthetic_project(3)
+        self.mods = os.path.join(self.folder, "Mods")
+        self.target = os.path.join(self.mods, "Benchmark")
+        self.shadow_builder = ShadowBuilder(os.path.join(self.folder, "shadow"))
+        self.addCleanup(self.shadow_builder.shutdown)
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "the background build did not finish")
+            time.sleep(0.02)
+
+    def shadow_manifest(self, target):
+        return os.path.join(self.shadow_builder.shadow_folder(target), "mod", MANIFEST_NAME)
+
+    def test_publish_reuses_the_background_build(self):
+        self.shadow_builder.request(self.project, self.target)
+        self.wait_for(lambda: os.path.exists(self.shadow_manifest(self.target)))
+
+        build_report, deploy_report = self.shadow_builder.publish(self.project, self.mods, "Benchmark")
+        self.assertIn("items", build_report.skipped_stages)
+        self.assertIn("Defs/Items.xml", deploy_report.copied)
+        self.assertTrue(os.path.isfile(os.path.join(self.target, "Defs", "Items.xml")))
+        self.assertIsNone(self.shadow_builder.take_error())
+
+    def test_publish_keeps_user_files(self):
+        self.shadow_builder.publish(self.project, self.mods, "Benchmark")
+        preview = os.path.join(self.target, "About", "Preview.png")
+        with open(preview, 'wb') as f:
+            f.write(b"preview")
+        self.project.items[0]['label'] = "changed item"
+        _, deploy_report = self.shadow_builder.publish(self.project, self.mods, "Benchmark")
+        self.assertEqual(deploy_report.copied, ["Defs/Items.xml"])
+        self.assertTrue(os.path.isfile(preview))
+
+    def test_outputs_have_their_own_shadow_folder(self):
+        other = os.path.join(self.folder, "Other", "Benchmark")
+        self.assertNotEqual(self.shadow_builder.shadow_folder(self.target), self.shadow_builder.shadow_folder(other))
+
+    def test_background_failure_is_recorded(self):
+        self.shadow_builder.request(self.project, self.target, texture_format="bogus")
+        self.wait_for(lambda: self.shadow_builder.last_error is not None)
+        self.assertIsInstance(self.shadow_builder.take_error(), ValueError)
+        self.assertIsNone(self.shadow_builder.last_error)
+
+    def test_locked_output_is_skipped(self):
+        with file_lock(self.shadow_builder._lock_path(self.target)):
+            self.shadow_builder.request(self.project, self.target)
+            time.sleep(0.3)
+        self.assertFalse(os.path.exists(self.shadow_manifest(self.target)))
+        self.assertIsNone(self.shadow_builder.last_error)
+
+
+if __name__ == "__main__":
+    unittest.main()
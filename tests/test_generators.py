@@ -0,0 +1,221 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+import generators
+from benchmarks import synthetic_project
+from builder import ModBuilder, profile_options, run_stage
+from generators import FRAGMENT_TOUCH_SECONDS, FragmentCache, assign_shards
+
+
+def read_files(folder):
+    """Return {path relative to folder: bytes} of every XML file in folder"""
+    files = {}
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if filename.endswith(".xml"):
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, folder)] = f.read()
+    return files
+
+
+def resolve_parents(root):
+    """Return {(tag, defName): def} with every def merged into its parent
+    the way RimWorld does at load time"""
+    named = {elem.get('Name'): elem for elem in root if elem.get('Name')}
+
+    def merge(base, child):
+        for node in child:
+            matches = [elem for elem in base if elem.tag == node.tag]
+            if len(matches) == 1 and len(node) and len(matches[0]) and node[0].tag != "li":
+                merge(matches[0], node)
+            else:
+                if len(matches) == 1 and len(child.findall(node.tag)) == 1:
+                    base.remove(matches[0])
+                base.append(copy.deepcopy(node))
+
+    def resolved(elem):
+        parent = named.get(elem.get('ParentName'))
+        if parent is None:
+            return copy.deepcopy(elem)
+        base = resolved(parent)
+        merge(base, elem)
+        return base
+
+    return {(elem.tag, elem.findtext('defName')): resolved(elem)
+            for elem in root if elem.get('Abstract') != "True"}
+
+
+def canonical(elem):
+    """Compare elements regardless of the order of their children"""
+    return (elem.tag, (elem.text or "").strip(), tuple(sorted(canonical(child) for child in elem)))
+
+
+class GeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.dict(os.environ, {"MODMAKER_CACHE_DIR": os.path.join(self.folder, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = synthetic_project(20)
+
+    def build(self, name, **options):
+        mod_folder = os.path.join(self.folder, name)
+        report = ModBuilder(self.project, **options).build(mod_folder)
+        return mod_folder, report
+
+    def test_stream_writer_matches_minidom(self):
+        stream, _ = self.build("stream", engine="stream")
+        minidom, _ = self.build("minidom", engine="minidom")
+        self.assertEqual(read_files(stream), read_files(minidom))
+
+    def test_compact_layout(self):
+        pretty, _ = self.build("pretty")
+        stream, _ = self.build("stream", engine="stream", layout="compact")
+        minidom, _ = self.build("minidom", engine="minidom", layout="compact")
+        compact = read_files(stream)
+        self.assertEqual(compact, read_files(minidom))
+        items = compact[os.path.join("Defs", "Items.xml")]
+        self.assertNotIn(b"\n  <", items)
+        self.assertLess(len(items), len(read_files(pretty)[os.path.join("Defs", "Items.xml")]))
+        # Indentation is not data: both layouts parse to the same defs
+        self.assertEqual(canonical(ET.fromstring(items)),
+                         canonical(ET.parse(os.path.join(pretty, "Defs", "Items.xml")).getroot()))
+
+    def test_build_profiles(self):
+        self.assertEqual(profile_options("release")['layout'], "compact")
+        self.assertEqual(profile_options("release", layout="pretty")['layout'], "pretty")
+        with self.assertRaises(ValueError):
+            profile_options("fast")
+
+    def test_parent_extraction_round_trip(self):
+        plain, _ = self.build("plain")
+        extracted, report = self.build("extracted", extract_parents=True)
+        self.assertTrue(any(saved > 0 for saved in report.parent_bytes_saved.values()))
+
+        for filename in sorted(os.listdir(os.path.join(plain, "Defs"))):
+            with self.subTest(filename=filename):
+                before = os.path.join(plain, "Defs", filename)
+                after = os.path.join(extracted, "Defs", filename)
+                expected = resolve_parents(ET.parse(before).getroot())
+                root = ET.parse(after).getroot()
+                actual = resolve_parents(root)
+                for parent in root.findall("*[@Abstract='True']"):
+                    # Parent names are global, so they carry the packageId
+                    self.assertTrue(parent.get('Name').startswith("modmaker_benchmark20_"))
+                self.assertEqual(expected.keys(), actual.keys())
+                for key in expected:
+                    self.assertEqual(canonical(expected[key]), canonical(actual[key]), key)
+                # The reported saving is exact
+                saved = report.parent_bytes_saved.get(f"Defs/{filename}", 0)
+                self.assertEqual(os.path.getsize(before) - os.path.getsize(after), saved)
+
+    def test_sharded_build_keeps_every_def(self):
+        plain, _ = self.build("plain")
+        sharded, _ = self.build("sharded", shard_defs=5)
+        shards = [name for name in os.listdir(os.path.join(sharded, "Defs")) if name.startswith("Items_")]
+        self.assertGreater(len(shards), 1)
+        def_names = sorted(elem.findtext('defName') for name in shards
+                           for elem in ET.parse(os.path.join(sharded, "Defs", name)).getroot())
+        items = ET.parse(os.path.join(plain, "Defs", "Items.xml")).getroot()
+        expected = sorted(elem.findtext('defName') for elem in items)
+        self.assertEqual(def_names, expected)
+
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        self.names = [f"Def{i}" for i in range(12)]
+
+    def test_assignment_is_fixed(self):
+        # Shards are named by the defName's SHA-256, not Python's salted
+        # hash(), so files keep their defs across runs and versions
+        self.assertEqual(assign_shards(dict.fromkeys(self.names, 1), 4), {
+            "00": ["Def2", "Def4", "Def5", "Def7"],
+            "01": ["Def8"],
+            "10": ["Def1", "Def9", "Def10"],
+            "11": ["Def0", "Def3", "Def6", "Def11"],
+        })
+
+    def test_adding_a_def_only_touches_its_shard(self):
+        names = [f"Def{i}" for i in range(200)]
+        before = assign_shards(dict.fromkeys(names, 1), 10)
+        after = assign_shards(dict.fromkeys(names + ["NewDef"], 1), 10)
+        changed = {prefix for prefix in set(before) | set(after) if before.get(prefix) != after.get(prefix)}
+        new_prefix = next(prefix for prefix, def_names in after.items() if "NewDef" in def_names)
+        # Only the shard of the new def changed, or was split in two
+        self.assertTrue(all(new_prefix.startswith(prefix) or prefix.startswith(new_prefix[:-1])
+                            for prefix in changed))
+        self.assertLessEqual(sum(len(before.get(prefix, ())) for prefix in changed), 10)
+
+    def test_limits(self):
+        sizes = {name: 100 * (i + 1) for i, name in enumerate(self.names)}
+        shards = assign_shards(dict.fromkeys(self.names, 1), def_sizes=sizes, max_bytes=1500)
+        self.assertEqual(sorted(name for def_names in shards.values() for name in def_names),
+                         sorted(self.names))
+        for def_names in shards.values():
+            self.assertTrue(len(def_names) == 1 or sum(sizes[name] for name in def_names) <= 1500)
+
+
+class FragmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, "fragments.sqlite3")
+
+    def store(self, now, fragments, used=(), limit=1000):
+        """Open the cache at time now, look up used, add fragments and close"""
+        with mock.patch.object(generators.time, "time", return_value=now):
+            cache = FragmentCache(self.path, limit)
+            found = cache.get_many(list(used))
+            for key, xml in fragments.items():
+                cache.put(key, xml)
+            cache.close()
+        return found
+
+    def cached_keys(self):
+        cache = FragmentCache(self.path)
+        self.addCleanup(cache.close)
+        return set(cache.get_many(["a", "b", "c"]))
+
+    def test_least_recently_used_are_evicted(self):
+        self.store(1000, {"a": "x" * 400})
+        self.store(2000, {"b": "x" * 400})
+        # Looking "a" up a day later marks it as used, so "b" goes first
+        later = 1000 + FRAGMENT_TOUCH_SECONDS + 1
+        self.assertEqual(self.store(later, {"c": "x" * 400}, used=["a"]), {"a": "x" * 400})
+        self.assertEqual(self.cached_keys(), {"a", "c"})
+
+    def test_lookups_within_a_day_do_not_write(self):
+        self.store(1000, {"a": "x" * 400})
+        self.store(2000, {"b": "x" * 400})
+        self.store(3000, {"c": "x" * 400}, used=["a"])
+        self.assertEqual(self.cached_keys(), {"b", "c"})
+
+    def test_changed_defs_miss(self):
+        project = synthetic_project(5)
+        options = {'engine': "stream"}
+
+        def run(name):
+            folder = os.path.join(self.folder, name)
+            os.makedirs(folder)
+            _, _, fragments, _ = run_stage(project, "generate_items_xml", folder, options, self.path)
+            return fragments
+
+        self.assertEqual(run("first"), (0, 5))
+        self.assertEqual(run("second"), (5, 0))
+        project.items[0]['label'] = "changed item"
+        self.assertEqual(run("third"), (4, 1))
+        options['layout'] = "compact"
+        self.assertEqual(run("compact"), (0, 5))
+        with mock.patch.object(generators, "GENERATOR_VERSION", generators.GENERATOR_VERSION + 1):
+            self.assertEqual(run("upgraded"), (0, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
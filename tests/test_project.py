@@ -0,0 +1,66 @@
+import unittest
+
+from benchmarks import synthetic_project
+from project import CONTENT_TYPES, DefIndex
+
+
+def index_state(index, project):
+    """Return what the index knows about every defName of the project"""
+    def_names = [record['defName'] for content_type in CONTENT_TYPES for record in getattr(project, content_type)]
+    return ({def_name: index.get(def_name) for def_name in def_names},
+            {def_name: index.unlocked_by(def_name) for def_name in def_names}, len(index))
+
+
+class DefIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.project = synthetic_project(3)
+        self.index = DefIndex.from_project(self.project)
+
+    def assertInSync(self):
+        expected = DefIndex.from_project(self.project)
+        self.assertEqual(index_state(self.index, self.project), index_state(expected, self.project))
+
+    def test_add(self):
+        item = dict(self.project.items[0], defName="NewItem")
+        self.project.items.append(item)
+        self.assertTrue(self.index.add("items", item))
+        self.assertFalse(self.index.add("weapons", dict(item)))
+        self.assertEqual(self.index.get("NewItem"), ("items", item))
+        self.assertInSync()
+
+    def test_remove(self):
+        item = self.project.items.pop(0)
+        self.index.drop_unlocks(item['defName'])
+        self.index.remove(item)
+        self.assertNotIn(item['defName'], self.index)
+        self.assertEqual(self.project.research[0]['unlockedItems'], [])
+        self.assertInSync()
+
+        research = self.project.research.pop(1)
+        self.index.remove(research)
+        self.assertEqual(self.index.unlocked_by("BenchItem1"), [])
+        self.assertInSync()
+
+    def test_remove_duplicate_keeps_first(self):
+        first = self.project.items[0]
+        duplicate = dict(first)
+        self.project.items.append(duplicate)
+        self.assertEqual(len(self.index.rebuild(self.project)), 1)
+        del self.project.items[-1]
+        self.index.remove(duplicate)
+        self.assertEqual(self.index.get(first['defName']), ("items", first))
+        self.assertInSync()
+
+    def test_import_and_clear(self):
+        self.project = synthetic_project(5)
+        self.assertEqual(self.index.rebuild(self.project), [])
+        self.assertInSync()
+        self.assertEqual(self.index.unlocked_by("BenchWeapon4"), ["BenchResearch4"])
+
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.unlocked_by("BenchWeapon4"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
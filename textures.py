@@ -0,0 +1,544 @@
+"""
+Rimworld Mod Maker - Texture Module
+Reads texture metadata from the PNG header and flags textures that are
+slow to load or waste video memory in RimWorld, without decoding pixels.
+Also repacks and downscales PNGs for the optional texture optimization
+stage of a build, using nothing but zlib.
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from assets import ASSET_CONTENT_TYPES, PNG_SIGNATURE, default_hash_cache_path, file_lock
+
+
+# Largest texture side that is not reported as oversized. Vanilla things
+# stay well below this; anything larger only costs memory when zoomed out.
+MAX_TEXTURE_SIZE = 2048
+
+PNG_COLOR_TYPES = {
+    0: "greyscale",
+    2: "RGB",
+    3: "palette",
+    4: "greyscale + alpha",
+    6: "RGBA"
+}
+
+# Longest side a texture of each content type is scaled down to by the
+# optimization stage. Items are drawn on a single cell, buildings and
+# workbenches can cover several.
+TEXTURE_BUDGETS = {
+    "items": 256,
+    "weapons": 256,
+    "drugs": 256,
+    "cosmetics": 512,
+    "buildings": 1024,
+    "workbenches": 1024
+}
+
+# Chunks the game needs; every other (ancillary) chunk is stripped
+KEPT_PNG_CHUNKS = (b"IHDR", b"PLTE", b"tRNS", b"IDAT", b"IEND")
+
+# File format textures are placed in the mod as. "png" keeps PNGs; the
+# DDS formats are written by dds.py
+TEXTURE_FORMATS = ("png", "dds", "dds-bc")
+DEFAULT_TEXTURE_FORMAT = "png"
+
+# Bump when the optimizer output changes, so cached results are not reused
+OPTIMIZER_VERSION = 2
+OPTIMIZED_TEXTURES_NAME = "optimized"
+
+TEXTURE_INFO_NAME = "texture_headers.json"
+TEXTURE_INFO_VERSION = 1
+
+# Channels per pixel of the 8-bit colour types that can be downscaled,
+# and the index of their alpha channel
+_CHANNELS = {0: (1, None), 2: (3, None), 4: (2, 1), 6: (4, 3)}
+
+# Signature, then the IHDR chunk: length, type and 13 bytes of data
+_IHDR = struct.Struct(">8sI4sIIBBBBB")
+
+TextureInfo = namedtuple("TextureInfo", "width height bit_depth color_type interlaced")
+
+
+def read_png_header(path):
+    """Return the TextureInfo of a PNG file, reading only its first 33 bytes.
+
+    Raises ValueError if the file does not start with a valid IHDR chunk.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_IHDR.size)
+    if len(header) < _IHDR.size:
+        raise ValueError("file is too short to be a PNG")
+
+    (signature, length, chunk_type, width, height, bit_depth,
+     color_type, _, _, interlace) = _IHDR.unpack(header)
+    if signature != PNG_SIGNATURE or chunk_type != b"IHDR" or length != 13:
+        raise ValueError("not a PNG file")
+    if not width or not height or color_type not in PNG_COLOR_TYPES:
+        raise ValueError("corrupt PNG header")
+    return TextureInfo(width, height, bit_depth, color_type, bool(interlace))
+
+
+def is_power_of_two(n):
+    return n > 0 and n & (n - 1) == 0
+
+
+def texture_problems(info, max_size=MAX_TEXTURE_SIZE):
+    """Return human readable problems with a texture, or an empty list"""
+    problems = []
+    if not (is_power_of_two(info.width) and is_power_of_two(info.height)):
+        problems.append(f"{info.width}x{info.height} is not a power of two; it loads more "
+                        f"slowly and takes more video memory")
+    if max(info.width, info.height) > max_size:
+        problems.append(f"{info.width}x{info.height} is larger than {max_size}x{max_size}")
+    if info.color_type in (0, 2):
+        problems.append(f"{PNG_COLOR_TYPES[info.color_type]} image without alpha channel or "
+                        f"palette; it is drawn as an opaque rectangle")
+    if info.bit_depth == 16:
+        problems.append("16 bits per channel; the game keeps only 8")
+    return problems
+
+
+class TextureInspector:
+    """Reads PNG headers, remembering the result for every file content.
+
+    hash_file maps a path to its content hash; pass HashCache.sha256 so
+    that unchanged files are not read at all. Without one, results are
+    kept per path, size and mtime, since hashing a whole file would cost
+    more than reading its header again. With a hash_file, path names a
+    JSON file the headers are kept in between runs.
+    """
+
+    def __init__(self, hash_file=None, path=None):
+        self._hash_file = hash_file
+        self.path = path if hash_file else None
+        self._infos = self._read() if self.path else {}  # Content hash or stat signature -> TextureInfo
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != TEXTURE_INFO_VERSION:
+            return {}
+        try:
+            return {digest: TextureInfo(*values) for digest, values in data.get('textures', {}).items()}
+        except TypeError:
+            return {}
+
+    def inspect(self, path):
+        """Return the TextureInfo of a PNG file; raises ValueError or OSError"""
+        if self._hash_file:
+            digest = self._hash_file(path)
+        else:
+            stat = os.stat(path)
+            digest = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            info = self._infos.get(digest)
+        if info is None:
+            info = read_png_header(path)
+            with self._lock:
+                self._infos[digest] = info
+                self._dirty = True
+        return info
+
+    def save(self):
+        """Write new headers to disk, merged with those other runs saved meanwhile"""
+        if not self.path or not self._dirty:
+            return
+        with self._lock, file_lock(f"{self.path}.lock"):
+            infos = self._read()
+            infos.update(self._infos)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': TEXTURE_INFO_VERSION,
+                           'textures': {digest: list(info) for digest, info in infos.items()}}, f)
+            os.replace(tmp_path, self.path)
+            self._infos = infos
+            self._dirty = False
+
+
+def lint_textures(project, inspector=None, max_size=MAX_TEXTURE_SIZE):
+    """Check every texture of a project.
+
+    Returns (description, path, problem) for each problem found, in the
+    same form as the asset errors of a build.
+    """
+    inspector = inspector or TextureInspector()
+    problems = []
+    for content_type, label in ASSET_CONTENT_TYPES:
+        for record in getattr(project, content_type):
+            path = record.get('texture')
+            if not path:
+                continue
+            description = f"{label} texture: {record['defName']}"
+            try:
+                info = inspector.inspect(path)
+            except (OSError, ValueError) as e:
+                problems.append((description, path, str(e)))
+                continue
+            problems.extend((description, path, problem) for problem in texture_problems(info, max_size))
+    return problems
+
+
+def default_texture_info_path():
+    """Return the file PNG headers are kept in for the current user"""
+    return os.path.join(os.path.dirname(default_hash_cache_path()), TEXTURE_INFO_NAME)
+
+
+def default_texture_cache_path():
+    """Return the folder optimized textures are cached in for the current user"""
+    return os.path.join(os.path.dirname(default_hash_cache_path()), OPTIMIZED_TEXTURES_NAME)
+
+
+def texture_budgets(project, budgets=TEXTURE_BUDGETS):
+    """Return {texture path: longest side allowed} for a project. A texture
+    used by several content types gets the largest of their budgets; 0
+    means no limit."""
+    limits = {}
+    for content_type, _ in ASSET_CONTENT_TYPES:
+        for record in getattr(project, content_type):
+            path = record.get('texture')
+            if path:
+                limits[path] = max(limits.get(path, 0), budgets.get(content_type, 0))
+    return limits
+
+
+def _read_chunks(data):
+    """Return the (type, payload) chunks of a PNG file's bytes"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG file")
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos + 12 <= len(data):
+        length, chunk_type = struct.unpack_from(">I4s", data, pos)
+        payload = data[pos + 8:pos + 8 + length]
+        crc, = struct.unpack_from(">I", data, pos + 8 + length)
+        if len(payload) != length or zlib.crc32(chunk_type + payload) != crc:
+            name = chunk_type.decode('latin-1') if chunk_type.isalpha() else "PNG"
+            raise ValueError(f"corrupt {name} chunk")
+        chunks.append((chunk_type, payload))
+        pos += 12 + length
+        if chunk_type == b"IEND":
+            break
+    if not chunks or chunks[0][0] != b"IHDR" or chunks[-1][0] != b"IEND":
+        raise ValueError("truncated PNG file")
+    return chunks
+
+
+def _chunk(chunk_type, payload):
+    return (struct.pack(">I", len(payload)) + chunk_type + payload +
+            struct.pack(">I", zlib.crc32(chunk_type + payload)))
+
+
+def _unfilter(raw, stride, height, bpp):
+    """Undo the PNG row filters of stride bytes per row, returning one
+    bytearray per row. bpp is the number of bytes per pixel, rounded up."""
+    rows = []
+    previous = bytearray(stride)
+    pos = 0
+    for _ in range(height):
+        filter_type = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += stride + 1
+        if filter_type == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif filter_type == 2:
+            line = bytearray((a + b) & 0xFF for a, b in zip(line, previous))
+        elif filter_type == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                up = previous[i]
+                up_left = previous[i - bpp] if i >= bpp else 0
+                estimate = left + up - up_left
+                distance_left = abs(estimate - left)
+                distance_up = abs(estimate - up)
+                distance_up_left = abs(estimate - up_left)
+                if distance_left <= distance_up and distance_left <= distance_up_left:
+                    predictor = left
+                elif distance_up <= distance_up_left:
+                    predictor = up
+                else:
+                    predictor = up_left
+                line[i] = (line[i] + predictor) & 0xFF
+        elif filter_type != 0:
+            raise ValueError(f"unknown PNG filter type {filter_type}")
+        rows.append(line)
+        previous = line
+    return rows
+
+
+def _unpack_samples(line, bit_depth, count):
+    """Split a row of 1, 2 or 4 bit samples into one byte per sample"""
+    per_byte = 8 // bit_depth
+    mask = (1 << bit_depth) - 1
+    samples = bytearray(count)
+    for i in range(count):
+        samples[i] = (line[i // per_byte] >> (8 - bit_depth * (i % per_byte + 1))) & mask
+    return samples
+
+
+def read_png_rgba(path):
+    """Decode a PNG into (width, height, rows of 8-bit RGBA bytes).
+
+    Handles every colour type and bit depth; 16-bit samples keep their
+    high byte. Interlaced images raise ValueError.
+    """
+    with open(path, 'rb') as f:
+        chunks = _read_chunks(f.read())
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    if interlace:
+        raise ValueError("interlaced PNGs are not supported")
+    if color_type not in PNG_COLOR_TYPES:
+        raise ValueError("corrupt PNG header")
+    payloads = dict((chunk_type, payload) for chunk_type, payload in chunks if chunk_type != b"IDAT")
+    raw = zlib.decompress(b"".join(payload for chunk_type, payload in chunks if chunk_type == b"IDAT"))
+
+    channels = 1 if color_type == 3 else _CHANNELS[color_type][0]
+    bits_per_pixel = channels * bit_depth
+    stride = (width * bits_per_pixel + 7) // 8
+    rows = _unfilter(raw, stride, height, max(1, bits_per_pixel // 8))
+
+    palette = None
+    if color_type == 3:
+        colors = payloads.get(b"PLTE", b"")
+        alphas = payloads.get(b"tRNS", b"")
+        palette = [bytes(colors[i * 3:i * 3 + 3]) + bytes([alphas[i] if i < len(alphas) else 255])
+                   for i in range(len(colors) // 3)]
+        palette += [b"\0\0\0\xff"] * (256 - len(palette))
+    scale = 255 // ((1 << bit_depth) - 1) if bit_depth < 8 else 1
+
+    rgba_rows = []
+    for line in rows:
+        if bit_depth == 16:
+            line = line[0::2]
+        elif bit_depth < 8:
+            line = _unpack_samples(line, bit_depth, width)
+            if palette is None:
+                line = bytearray(sample * scale for sample in line)
+        rgba = bytearray(width * 4)
+        if palette is not None:
+            rgba = bytearray(b"".join(palette[index] for index in line))
+        elif color_type == 6:
+            rgba = line
+        elif color_type == 2:
+            for channel in range(3):
+                rgba[channel::4] = line[channel::3]
+            rgba[3::4] = b"\xff" * width
+        elif color_type == 4:
+            for channel in range(3):
+                rgba[channel::4] = line[0::2]
+            rgba[3::4] = line[1::2]
+        else:
+            for channel in range(3):
+                rgba[channel::4] = line
+            rgba[3::4] = b"\xff" * width
+        rgba_rows.append(bytes(rgba))
+    return width, height, rgba_rows
+
+
+def _filter(rows, bpp):
+    """Filter rows for compression, choosing None, Sub or Up per row by
+    the usual minimum sum of absolute differences heuristic"""
+    out = bytearray()
+    previous = bytes(len(rows[0])) if rows else b""
+    for line in rows:
+        candidates = (
+            (0, bytes(line)),
+            (1, bytes(line[:bpp]) + bytes((a - b) & 0xFF for a, b in zip(line[bpp:], line))),
+            (2, bytes((a - b) & 0xFF for a, b in zip(line, previous)))
+        )
+        filter_type, filtered = min(
+            candidates, key=lambda candidate: sum(b if b < 128 else 256 - b for b in candidate[1]))
+        out.append(filter_type)
+        out += filtered
+        previous = line
+    return bytes(out)
+
+
+def _downscale(rows, width, height, channels, alpha, factor):
+    """Box filter the image down by an integer factor. Colour is averaged
+    weighted by alpha, so transparent pixels do not darken the edges."""
+    new_width = -(-width // factor)
+    new_height = -(-height // factor)
+    new_rows = []
+    for y in range(new_height):
+        block = rows[y * factor:(y + 1) * factor]
+        # Per channel and output pixel: sum over the block's rows
+        sums = []
+        alpha_sums = None
+        if alpha is not None:
+            alpha_sums = [0] * new_width
+            for line in block:
+                samples = line[alpha::channels]
+                for x in range(new_width):
+                    alpha_sums[x] += sum(samples[x * factor:(x + 1) * factor])
+        for channel in range(channels):
+            totals = [0] * new_width
+            for line in block:
+                samples = line[channel::channels]
+                if alpha is not None and channel != alpha:
+                    weights = line[alpha::channels]
+                    samples = [sample * weight for sample, weight in zip(samples, weights)]
+                for x in range(new_width):
+                    totals[x] += sum(samples[x * factor:(x + 1) * factor])
+            sums.append(totals)
+
+        line = bytearray(new_width * channels)
+        for x in range(new_width):
+            count = len(block) * (min(width, (x + 1) * factor) - x * factor)
+            for channel in range(channels):
+                if alpha is None or channel == alpha:
+                    value = (sums[channel][x] + count // 2) // count
+                elif alpha_sums[x]:
+                    value = (sums[channel][x] + alpha_sums[x] // 2) // alpha_sums[x]
+                else:
+                    value = 0
+                line[x * channels + channel] = value
+        new_rows.append(line)
+    return new_rows, new_width, new_height
+
+
+def optimize_png(source, destination, max_size=None):
+    """Write an optimized copy of a PNG to destination.
+
+    Ancillary chunks are dropped and the image data is recompressed at
+    the highest zlib level. If max_size is given and the image is larger,
+    it is first scaled down by a power of two, which keeps power of two
+    sizes. Returns (original size, new size, new dimensions or None if
+    the image was not scaled). The original is written unchanged if
+    nothing got smaller.
+    """
+    with open(source, 'rb') as f:
+        data = f.read()
+    chunks = _read_chunks(data)
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    image_data = b"".join(payload for chunk_type, payload in chunks if chunk_type == b"IDAT")
+
+    header = chunks[0][1]
+    raw = zlib.decompress(image_data)
+    scaled = None
+    factor = 1
+    while max_size and max(width, height) > max_size * factor:
+        factor *= 2
+    if factor > 1 and bit_depth == 8 and not interlace and color_type in _CHANNELS:
+        channels, alpha = _CHANNELS[color_type]
+        rows = _unfilter(raw, width * channels, height, channels)
+        rows, width, height = _downscale(rows, width, height, channels, alpha, factor)
+        raw = _filter(rows, channels)
+        header = struct.pack(">II", width, height) + header[8:]
+        scaled = (width, height)
+
+    out = [PNG_SIGNATURE, _chunk(b"IHDR", header)]
+    out.extend(_chunk(chunk_type, payload) for chunk_type, payload in chunks[1:-1]
+               if chunk_type in KEPT_PNG_CHUNKS and chunk_type != b"IDAT")
+    out.append(_chunk(b"IDAT", zlib.compress(raw, 9)))
+    out.append(_chunk(b"IEND", b""))
+    optimized = b"".join(out)
+    if scaled is None and len(optimized) >= len(data):
+        optimized = data
+
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(optimized)
+    os.replace(tmp_path, destination)
+    return len(data), len(optimized), scaled
+
+
+class TextureOptimizationReport:
+    """Outcome of the texture optimization stage"""
+
+    def __init__(self):
+        self.replacements = {}  # Source path -> optimized copy to place instead
+        self.optimized = 0      # Textures optimized by this build
+        self.cached = 0         # Textures optimized by an earlier build
+        self.scaled = []        # (source, (new width, new height))
+        self.bytes_saved = 0
+        self.errors = []        # (description, source, error)
+
+
+def process_texture(source, destination, max_size=None, texture_format=DEFAULT_TEXTURE_FORMAT):
+    """Write source optimized or converted to texture_format to destination.
+
+    Returns (original size, new size, new dimensions or None).
+    """
+    if texture_format == "png":
+        return optimize_png(source, destination, max_size)
+    import dds
+    return dds.write_dds(source, destination, texture_format, max_size)
+
+
+def optimize_textures(project, source_hashes, cache_folder=None, budgets=TEXTURE_BUDGETS,
+                      workers=None, texture_format=DEFAULT_TEXTURE_FORMAT, cancel=None):
+    """Optimize every texture of a project on a process pool.
+
+    Textures are scaled down to their budget unless budgets is None, and
+    written as texture_format. Results are cached in cache_folder under
+    the content hash of the source, the size budget and the format, so
+    each texture is only processed once. source_hashes maps texture paths
+    to their SHA-256, as in AssetPlan. Once cancel, a threading.Event, is
+    set no further textures are started.
+    """
+    if texture_format not in TEXTURE_FORMATS:
+        raise ValueError(f"Unknown texture format '{texture_format}', expected one of {', '.join(TEXTURE_FORMATS)}")
+    cache_folder = cache_folder or default_texture_cache_path()
+    os.makedirs(cache_folder, exist_ok=True)
+    report = TextureOptimizationReport()
+    extension = ".png" if texture_format == "png" else ".dds"
+
+    pending = {}
+    for source, max_size in texture_budgets(project, budgets or {}).items():
+        digest = source_hashes.get(source)
+        if not digest or source in report.replacements:
+            continue
+        max_size = max_size or None
+        path = os.path.join(cache_folder, f"{digest}-{max_size or 'full'}-{texture_format}"
+                                          f"-v{OPTIMIZER_VERSION}{extension}")
+        report.replacements[source] = path
+        if os.path.exists(path):
+            report.cached += 1
+            report.bytes_saved += os.path.getsize(source) - os.path.getsize(path)
+        else:
+            pending.setdefault(path, (source, max_size))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {path: pool.submit(process_texture, source, path, max_size, texture_format)
+                       for path, (source, max_size) in pending.items()}
+            failed = set()
+            for path, future in futures.items():
+                source, max_size = pending[path]
+                if cancel is not None and cancel.is_set():
+                    for remaining in futures.values():
+                        remaining.cancel()
+                    break
+                try:
+                    original_size, new_size, scaled = future.result()
+                except Exception as e:
+                    report.errors.append((f"Texture: {os.path.basename(source)}", source,
+                                          f"could not be optimized: {e}"))
+                    failed.add(path)
+                    continue
+                report.optimized += 1
+                report.bytes_saved += original_size - new_size
+                if scaled:
+                    report.scaled.append((source, scaled))
+
+        # Textures that failed are placed as they are
+        report.replacements = {source: path for source, path in report.replacements.items()
+                               if path not in failed}
+    return report
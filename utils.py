@@ -4,13 +4,40 @@ Contains file operations, mod creation, and utility functions.
 """
 
 import os
-import shutil
-from tkinter import filedialog, messagebox
+import queue
+import threading
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+
+from assets import ASSET_CONTENT_TYPES
+from builder import (
+    BuildCancelled, ModBuilder, DEFAULT_BUILD_PROFILE, check_cancelled, create_mod_structure, create_preview_readme,
+    profile_options
+)
+from project import ModProject, CONTENT_LABELS, normalize_research_unlocks
+from tabs import SHARD_SIZE_CHOICES
+from textures import lint_textures, DEFAULT_TEXTURE_FORMAT
+
+
+# How long editing has to pause before the content is built in the background
+SHADOW_BUILD_DELAY_MS = 1000
+
+# Status shown in the Create Mod dialog for the stages before XML generation
+BUILD_STAGE_LABELS = {
+    "prefetch": "Hashing assets",
+    "lint": "Checking textures",
+    "textures": "Converting textures"
+}
 
 
 class FileUtils:
     def __init__(self, app):
         self.app = app
+        # The running Create Mod build, if any
+        self.build_thread = None
+        self.build_cancel = None
+        # Pending after() call of schedule_shadow_build()
+        self.shadow_build_timer = None
     
     def select_directory(self):
         """Select output directory for the mod"""
@@ -18,22 +45,11 @@ class FileUtils:
         if directory:
             self.app.selected_directory = directory
             self.app.directory_label.config(text=directory)
+            self.app.schedule_shadow_build()
     
     def create_mod_structure(self, mod_folder):
         """Create the basic mod folder structure"""
-        # Create basic directories
-        directories = [
-            "About",
-            "Defs",
-            "Textures/Things",
-            "Sounds",
-            "Patches",
-            "Assemblies",
-            "Languages/English/Keyed"
-        ]
-        
-        for directory in directories:
-            os.makedirs(os.path.join(mod_folder, directory), exist_ok=True)
+        create_mod_structure(mod_folder)
     
     def create_mod(self):
         """Create the complete mod with all files and structure"""
@@ -47,176 +63,270 @@ class FileUtils:
             messagebox.showerror("Error", "Please select an output directory!")
             return
         
+        if self.build_thread and self.build_thread.is_alive():
+            return
+        
         try:
+            project = ModProject.from_app(self.app)
+            
             # Create mod folder
             mod_folder = os.path.join(self.app.selected_directory, mod_name)
             
             # Check if folder already exists
+            clean = False
             if os.path.exists(mod_folder):
                 if not messagebox.askyesno("Folder Exists", 
                     f"The folder '{mod_name}' already exists. Do you want to overwrite it?"):
                     return
-                # Remove existing folder
-                shutil.rmtree(mod_folder)
-            
-            # Create folder structure
-            self.create_mod_structure(mod_folder)
-            
-            # Generate XML files
-            defs_folder = os.path.join(mod_folder, "Defs")
-            patches_folder = os.path.join(mod_folder, "Patches")
-            
-            # Generate About.xml
-            self.app.xml_generator.generate_about_xml(mod_folder)
-            
-            # Generate content XML files
-            if self.app.items:
-                self.app.xml_generator.generate_items_xml(defs_folder)
-            
-            if self.app.weapons:
-                self.app.xml_generator.generate_weapons_xml(defs_folder)
-            
-            if self.app.buildings:
-                self.app.xml_generator.generate_buildings_xml(defs_folder)
+                # A previous build is updated, only rewriting what changed;
+                # anything else is replaced. Either way the new build is
+                # written to a staging folder and only swapped in when done
+                clean = not ModBuilder.has_manifest(mod_folder)
             
-            if self.app.cosmetics:
-                self.app.xml_generator.generate_cosmetics_xml(defs_folder)
+            # The content was most likely built in the background while it
+            # was edited. Bring that shadow build up to date, which only
+            # regenerates the XML files and assets that changed since, then
+            # sync it into the mod folder, linking the files that changed
+            options = self.build_options()
+            keep_previous = self.app.keep_previous_build.get()
             
-            if self.app.drugs:
-                self.app.xml_generator.generate_drugs_xml(defs_folder)
+            def build(progress, cancel, stage_progress, confirm):
+                # Assets still being hashed and staged since they were
+                # selected are finished here, off the Tk thread
+                self.app.asset_prefetcher.wait(
+                    cancel, lambda done, total: stage_progress(done, total, "prefetch"))
+                check_cancelled(cancel)
+                
+                # Flag textures the game loads slowly before spending time on them
+                stage_progress(0, 1, "lint")
+                texture_problems = lint_textures(project, self.app.texture_inspector)
+                if texture_problems:
+                    message = f"{len(texture_problems)} texture problems were found:\n"
+                    for description, source, problem in texture_problems[:5]:
+                        message += f"- {description}: {problem}\n"
+                    if len(texture_problems) > 5:
+                        message += f"... and {len(texture_problems) - 5} more\n"
+                    if not confirm("Texture Warnings", message + "\nCreate the mod anyway?"):
+                        raise BuildCancelled("Build cancelled because of texture problems")
+                stage_progress(1, 1, "lint")
+                
+                return self.app.shadow_builder.publish(project, self.app.selected_directory, mod_name,
+                                                       keep_previous, clean, progress, cancel,
+                                                       stage_progress, **options)
             
-            if self.app.workbenches:
-                self.app.xml_generator.generate_workbenches_xml(defs_folder)
-            
-            if self.app.research:
-                self.app.xml_generator.generate_research_xml(defs_folder)
-                # Generate research unlock patches
-                self.app.xml_generator.generate_research_unlock_patches(patches_folder)
-            
-            if self.app.recipes:
-                self.app.xml_generator.generate_recipes_xml(defs_folder)
-            
-            # Copy assets
-            copied_assets = self.app.asset_manager.copy_assets(mod_folder)
-            
-            # Create preview image placeholder
-            self.create_preview_image(mod_folder)
-            
-            # Create language files
-            self.create_language_files(mod_folder)
-            
-            # Show success message
-            message = f"Mod '{mod_name}' created successfully!\n\nLocation: {mod_folder}\n\n"
-            
-            if copied_assets:
-                message += f"Copied {len(copied_assets)} asset files:\n"
-                for asset in copied_assets[:5]:  # Show first 5 assets
-                    message += f"- {asset}\n"
-                if len(copied_assets) > 5:
-                    message += f"... and {len(copied_assets) - 5} more"
-            else:
-                message += "No custom assets were copied."
-            
-            messagebox.showinfo("Success", message)
+            self.cancel_shadow_build_timer()
+            self.start_build(build, mod_name, mod_folder)
             
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred while creating the mod:\n{str(e)}")
     
+    def build_options(self):
+        """Return the ModBuilder options selected on the Mod Info tab"""
+        return profile_options(self.app.build_profile.get(), **{
+            'optimize_textures': self.app.optimize_textures.get(),
+            'texture_format': self.app.texture_format.get(),
+            'extract_parents': self.app.extract_parents.get(),
+            # Large Defs files are split so that an edit only rewrites part of them
+            'shard_defs': int(self.app.shard_defs.get()) if self.app.shard_defs.get().isdigit() else None
+        })
+    
+    def schedule_shadow_build(self):
+        """Build the current content in the background once editing pauses"""
+        self.cancel_shadow_build_timer()
+        self.shadow_build_timer = self.app.root.after(SHADOW_BUILD_DELAY_MS, self.request_shadow_build)
+    
+    def cancel_shadow_build_timer(self):
+        """Drop a background build that was scheduled but not started"""
+        if self.shadow_build_timer is not None:
+            self.app.root.after_cancel(self.shadow_build_timer)
+            self.shadow_build_timer = None
+    
+    def request_shadow_build(self):
+        """Hand a snapshot of the current content to the shadow builder"""
+        self.shadow_build_timer = None
+        error = self.app.shadow_builder.take_error()
+        if error is not None:
+            messagebox.showwarning("Background Build Failed",
+                                   f"Building the mod in the background failed:\n{error}\n\n"
+                                   "Create Mod will run into the same problem until it is fixed.")
+        if self.build_thread and self.build_thread.is_alive():
+            return  # Create Mod is building the latest content already
+        mod_name = self.app.name_entry.get().strip()
+        if not mod_name or not self.app.selected_directory:
+            return  # Nothing to build for yet; Create Mod does a full build
+        target = os.path.join(self.app.selected_directory, mod_name)
+        self.app.shadow_builder.request(ModProject.from_app(self.app), target, **self.build_options())
+    
+    def start_build(self, build, mod_name, mod_folder):
+        """Run build(progress, cancel, stage_progress, confirm), which
+        returns a BuildReport and a DeployReport, on a worker thread behind
+        a progress dialog.
+        
+        The worker only puts events on a queue, which the Tk thread polls;
+        confirm(title, message) asks a yes/no question from the Tk thread
+        and returns the answer. Cancel stops the build between files; the
+        mod folder is then left as the previous build wrote it.
+        """
+        events = queue.Queue()
+        cancel = threading.Event()
+        
+        dialog = tk.Toplevel(self.app.root)
+        dialog.title("Creating Mod")
+        dialog.geometry("420x150")
+        dialog.resizable(False, False)
+        dialog.transient(self.app.root)
+        
+        status_label = tk.Label(dialog, text="Hashing assets...", anchor="w")
+        status_label.pack(fill="x", padx=20, pady=(20, 5))
+        progress_bar = ttk.Progressbar(dialog, mode="determinate")
+        progress_bar.pack(fill="x", padx=20, pady=5)
+        
+        def cancel_build():
+            cancel.set()
+            status_label.config(text="Cancelling...")
+            cancel_button.config(state="disabled")
+        
+        cancel_button = tk.Button(dialog, text="Cancel", command=cancel_build)
+        cancel_button.pack(pady=10)
+        dialog.protocol("WM_DELETE_WINDOW", cancel_build)
+        
+        def stage_progress(done, total, name):
+            if name in BUILD_STAGE_LABELS:
+                events.put(('progress', f"{BUILD_STAGE_LABELS[name]} ({done}/{total})...", done, total))
+            else:
+                events.put(('progress', f"Generating XML ({done}/{total}): {name}", done, total))
+        
+        def asset_progress(done, total, description):
+            events.put(('progress', f"Copying assets ({done}/{total})", done, total))
+        
+        def run_build():
+            try:
+                events.put(('done', build(asset_progress, cancel, stage_progress, confirm)))
+            except BuildCancelled as e:
+                events.put(('cancelled', e))
+            except Exception as e:
+                events.put(('error', e))
+        
+        def confirm(title, message):
+            answer = queue.Queue(maxsize=1)
+            events.put(('confirm', title, message, answer))
+            # A cancelled build is not waited on by cancel_build() forever
+            while not cancel.is_set():
+                try:
+                    return answer.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return False
+        
+        def poll():
+            try:
+                while True:
+                    event = events.get_nowait()
+                    if event[0] == 'confirm':
+                        event[3].put(messagebox.askyesno(event[1], event[2], parent=dialog))
+                        continue
+                    if event[0] != 'progress':
+                        finish(*event)
+                        return
+                    if not cancel.is_set():
+                        status_label.config(text=event[1])
+                    progress_bar.config(maximum=max(event[3], 1), value=event[2])
+            except queue.Empty:
+                pass
+            self.app.root.after(50, poll)
+        
+        def finish(outcome, result):
+            dialog.destroy()
+            self.app.create_button.config(state="normal")
+            if outcome == 'done':
+                self.show_build_result(mod_name, mod_folder, *result)
+            elif outcome == 'cancelled':
+                messagebox.showinfo("Cancelled", f"Creating mod '{mod_name}' was cancelled.\n\n"
+                                    f"The previous contents of {mod_folder} were left unchanged.")
+            else:
+                messagebox.showerror("Error", f"An error occurred while creating the mod:\n{str(result)}")
+        
+        self.app.create_button.config(state="disabled")
+        self.build_cancel = cancel
+        self.build_thread = threading.Thread(target=run_build, daemon=True)
+        self.build_thread.start()
+        self.app.root.after(50, poll)
+    
+    def cancel_build(self):
+        """Cancel a running build and wait for it to stop"""
+        if self.build_thread and self.build_thread.is_alive():
+            self.build_cancel.set()
+            self.build_thread.join()
+    
+    def restore_previous_build(self):
+        """Swap the mod folder with the build kept before the last one"""
+        mod_name = self.app.name_entry.get().strip()
+        if not mod_name or not getattr(self.app, 'selected_directory', None):
+            messagebox.showerror("Error", "Enter the mod name and select the output directory of the build to restore!")
+            return
+        if self.build_thread and self.build_thread.is_alive():
+            messagebox.showwarning("Warning", "Wait for the running build to finish first.")
+            return
+        
+        mod_folder = os.path.join(self.app.selected_directory, mod_name)
+        if not messagebox.askyesno("Restore Previous Build",
+                                   f"Replace '{mod_folder}' with the build before it?\n\n"
+                                   "Restoring again swaps them back."):
+            return
+        try:
+            ModBuilder.restore_previous(mod_folder)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not restore the previous build:\n{str(e)}")
+            return
+        messagebox.showinfo("Success", f"The previous build of '{mod_name}' was restored.")
+    
+    def show_build_result(self, mod_name, mod_folder, build_report, deploy_report=None):
+        """Show the summary of a finished build"""
+        copied_assets = build_report.copied_assets
+        message = f"Mod '{mod_name}' created successfully!\n\nLocation: {mod_folder}\n\n"
+        
+        if copied_assets:
+            message += f"Copied {len(copied_assets)} asset files:\n"
+            for asset in copied_assets[:5]:  # Show first 5 assets
+                message += f"- {asset}\n"
+            if len(copied_assets) > 5:
+                message += f"... and {len(copied_assets) - 5} more"
+        else:
+            message += "No custom assets were copied."
+        
+        if build_report.texture_bytes_saved > 0:
+            message += (f"\nTexture optimization saved {build_report.texture_bytes_saved // 1024} KB"
+                        f" ({len(build_report.scaled_textures)} textures scaled down).")
+        
+        if build_report.skipped_assets:
+            message += f"\n{build_report.skipped_assets} unchanged asset files were left in place."
+        
+        if build_report.asset_errors:
+            message += f"\n\n{len(build_report.asset_errors)} asset files could not be copied:\n"
+            for description, source, error in build_report.asset_errors[:5]:
+                message += f"- {description} ({source}): {error}\n"
+            if len(build_report.asset_errors) > 5:
+                message += f"... and {len(build_report.asset_errors) - 5} more"
+        
+        slowest = build_report.slowest_stage()
+        message += f"\n\nBuilt in {build_report.total_time:.2f}s"
+        if slowest:
+            message += f" (slowest stage: {slowest[0]}, {slowest[1]:.2f}s)"
+        if build_report.skipped_stages:
+            message += f"\n{len(build_report.skipped_stages)} unchanged XML files were left in place."
+        if deploy_report:
+            message += (f"\n{len(deploy_report.copied)} files of the mod folder were updated"
+                        f" in {deploy_report.total_time:.2f}s.")
+        
+        messagebox.showinfo("Success", message)
+    
     def create_preview_image(self, mod_folder):
         """Create a placeholder preview image for the mod"""
-        about_folder = os.path.join(mod_folder, "About")
-        preview_path = os.path.join(about_folder, "Preview.png")
-        
-        # Create a simple text file explaining how to add a preview
-        readme_path = os.path.join(about_folder, "README_Preview.txt")
-        with open(readme_path, 'w', encoding='utf-8') as f:
-            f.write("To add a preview image for your mod:\n")
-            f.write("1. Create or find a 512x512 pixel PNG image\n")
-            f.write("2. Name it 'Preview.png'\n")
-            f.write("3. Replace this file with your preview image\n")
-            f.write("4. Delete this README_Preview.txt file\n")
+        create_preview_readme(mod_folder)
     
     def create_language_files(self, mod_folder):
         """Create basic language files for the mod"""
-        lang_folder = os.path.join(mod_folder, "Languages", "English", "Keyed")
-        
-        # Create a basic language file with keys for custom content
-        lang_content = []
-        lang_content.append('<?xml version="1.0" encoding="utf-8" ?>')
-        lang_content.append('<LanguageData>')
-        lang_content.append('')
-        lang_content.append('  <!-- Mod-specific translations can be added here -->')
-        
-        # Add language keys for items
-        if self.app.items:
-            lang_content.append('')
-            lang_content.append('  <!-- Items -->')
-            for item in self.app.items:
-                safe_name = item['defName'].replace(' ', '_')
-                if item.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{item["description"]}</{safe_name}.description>')
-        
-        # Add language keys for weapons
-        if self.app.weapons:
-            lang_content.append('')
-            lang_content.append('  <!-- Weapons -->')
-            for weapon in self.app.weapons:
-                safe_name = weapon['defName'].replace(' ', '_')
-                if weapon.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{weapon["description"]}</{safe_name}.description>')
-        
-        # Add language keys for buildings
-        if self.app.buildings:
-            lang_content.append('')
-            lang_content.append('  <!-- Buildings -->')
-            for building in self.app.buildings:
-                safe_name = building['defName'].replace(' ', '_')
-                if building.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{building["description"]}</{safe_name}.description>')
-        
-        # Add language keys for cosmetics
-        if self.app.cosmetics:
-            lang_content.append('')
-            lang_content.append('  <!-- Cosmetics -->')
-            for cosmetic in self.app.cosmetics:
-                safe_name = cosmetic['defName'].replace(' ', '_')
-                if cosmetic.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{cosmetic["description"]}</{safe_name}.description>')
-        
-        # Add language keys for drugs
-        if self.app.drugs:
-            lang_content.append('')
-            lang_content.append('  <!-- Drugs -->')
-            for drug in self.app.drugs:
-                safe_name = drug['defName'].replace(' ', '_')
-                if drug.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{drug["description"]}</{safe_name}.description>')
-        
-        # Add language keys for workbenches
-        if self.app.workbenches:
-            lang_content.append('')
-            lang_content.append('  <!-- Workbenches -->')
-            for workbench in self.app.workbenches:
-                safe_name = workbench['defName'].replace(' ', '_')
-                if workbench.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{workbench["description"]}</{safe_name}.description>')
-        
-        # Add language keys for research
-        if self.app.research:
-            lang_content.append('')
-            lang_content.append('  <!-- Research -->')
-            for research in self.app.research:
-                safe_name = research['defName'].replace(' ', '_')
-                if research.get('description'):
-                    lang_content.append(f'  <{safe_name}.description>{research["description"]}</{safe_name}.description>')
-        
-        lang_content.append('')
-        lang_content.append('</LanguageData>')
-        
-        # Write language file
-        lang_file_path = os.path.join(lang_folder, "ModLanguage.xml")
-        with open(lang_file_path, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lang_content))
+        self.app.xml_generator.generate_language_xml(mod_folder)
     
     def export_mod_data(self):
         """Export all mod data to a JSON file for backup/sharing"""
@@ -231,12 +341,7 @@ class FileUtils:
         
         # Prepare data for export
         export_data = {
-            'mod_info': {
-                'name': self.app.name_entry.get(),
-                'author': self.app.author_entry.get(),
-                'version': self.app.version_entry.get(),
-                'description': self.app.description_text.get("1.0", "end-1c")
-            },
+            'mod_info': self.app.get_mod_info(),
             'items': self.app.items,
             'weapons': self.app.weapons,
             'buildings': self.app.buildings,
@@ -251,6 +356,12 @@ class FileUtils:
                 'include_assemblies': self.app.include_assemblies.get(),
                 'include_textures': self.app.include_textures.get(),
                 'include_sounds': self.app.include_sounds.get(),
+                'build_profile': self.app.build_profile.get(),
+                'optimize_textures': self.app.optimize_textures.get(),
+                'texture_format': self.app.texture_format.get(),
+                'keep_previous_build': self.app.keep_previous_build.get(),
+                'extract_parents': self.app.extract_parents.get(),
+                'shard_defs': self.app.shard_defs.get(),
                 'include_languages': self.app.include_languages.get()
             }
         }
@@ -316,6 +427,15 @@ class FileUtils:
             self.app.workbenches = import_data.get('workbenches', [])
             self.app.research = import_data.get('research', [])
             self.app.recipes = import_data.get('recipes', [])
+            normalize_research_unlocks(self.app.research)
+            duplicates = self.app.def_index.rebuild(self.app)
+            
+            # Stage the imported assets in the background, as if selected
+            for content_type, _ in ASSET_CONTENT_TYPES:
+                for record in getattr(self.app, content_type):
+                    for asset in (record.get('texture'), record.get('sound')):
+                        if asset and os.path.isfile(asset):
+                            self.app.asset_prefetcher.submit(asset)
             
             # Import settings
             if 'settings' in import_data:
@@ -325,12 +445,29 @@ class FileUtils:
                 self.app.include_assemblies.set(settings.get('include_assemblies', False))
                 self.app.include_textures.set(settings.get('include_textures', False))
                 self.app.include_sounds.set(settings.get('include_sounds', False))
+                self.app.build_profile.set(settings.get('build_profile', DEFAULT_BUILD_PROFILE))
+                self.app.optimize_textures.set(settings.get('optimize_textures', False))
+                self.app.texture_format.set(settings.get('texture_format', DEFAULT_TEXTURE_FORMAT))
+                self.app.keep_previous_build.set(settings.get('keep_previous_build', False))
+                self.app.extract_parents.set(settings.get('extract_parents', False))
+                self.app.shard_defs.set(settings.get('shard_defs', SHARD_SIZE_CHOICES[0]))
                 self.app.include_languages.set(settings.get('include_languages', False))
             
             # Refresh all listboxes
             self.refresh_all_listboxes()
+            self.app.schedule_shadow_build()
             
-            messagebox.showinfo("Success", f"Mod data imported from:\n{filename}")
+            message = f"Mod data imported from:\n{filename}"
+            if duplicates:
+                message += f"\n\nWarning: {len(duplicates)} defNames are used more than once:\n"
+                for content_type, record, existing_type in duplicates[:5]:
+                    message += (f"- {record['defName']} ({CONTENT_LABELS[content_type]}, "
+                                f"already used by a {CONTENT_LABELS[existing_type]})\n")
+                if len(duplicates) > 5:
+                    message += f"... and {len(duplicates) - 5} more"
+                messagebox.showwarning("Imported With Duplicates", message)
+            else:
+                messagebox.showinfo("Success", message)
             
         except Exception as e:
             messagebox.showerror("Error", f"Failed to import mod data:\n{str(e)}")
@@ -346,9 +483,11 @@ class FileUtils:
         self.app.workbenches.clear()
         self.app.research.clear()
         self.app.recipes.clear()
+        self.app.def_index.clear()
         
         # Clear listboxes
         self.refresh_all_listboxes()
+        self.app.schedule_shadow_build()
     
     def refresh_all_listboxes(self):
         """Refresh all content listboxes"""